@@ -0,0 +1,123 @@
+import os
+import string
+from manifiesto import hash_fichero
+
+
+# ALMACÉN DE MP3 POR CONTENIDO
+#
+# Cada MP3 distinto que llega al servidor se guarda una sola vez en
+# <carpeta>/<2 primeras letras del hash>/<sha256>, y los ficheros de los
+# usuarios (datos_server/<usuario>/<nombre>.mp3) son enlaces duros a ese
+# blob. El número de enlaces del blob (st_nlink) es su contador de
+# referencias: 1 quiere decir que ya no lo usa ningún usuario y se puede
+# borrar (recoger).
+#
+# Los blobs nunca se modifican: todo el que escribe un MP3 lo hace en un
+# .part y lo pone en su sitio con os.replace, que cambia la entrada del
+# directorio y no el fichero enlazado. Todas las operaciones son de
+# sistema de ficheros (link, replace), así que sirven igual con varios
+# procesos trabajadores.
+#
+# Si el sistema de ficheros no admite enlaces duros, los MP3 se quedan como
+# copias privadas de cada usuario (sin deduplicar).
+
+
+def es_hash(texto):
+    return len(texto) == 64 and all(c in string.hexdigits for c in texto)
+
+
+class AlmacenBlobs:
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+
+    def ruta(self, hash_mp3):
+        return os.path.join(self.carpeta, hash_mp3[:2], hash_mp3)
+
+    def _enlazar_en(self, blob, destino):
+        """Hace que 'destino' sea un enlace al blob (sustituyéndolo de golpe
+        si ya existía)."""
+        temporal = destino + ".blob"
+        os.link(blob, temporal)
+        try:
+            os.replace(temporal, destino)
+        except OSError:
+            os.remove(temporal)
+            raise
+
+    def enlazar(self, hash_mp3, destino):
+        """Pone en 'destino' el MP3 con ese hash si el almacén lo tiene.
+        Devuelve False si no lo tiene (hay que subirlo)."""
+        if not es_hash(hash_mp3):
+            return False
+        try:
+            self._enlazar_en(self.ruta(hash_mp3), destino)
+        except OSError:
+            return False
+        return True
+
+    def guardar(self, ruta, hash_mp3=None):
+        """Incorpora al almacén un MP3 de un usuario. Si ya había un blob con
+        el mismo contenido, el fichero pasa a ser un enlace a él. Sin
+        'hash_mp3' se calcula (nunca hay que fiarse del que mande el
+        cliente: otro usuario podría recibir ese blob)."""
+        if hash_mp3 is None:
+            hash_mp3 = hash_fichero(ruta)
+        blob = self.ruta(hash_mp3)
+
+        try:
+            if os.path.samefile(blob, ruta):
+                return hash_mp3
+            self._enlazar_en(blob, ruta)
+            return hash_mp3
+        except FileNotFoundError:
+            pass  # Contenido nuevo (o el blob se ha recogido entretanto)
+        except OSError:
+            return hash_mp3  # Sin enlaces duros: se queda como copia privada
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(ruta, blob)
+        except FileExistsError:
+            # Otra sesión ha guardado el mismo contenido a la vez
+            try:
+                self._enlazar_en(blob, ruta)
+            except OSError:
+                pass
+        except OSError:
+            pass
+        return hash_mp3
+
+    def incorporar(self, carpeta, manifiesto):
+        """Pasa al almacén los MP3 de una carpeta que aún no están en él
+        (los de antes de existir el almacén). El manifiesto lo ha calculado
+        el propio servidor, así que sus hashes son de fiar."""
+        for nombre, info in manifiesto.items():
+            ruta = os.path.join(carpeta, nombre)
+            try:
+                if os.stat(ruta).st_nlink > 1:
+                    continue
+            except OSError:
+                continue
+            self.guardar(ruta, info["hash"])
+
+    def recoger(self):
+        """Borra los blobs que ya no usa ningún usuario. Devuelve
+        (blobs que quedan, bytes que ocupan, bytes liberados)."""
+        quedan = ocupados = liberados = 0
+        if not os.path.isdir(self.carpeta):
+            return quedan, ocupados, liberados
+
+        for prefijo in os.listdir(self.carpeta):
+            subcarpeta = os.path.join(self.carpeta, prefijo)
+            if not os.path.isdir(subcarpeta):
+                continue
+            for nombre in os.listdir(subcarpeta):
+                blob = os.path.join(subcarpeta, nombre)
+                st = os.stat(blob)
+                if st.st_nlink <= 1:
+                    os.remove(blob)
+                    liberados += st.st_size
+                else:
+                    quedan += 1
+                    ocupados += st.st_size
+        return quedan, ocupados, liberados
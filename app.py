@@ -1,6 +1,11 @@
+import os
 from musica.plataforma import PlataformaMusical
 from musica.cancion import Cancion
 from musica.lista_reproduccion import ListaReproduccion
+from musica.importador import importar_carpeta, resumen
+
+# Resultados que se muestran como mucho en una búsqueda
+MAX_RESULTADOS = 20
 
 
 def pedir_int(msg: str) -> int:
@@ -12,14 +17,17 @@ def pedir_int(msg: str) -> int:
             print("Por favor, introduce un número válido.")
 
 
-def menu_canciones(plataforma):
-    """Menú para gestionar canciones en la plataforma."""
+def menu_canciones(plataforma, carpeta_mp3=None):
+    """Menú para gestionar canciones en la plataforma.
+    Si se da carpeta_mp3, los MP3 importados se ponen en esa carpeta."""
     while True:
         print('\n--- Gestión de canciones ---')
         print('1) Añadir canción')
         print('2) Modificar canción')
         print('3) Eliminar canción')
         print('4) Listar canciones')
+        print('5) Buscar canciones')
+        print('6) Importar carpeta de MP3')
         print('0) Volver')
         opc = pedir_int('> ')
 
@@ -53,7 +61,7 @@ def menu_canciones(plataforma):
                 break
 
             # Buscar la canción seleccionada
-            cancion = next((c for c in plataforma.canciones if c.id == id_cancion), None)
+            cancion = plataforma.obtener_cancion(id_cancion)
             if not cancion:
                 print('No se encontró una canción con ese ID.')
                 continue
@@ -93,7 +101,7 @@ def menu_canciones(plataforma):
                 break
             
             # Buscar la canción seleccionada
-            cancion = next((c for c in plataforma.canciones if c.id == id_cancion), None)
+            cancion = plataforma.obtener_cancion(id_cancion)
             if not cancion:
                 print('No se encontró una canción con ese ID.')
                 continue
@@ -112,6 +120,41 @@ def menu_canciones(plataforma):
                 for c in plataforma.canciones:
                     print(f'{c.id}) {c}')
 
+        elif opc == 5:
+            # Buscar canciones
+            print('\n--- Buscar canciones ---')
+            texto = input('Buscar (título, artista o género; enter para todas): ')
+            minimo_txt = input('Duración mínima en segundos (enter para no filtrar): ').strip()
+            maximo_txt = input('Duración máxima en segundos (enter para no filtrar): ').strip()
+            print('Ordenar por: 1) Título  2) Artista  3) Duración')
+            orden = {'2': 'artista', '3': 'duracion'}.get(input('> ').strip(), 'titulo')
+
+            try:
+                duracion_min = int(minimo_txt) if minimo_txt else None
+                duracion_max = int(maximo_txt) if maximo_txt else None
+            except ValueError:
+                print('Por favor, introduce un número válido.')
+                continue
+
+            resultados = plataforma.buscar(texto, duracion_min, duracion_max, orden, limite=MAX_RESULTADOS + 1)
+            if not resultados:
+                print('No se encontró ninguna canción.')
+            for c in resultados[:MAX_RESULTADOS]:
+                print(f'{c.id}) {c}')
+            if len(resultados) > MAX_RESULTADOS:
+                print(f'(Solo se muestran las {MAX_RESULTADOS} primeras; afina la búsqueda para ver más)')
+
+        elif opc == 6:
+            # Importar una carpeta de MP3
+            print('\n--- Importar carpeta de MP3 ---')
+            carpeta = input('Carpeta: ').strip()
+            if not os.path.isdir(carpeta):
+                print('No existe esa carpeta.')
+                continue
+
+            print('Importando...')
+            print(resumen(importar_carpeta(plataforma, carpeta, carpeta_mp3)))
+
         elif opc == 0:
             break
 
@@ -188,7 +231,7 @@ def menu_listas(plataforma):
                 print('La lista está vacía.')
             else:
                 for id_c in lista.canciones:
-                    cancion = next((c for c in plataforma.canciones if c.id == id_c), None)
+                    cancion = plataforma.obtener_cancion(id_c)
                     if cancion:
                         print(f'{id_c}) {cancion}')
 
@@ -223,7 +266,7 @@ def menu_listas(plataforma):
             if id_cancion == 0:
                 continue
 
-            if lista.anadir_cancion(id_cancion):
+            if plataforma.anadir_a_lista(lista.nombre, id_cancion):
                 print('Añadida')
             else:
                 print('La canción ya está en la lista o el ID no es válido.')
@@ -254,7 +297,7 @@ def menu_listas(plataforma):
 
             print('\n--- Canciones en la lista ---')
             for id_c in lista.canciones:
-                cancion = next((c for c in plataforma.canciones if c.id == id_c), None)
+                cancion = plataforma.obtener_cancion(id_c)
                 if cancion:
                     print(f'{id_c}) {cancion}')
 
@@ -262,7 +305,7 @@ def menu_listas(plataforma):
             if id_cancion == 0:
                 continue
 
-            if lista.quitar_cancion(id_cancion):
+            if plataforma.quitar_de_lista(lista.nombre, id_cancion):
                 print('Eliminada')
             else:
                 print('Esa canción no estaba en la lista.')
@@ -302,12 +345,14 @@ def menu_reproduccion(plataforma):
             print('La lista está vacía.')
             continue
 
+        # Ids en orden para poder ir por posición
+        ids_lista = list(lista.canciones)
         indice_cancion = 0
 
         while True:
             # Obtener canción actual
-            id_cancion = lista.canciones[indice_cancion]
-            cancion = next((c for c in plataforma.canciones if c.id == id_cancion), None)
+            id_cancion = ids_lista[indice_cancion]
+            cancion = plataforma.obtener_cancion(id_cancion)
 
             if not cancion:
                 print('Error: una de las canciones de la lista no existe.')
@@ -322,12 +367,12 @@ def menu_reproduccion(plataforma):
 
             if opcion == 'n':
                 indice_cancion += 1
-                if indice_cancion >= len(lista.canciones):
+                if indice_cancion >= len(ids_lista):
                     indice_cancion = 0  # Vuelve al inicio
             elif opcion == 'p':
                 indice_cancion -= 1
                 if indice_cancion < 0:
-                    indice_cancion = len(lista.canciones) - 1  # Vuelve al final
+                    indice_cancion = len(ids_lista) - 1  # Vuelve al final
             elif opcion == 's':
                 break
             else:
@@ -0,0 +1,124 @@
+"""Mide la búsqueda de canciones (PlataformaMusical.buscar) en un catálogo de
+N canciones frente a recorrer todas las canciones en cada búsqueda:
+- palabra: una palabra completa del título
+- prefijo: el principio de un artista (como al buscar mientras se escribe)
+- rango: canciones entre dos duraciones
+- combinada: palabra + prefijo + rango
+- rango_dur: un rango amplio de duraciones ordenado por duración
+- todas: sin texto ni filtros (lo que muestra el menú al buscar sin escribir nada)
+- una_letra: una sola letra, que tienen casi todas las canciones
+Todas menos rango_dur piden las --limite primeras por título. Se da la mediana de
+--repeticiones búsquedas distintas de cada tipo y lo que tarda en
+construirse el índice (se construye en las primeras búsquedas).
+
+Uso:
+    python benchmarks/busqueda_canciones.py [--canciones 1000000] [--limite 20] [--repeticiones 50]
+"""
+import argparse
+import heapq
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musica.buscador import ORDENES, palabras, palabras_cancion
+from musica.plataforma import PlataformaMusical
+
+TIPOS = ("palabra", "prefijo", "rango", "combinada", "rango_dur", "todas", "una_letra")
+GENEROS = ["Rock", "Pop", "Jazz", "Clásica", "Electrónica", "Hip hop", "Reggae", "Metal"]
+
+
+def biblioteca(num_canciones):
+    return {
+        "canciones": [
+            {"id": i, "titulo": f"Canción {i % 50000} parte {i % 7}", "artista": f"Artista{i % 20000}",
+             "duracion": 60 + (i * 37) % 540, "genero": GENEROS[i % len(GENEROS)], "archivo_mp3": f"c{i}.mp3"}
+            for i in range(1, num_canciones + 1)
+        ],
+        "listas": [],
+    }
+
+
+def buscar_lineal(plataforma, texto, duracion_min=None, duracion_max=None, orden="titulo", descendente=False,
+                  limite=None):
+    """La misma búsqueda recorriendo todo el catálogo."""
+    buscadas = palabras(texto)
+    ultima = buscadas.pop() if buscadas else None
+    resultado = []
+    for c in plataforma.canciones:
+        if duracion_min is not None and c.duracion < duracion_min:
+            continue
+        if duracion_max is not None and c.duracion > duracion_max:
+            continue
+        suyas = palabras_cancion(c)
+        if all(p in suyas for p in buscadas) and (ultima is None or any(p.startswith(ultima) for p in suyas)):
+            resultado.append(c)
+    elegir = heapq.nlargest if descendente else heapq.nsmallest
+    return elegir(limite, resultado, key=ORDENES[orden])
+
+
+def consultas(tipo, repeticiones):
+    for i in range(repeticiones):
+        if tipo == "palabra":
+            yield (str((i * 997) % 50000),), {}
+        elif tipo == "prefijo":
+            yield (f"artista{(i * 131) % 2000}",), {}
+        elif tipo == "rango":
+            minimo = 60 + (i * 11) % 500
+            yield ("",), {"duracion_min": minimo, "duracion_max": minimo + 5}
+        elif tipo == "rango_dur":
+            minimo = 60 + (i * 11) % 300
+            yield ("",), {"duracion_min": minimo, "duracion_max": minimo + 240, "orden": "duracion"}
+        elif tipo == "todas":
+            yield ("",), {"descendente": i % 2 == 1}
+        elif tipo == "una_letra":
+            yield ("acpr"[i % 4],), {}
+        else:
+            minimo = 60 + (i * 11) % 400
+            yield (f"parte {i % 7} artista{i % 20}",), {"duracion_min": minimo, "duracion_max": minimo + 120}
+
+
+def mediana(funcion, tipo, repeticiones):
+    tiempos = []
+    for args, kwargs in consultas(tipo, repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args, **kwargs)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=1000000)
+    parser.add_argument("--limite", type=int, default=20, help="resultados de cada búsqueda")
+    parser.add_argument("--repeticiones", type=int, default=50, help="búsquedas de cada tipo")
+    parser.add_argument("--repeticiones-lineal", type=int, default=3,
+                        help="búsquedas de cada tipo recorriendo todo (son lentas)")
+    args = parser.parse_args()
+
+    plataforma = PlataformaMusical.from_dict(biblioteca(args.canciones), "datos")
+
+    inicio = time.perf_counter()
+    plataforma.buscar("canción", limite=1)
+    plataforma.buscar("", limite=1)  # la lista por título se ordena en la primera que la usa
+    print(f"{args.canciones} canciones; índice construido en {time.perf_counter() - inicio:.1f} s")
+
+    # Las dos versiones tienen que dar lo mismo
+    for tipo in TIPOS:
+        for consulta, kwargs in consultas(tipo, 2):
+            assert plataforma.buscar(*consulta, limite=args.limite, **kwargs) == \
+                buscar_lineal(plataforma, *consulta, limite=args.limite, **kwargs)
+
+    print(f"{'búsqueda':10s} {'índice':>12s} {'recorrido':>12s}   (mediana, ms)")
+    for tipo in TIPOS:
+        con_indice = mediana(lambda *a, **k: plataforma.buscar(*a, limite=args.limite, **k),
+                             tipo, args.repeticiones)
+        lineal = mediana(lambda *a, **k: buscar_lineal(plataforma, *a, limite=args.limite, **k),
+                         tipo, args.repeticiones_lineal)
+        print(f"{tipo:10s} {con_indice * 1000:12.2f} {lineal * 1000:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
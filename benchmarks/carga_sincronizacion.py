@@ -0,0 +1,375 @@
+"""Generador de carga para el servidor de sincronización.
+
+Lanza N usuarios sintéticos a la vez contra un servidor.py y cada uno
+repite sesiones completas del protocolo de cliente.py sin menús:
+LOGIN, descarga de la metadata (METADATA_SIZE) y de los MP3 (NUM_MP3),
+unas cuantas ediciones, subida de la metadata (UPLOAD_OPS o
+UPLOAD_METADATA), subida de los MP3 nuevos y LOGOUT.
+
+Antes de medir, cada usuario sube una biblioteca de --canciones canciones
+con --mp3s ficheros de --mp3-kb KB (--compartidos de ellos iguales para
+todos los usuarios, como las canciones populares). Después, en cada sesión edita
+--ediciones canciones y añade --nuevas canciones con su MP3. Con
+--sin-cache cada sesión empieza con la carpeta local vacía (como un
+dispositivo nuevo) y descarga todos los MP3.
+
+Se mide en el cliente la latencia de cada fase y de la sesión entera y se
+muestran las sesiones por segundo y los percentiles p50/p95/p99. Con
+--json se escribe además el resultado (y las estadísticas del propio
+servidor, orden STATS, si se ha arrancado con --stats-publicas; con
+--lanzar se arranca así) en un fichero, o en la salida estándar con '-',
+para poder comparar entre versiones.
+
+Uso:
+    python benchmarks/carga_sincronizacion.py --lanzar [--modo hilos] [--usuarios 50] [--sesiones 5]
+    python benchmarks/carga_sincronizacion.py --puerto 9999 --json resultado.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import estadisticas
+from codificacion import codificar_metadata, decodificar_metadata, capacidades_de_etiqueta, cabecera_tam, leer_cabecera_tam
+from manifiesto import calcular_manifiesto, ficheros_distintos
+from operaciones import aplicar_operaciones, huella
+from protocolo import Conexion, ErrorProtocolo, enviar_mp3, recibir_mp3
+
+# Fases medidas en el cliente (más la sesión entera)
+FASES = ("login", "descarga_metadata", "descarga_mp3", "subida_metadata", "subida_mp3", "logout", "sesion")
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) de una lista ordenada, por el rango más cercano."""
+    if not valores:
+        return 0.0
+    i = min(len(valores) - 1, max(0, int(round(p / 100 * len(valores))) - 1))
+    return valores[i]
+
+
+class UsuarioSintetico:
+    """Un usuario con su carpeta local que repite sesiones contra el servidor."""
+
+    def __init__(self, nombre, carpeta, args):
+        self.nombre = nombre
+        self.carpeta = carpeta
+        self.args = args
+        self.siguiente_mp3 = 0
+        os.makedirs(carpeta, exist_ok=True)
+
+    def _nuevo_mp3(self, compartido=None):
+        """Crea un MP3 aleatorio, o el número 'compartido' de los que tienen
+        todos los usuarios (mismo nombre y contenido)."""
+        if compartido is not None:
+            nombre = f"compartido_{compartido}.mp3"
+            contenido = random.Random(compartido).randbytes(self.args.mp3_kb * 1024)
+        else:
+            nombre = f"{self.nombre}_{self.siguiente_mp3}.mp3"
+            self.siguiente_mp3 += 1
+            contenido = os.urandom(self.args.mp3_kb * 1024)
+        with open(os.path.join(self.carpeta, nombre), "wb") as f:
+            f.write(contenido)
+        return nombre
+
+    def operaciones_iniciales(self):
+        ops = []
+        for i in range(1, self.args.canciones + 1):
+            if i <= self.args.compartidos:
+                archivo = self._nuevo_mp3(compartido=i)
+            elif i <= self.args.mp3s:
+                archivo = self._nuevo_mp3()
+            else:
+                archivo = f"sin_fichero_{i}.mp3"
+            ops.append({"op": "registrar_cancion", "id": i, "titulo": f"Canción {i}",
+                        "artista": f"Artista {i % 50}", "duracion": 180 + i % 120,
+                        "genero": "Rock", "archivo_mp3": archivo})
+        ops.append({"op": "crear_lista", "nombre": "Favoritas"})
+        for i in range(1, min(self.args.canciones, 20) + 1):
+            ops.append({"op": "anadir_a_lista", "nombre": "Favoritas", "id": i})
+        return ops
+
+    def operaciones_sesion(self, data, numero):
+        ops = []
+        canciones = data["canciones"]
+        for k in range(min(self.args.ediciones, len(canciones))):
+            c = canciones[(numero * self.args.ediciones + k) % len(canciones)]
+            ops.append(dict(c, op="editar_cancion", titulo=f"{c['titulo'].split(' #')[0]} #{numero}"))
+        siguiente_id = max((c["id"] for c in canciones), default=0) + 1
+        for k in range(self.args.nuevas):
+            ops.append({"op": "registrar_cancion", "id": siguiente_id + k, "titulo": f"Nueva {numero}.{k}",
+                        "artista": "Sintético", "duracion": 200, "genero": "Pop",
+                        "archivo_mp3": self._nuevo_mp3()})
+        return ops
+
+    def sesion(self, numero, tiempos, inicial=False):
+        """Una sesión completa. Anota en 'tiempos' (fase -> segundos) lo que
+        tarda cada fase y devuelve los bytes (recibidos, enviados)."""
+        args = self.args
+        if args.sin_cache and not inicial:
+            for nombre in os.listdir(self.carpeta):
+                os.remove(os.path.join(self.carpeta, nombre))
+
+        inicio_sesion = marca = time.perf_counter()
+
+        def fase(nombre):
+            nonlocal marca
+            ahora = time.perf_counter()
+            tiempos[nombre] = ahora - marca
+            marca = ahora
+
+        con = Conexion(socket.create_connection((args.host, args.puerto)))
+        try:
+            # 1. LOGIN
+            con.enviar_linea(f"LOGIN:{self.nombre}:{args.caps}" if args.caps else f"LOGIN:{self.nombre}")
+            resp = con.leer_linea()
+            if not resp.startswith("OK"):
+                raise Exception(f"LOGIN rechazado: {resp}")
+            confirmadas = set(resp.split(":", 1)[1].split(",")) if ":" in resp else set()
+            fase("login")
+
+            # 2. METADATA
+            cabecera = con.leer_linea()
+            version_base = None
+            if cabecera.startswith("TOKEN:"):
+                cabecera = con.leer_linea()  # no se usan conexiones extra
+            if cabecera.startswith("VERSION:"):
+                version_base = int(cabecera.split(":")[1])
+                cabecera = con.leer_linea()
+            tam, etiqueta = leer_cabecera_tam(cabecera, "METADATA_SIZE")
+            data = decodificar_metadata(con.leer_exacto(tam), etiqueta)
+            capacidades_servidor = capacidades_de_etiqueta(etiqueta) | (confirmadas & {"OPS"})
+            fase("descarga_metadata")
+
+            # 3. MP3
+            manifiesto_servidor = {}
+            if "DELTA" in confirmadas:
+                manifiesto_servidor = json.loads(con.leer_datos("MANIFEST_SIZE").decode())
+                pedidos = ficheros_distintos(manifiesto_servidor, calcular_manifiesto(self.carpeta))
+                con.enviar_datos("PEDIR_SIZE", json.dumps(dict.fromkeys(pedidos, 0)).encode())
+            num_mp3 = int(con.leer_linea().split(":")[1])
+            for _ in range(num_mp3):
+                recibir_mp3(con, self.carpeta)
+            fase("descarga_mp3")
+
+            # Edición (no se mide: es el tiempo del usuario en el menú)
+            ops = self.operaciones_iniciales() if inicial else self.operaciones_sesion(data, numero)
+            data = aplicar_operaciones(data, ops)
+            if args.pausa_ms:
+                time.sleep(args.pausa_ms / 1000)
+            marca = time.perf_counter()
+
+            # 4. SUBIDA DE LA METADATA
+            solo_operaciones = "OPS" in capacidades_servidor and version_base is not None
+            while True:
+                if solo_operaciones:
+                    paquete = {"ops": ops, "huella": huella(data)}
+                    cuerpo, etiqueta = codificar_metadata(paquete, capacidades_servidor - {"BIN"})
+                    con.enviar_linea("UPLOAD_OPS")
+                    con.enviar_linea(f"BASE:{version_base}")
+                    con.enviar(cabecera_tam("OPS_SIZE", cuerpo, etiqueta) + cuerpo)
+                else:
+                    cuerpo, etiqueta = codificar_metadata(data, capacidades_servidor)
+                    con.enviar_linea("UPLOAD_METADATA")
+                    if version_base is not None:
+                        con.enviar_linea(f"BASE:{version_base}")
+                    con.enviar(cabecera_tam("SIZE", cuerpo, etiqueta) + cuerpo)
+                if version_base is None:
+                    break
+                respuesta = con.leer_linea().split(":")[0]
+                if respuesta == "RESEND":
+                    solo_operaciones = False
+                    continue
+                if respuesta == "CONFLICT":
+                    # Cada usuario sintético tiene un solo dispositivo: no debería pasar
+                    con.leer_datos("CONFLICT_SIZE")
+                    con.enviar_linea("DISCARD")
+                break
+            fase("subida_metadata")
+
+            # 5. SUBIDA DE LOS MP3 NUEVOS
+            manifiesto_local = calcular_manifiesto(self.carpeta)
+            if "DELTA" in confirmadas:
+                mp3s = ficheros_distintos(manifiesto_local, manifiesto_servidor)
+            else:
+                mp3s = [op["archivo_mp3"] for op in ops
+                        if op["op"] == "registrar_cancion" and op["archivo_mp3"] in manifiesto_local]
+            if "BLOBS" in confirmadas:
+                oferta = {nombre: manifiesto_local[nombre]["hash"] for nombre in mp3s}
+                con.enviar_datos("OFERTA_SIZE", json.dumps(oferta).encode())
+                mp3s = json.loads(con.leer_datos("FALTAN_SIZE").decode())
+            con.enviar_linea(f"NUM_MP3:{len(mp3s)}")
+            for mp3 in mp3s:
+                enviar_mp3(con, os.path.join(self.carpeta, mp3))
+            fase("subida_mp3")
+
+            # 6. LOGOUT (hasta que el servidor cierra la conexión)
+            con.enviar_linea("LOGOUT")
+            while con.sock.recv(4096):
+                pass
+            fase("logout")
+        finally:
+            con.cerrar()
+
+        tiempos["sesion"] = time.perf_counter() - inicio_sesion
+        return con.bytes_recibidos, con.bytes_enviados
+
+
+def lanzar_servidor(args, carpeta):
+    """Arranca un servidor.py local en 'carpeta' y espera a que acepte conexiones."""
+    orden = [sys.executable, os.path.join(RAIZ, "servidor.py"), "--puerto", str(args.puerto),
+             "--modo", args.modo, "--procesos", str(args.procesos), "--max-sesiones", str(max(1000, args.usuarios)),
+             "--stats-publicas"]
+    proceso = subprocess.Popen(orden, cwd=carpeta, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((args.host, args.puerto)).close()
+            return proceso
+        except OSError:
+            time.sleep(0.1)
+    proceso.kill()
+    raise Exception("El servidor no ha arrancado")
+
+
+def medir(args, carpeta_clientes):
+    usuarios = [UsuarioSintetico(f"carga{u}", os.path.join(carpeta_clientes, f"carga{u}"), args)
+                for u in range(args.usuarios)]
+
+    # Preparación (no se mide su latencia): cada usuario sube su biblioteca inicial
+    subidos_preparacion = 0
+    for usuario in usuarios:
+        subidos_preparacion += usuario.sesion(0, {}, inicial=True)[1]
+
+    muestras = {fase: [] for fase in FASES}
+    errores = {}
+    bytes_totales = [0, 0]
+    cerrojo = threading.Lock()
+    salida = threading.Barrier(args.usuarios + 1)
+
+    def trabajar(usuario):
+        propias = {fase: [] for fase in FASES}
+        propios_errores = {}
+        recibidos = enviados = 0
+        salida.wait()
+        for numero in range(1, args.sesiones + 1):
+            tiempos = {}
+            try:
+                r, e = usuario.sesion(numero, tiempos)
+                recibidos += r
+                enviados += e
+            except Exception as e:
+                tipo = type(e).__name__
+                propios_errores[tipo] = propios_errores.get(tipo, 0) + 1
+                continue
+            for fase, segundos in tiempos.items():
+                propias[fase].append(segundos)
+        with cerrojo:
+            for fase in FASES:
+                muestras[fase].extend(propias[fase])
+            for tipo, n in propios_errores.items():
+                errores[tipo] = errores.get(tipo, 0) + n
+            bytes_totales[0] += recibidos
+            bytes_totales[1] += enviados
+
+    hilos = [threading.Thread(target=trabajar, args=(u,)) for u in usuarios]
+    for hilo in hilos:
+        hilo.start()
+    salida.wait()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    fases = {}
+    for fase in FASES:
+        valores = sorted(muestras[fase])
+        fases[fase] = {
+            "n": len(valores),
+            "media_ms": round(sum(valores) / len(valores) * 1000, 3) if valores else 0,
+            "p50_ms": round(percentil(valores, 50) * 1000, 3),
+            "p95_ms": round(percentil(valores, 95) * 1000, 3),
+            "p99_ms": round(percentil(valores, 99) * 1000, 3),
+            "max_ms": round(valores[-1] * 1000, 3) if valores else 0,
+        }
+
+    sesiones = len(muestras["sesion"])
+    return {
+        "duracion_s": round(duracion, 3),
+        "sesiones": sesiones,
+        "sesiones_por_s": round(sesiones / duracion, 2) if duracion else 0,
+        "mb_descargados": round(bytes_totales[0] / 1e6, 3),
+        "mb_subidos": round(bytes_totales[1] / 1e6, 3),
+        "mb_subidos_preparacion": round(subidos_preparacion / 1e6, 3),
+        "errores": errores,
+        "fases": fases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--puerto", type=int, default=9999)
+    parser.add_argument("--lanzar", action="store_true",
+                        help="arrancar un servidor.py propio en una carpeta temporal")
+    parser.add_argument("--modo", choices=["hilos", "asyncio"], default="hilos",
+                        help="(con --lanzar) motor del servidor")
+    parser.add_argument("--procesos", type=int, default=1, help="(con --lanzar) procesos trabajadores del servidor")
+    parser.add_argument("--usuarios", type=int, default=50, help="usuarios simultáneos")
+    parser.add_argument("--sesiones", type=int, default=5, help="sesiones de cada usuario")
+    parser.add_argument("--canciones", type=int, default=200, help="canciones de cada biblioteca")
+    parser.add_argument("--mp3s", type=int, default=5, help="canciones con fichero MP3")
+    parser.add_argument("--compartidos", type=int, default=0,
+                        help="cuántos de esos MP3 son los mismos para todos los usuarios")
+    parser.add_argument("--mp3-kb", type=int, default=256, help="tamaño de cada MP3")
+    parser.add_argument("--ediciones", type=int, default=2, help="canciones editadas por sesión")
+    parser.add_argument("--nuevas", type=int, default=1, help="canciones (con MP3) añadidas por sesión")
+    parser.add_argument("--pausa-ms", type=float, default=0, help="tiempo de edición entre descarga y subida")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="cada sesión empieza sin MP3 locales y los descarga todos")
+    parser.add_argument("--caps", default="DELTA,ZLIB,BIN,VERSION,OPS,BLOBS",
+                        help="capacidades anunciadas en el LOGIN ('' para un cliente antiguo)")
+    parser.add_argument("--json", default=None, help="fichero donde escribir el resultado ('-' = salida estándar)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        proceso = lanzar_servidor(args, tmp) if args.lanzar else None
+        try:
+            resultado = medir(args, os.path.join(tmp, "clientes"))
+            try:
+                resultado["servidor"] = estadisticas.consultar(args.host, args.puerto)
+            except (OSError, ValueError, ErrorProtocolo):
+                resultado["servidor"] = None  # servidor sin orden STATS o sin --stats-publicas
+        finally:
+            if proceso:
+                proceso.terminate()
+                proceso.wait()
+
+    resultado["parametros"] = {k: v for k, v in vars(args).items() if k != "json"}
+
+    print(f"{resultado['sesiones']} sesiones en {resultado['duracion_s']} s: "
+          f"{resultado['sesiones_por_s']} sesiones/s, {resultado['mb_descargados']} MB descargados, "
+          f"{resultado['mb_subidos']} MB subidos (preparación: {resultado['mb_subidos_preparacion']} MB)")
+    if resultado["errores"]:
+        print(f"Errores: {resultado['errores']}")
+    print(f"{'fase':18s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'máx ms':>9s}")
+    for fase, datos in resultado["fases"].items():
+        print(f"{fase:18s} {datos['p50_ms']:9.2f} {datos['p95_ms']:9.2f} {datos['p99_ms']:9.2f} {datos['max_ms']:9.2f}")
+
+    if args.json == "-":
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Mide las operaciones del catálogo de PlataformaMusical según el tamaño de
+la biblioteca:
+- cargar: from_dict de una biblioteca con N canciones
+- registrar: --lote canciones nuevas (comprobación de duplicados e id)
+- editar / eliminar / obtener: --lote canciones buscadas por id
+- listas: --lote listas creadas y buscadas por nombre
+Las bibliotecas tienen --listas listas de --por-lista canciones cada una
+(eliminar una canción también la quita de sus listas).
+
+Con tamaños hasta --max-antiguo se mide también la versión anterior, que
+recorría todas las canciones (o listas) en cada operación.
+
+Uso:
+    python benchmarks/catalogo_plataforma.py [--tamanos 1000,10000,100000,500000] [--lote 1000]
+                                             [--listas 20] [--por-lista 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musica.cancion import Cancion
+from musica.plataforma import PlataformaMusical
+
+
+class ListaAntigua:
+    """ListaReproduccion con los ids en una lista, como era antes."""
+
+    def __init__(self, nombre, canciones=()):
+        self.nombre = nombre
+        self.canciones = list(canciones)
+
+
+class PlataformaAntigua:
+    """Los mismos métodos tal y como eran antes de los índices."""
+
+    def __init__(self, data, base_path):
+        self.canciones = [Cancion.from_dict(c, base_path) for c in data["canciones"]]
+        self.listas = [ListaAntigua(l["nombre"], l["canciones"]) for l in data["listas"]]
+
+    def registrar_cancion(self, titulo, artista, duracion, genero, archivo):
+        for c in self.canciones:
+            if c.titulo == titulo and c.artista == artista:
+                return False
+        next_id = max((c.id for c in self.canciones), default=0) + 1
+        self.canciones.append(Cancion(next_id, titulo, artista, duracion, genero, archivo))
+        return True
+
+    def obtener_cancion(self, id):
+        return next((c for c in self.canciones if c.id == id), None)
+
+    def editar_cancion(self, id, titulo, artista, duracion, genero, archivo):
+        for c in self.canciones:
+            if c.id == id:
+                c.titulo, c.artista, c.duracion, c.genero, c.archivo_mp3 = titulo, artista, duracion, genero, archivo
+                return True
+        return False
+
+    def eliminar_cancion(self, id):
+        for c in self.canciones:
+            if c.id == id:
+                self.canciones.remove(c)
+                for lista in self.listas:
+                    if id in lista.canciones:
+                        lista.canciones.remove(id)
+                return True
+        return False
+
+    def crear_lista(self, nombre):
+        for lista in self.listas:
+            if lista.nombre.lower() == nombre.lower():
+                return False
+        self.listas.append(ListaAntigua(nombre))
+        return True
+
+    def obtener_lista(self, nombre):
+        for lista in self.listas:
+            if lista.nombre.lower() == nombre.lower():
+                return lista
+        return None
+
+
+def biblioteca(num_canciones, num_listas, por_lista):
+    return {
+        "canciones": [
+            {"id": i, "titulo": f"Cancion {i}", "artista": f"Artista {i % 1000}",
+             "duracion": 180 + i % 120, "genero": "Rock", "archivo_mp3": f"c{i}.mp3"}
+            for i in range(1, num_canciones + 1)
+        ],
+        "listas": [{"nombre": f"Lista {i}",
+                    "canciones": [1 + (i * por_lista + j) % num_canciones for j in range(min(por_lista, num_canciones))]}
+                   for i in range(num_listas)],
+    }
+
+
+def medir(funcion):
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+def medir_plataforma(crear, data, lote):
+    """Segundos de cada operación sobre una plataforma con 'data'."""
+    n = len(data["canciones"])
+    ids = [1 + (i * 7919) % n for i in range(lote)]  # repartidos por todo el catálogo
+    tiempos = {}
+    plataforma = None
+
+    def cargar():
+        nonlocal plataforma
+        plataforma = crear(data, "datos")
+
+    tiempos["cargar"] = medir(cargar)
+    tiempos["registrar"] = medir(lambda: [
+        plataforma.registrar_cancion(f"Nueva {i}", "Importada", 200, "Pop", f"n{i}.mp3") for i in range(lote)])
+    tiempos["obtener"] = medir(lambda: [plataforma.obtener_cancion(i) for i in ids])
+    tiempos["editar"] = medir(lambda: [
+        plataforma.editar_cancion(i, f"Editada {i}", "Otro", 100, "Jazz", "e.mp3") for i in ids])
+    tiempos["listas"] = medir(lambda: [
+        (plataforma.crear_lista(f"Nueva lista {i}"), plataforma.obtener_lista(f"NUEVA LISTA {i // 2}"))
+        for i in range(lote)])
+    tiempos["eliminar"] = medir(lambda: [plataforma.eliminar_cancion(i) for i in ids])
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tamanos", default="1000,10000,100000,500000",
+                        help="canciones de cada biblioteca, separadas por comas")
+    parser.add_argument("--lote", type=int, default=1000, help="operaciones de cada tipo")
+    parser.add_argument("--listas", type=int, default=20, help="listas de cada biblioteca")
+    parser.add_argument("--por-lista", type=int, default=50, help="canciones de cada lista")
+    parser.add_argument("--max-antiguo", type=int, default=100000,
+                        help="tamaño máximo con el que se mide también la versión anterior")
+    args = parser.parse_args()
+
+    operaciones = ("cargar", "registrar", "obtener", "editar", "listas", "eliminar")
+    print(f"{'canciones':>10s} {'versión':9s}" + "".join(f"{op:>11s}" for op in operaciones) + "   (ms por lote)")
+    for n in (int(t) for t in args.tamanos.split(",")):
+        data = biblioteca(n, args.listas, args.por_lista)
+        versiones = [("índices", PlataformaMusical.from_dict)]
+        if n <= args.max_antiguo:
+            versiones.append(("antigua", PlataformaAntigua))
+        for nombre, crear in versiones:
+            tiempos = medir_plataforma(crear, data, args.lote)
+            print(f"{n:10d} {nombre:9s}" + "".join(f"{tiempos[op] * 1000:11.1f}" for op in operaciones))
+
+
+if __name__ == "__main__":
+    main()
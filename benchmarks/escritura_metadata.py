@@ -0,0 +1,156 @@
+"""Compara cómo se hacen duraderas las escrituras de metadata de cada
+logout del servidor, con el mismo historial de versiones (versiones.py) en
+los dos casos:
+- fsync por fichero: escrituras aplicadas directamente y un fsync por
+  fichero tocado (log, índice, biblioteca.json y su carpeta)
+- diario: escrituras confirmadas en el diario, un fsync por grupo
+
+Cada hilo simula un usuario distinto que hace logouts seguidos, todos a la
+vez, y se mide la latencia de cada guardado y los guardados por segundo.
+Las escrituras de cada logout (con el cálculo de los deltas) se preparan
+antes de medir, así solo se mide lo que cambia entre los dos modos; lo
+que cuesta prepararlas se da aparte. Con --fsync-ms se suma esa espera a
+cada fsync para emular un disco que tarda más en confirmar que el de la
+máquina donde se mide: con un fsync casi gratis (un disco virtual con
+caché, ~0.1 ms) gana el fsync por fichero, porque el diario escribe los
+datos dos veces; con fsyncs de un disco de verdad gana el diario.
+
+Uso:
+    python benchmarks/escritura_metadata.py [--usuarios 32] [--logouts 20] [--canciones 500] [--fsync-ms 0]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import diario
+from diario import Diario, REEMPLAZAR, aplicar_escrituras
+from versiones import HistorialVersiones
+
+
+def biblioteca(num_canciones, version):
+    canciones = [
+        {"id": i, "titulo": f"Cancion {i}", "artista": f"Artista {i % 50}",
+         "duracion": 180 + i % 120, "genero": "Rock", "archivo_mp3": f"c{i}.mp3"}
+        for i in range(1, num_canciones + 1)
+    ]
+    canciones[version % num_canciones]["titulo"] = f"Editada {version}"
+    return json.dumps({"canciones": canciones, "listas": [{"nombre": "Favoritas", "canciones": [1, 2, 3]}]})
+
+
+def fsync_escrituras(escrituras):
+    """Sincroniza cada fichero tocado por las escrituras."""
+    for ruta in {e[1] for e in escrituras}:
+        diario._fsync_ruta(ruta)
+    diario._fsync_ruta(os.path.dirname(escrituras[0][1]))
+
+
+def medir(base, num_usuarios, num_logouts, num_canciones, modo):
+    diario_grupo = None
+    if modo == "diario":
+        diario_grupo = Diario(os.path.join(base, "diario.log"))
+        diario_grupo.recuperar()
+        diario_grupo.iniciar()
+
+    # Las escrituras de cada logout se preparan antes (aplicándolas sin
+    # fsync, como exige preparar) y la carpeta vuelve después a como estaba
+    contenidos = [biblioteca(num_canciones, v) for v in range(num_logouts + 1)]
+    preparadas = []
+    segundos_preparar = 0
+    for u in range(num_usuarios):
+        carpeta = os.path.join(base, f"usuario{u}")
+        os.makedirs(carpeta)
+        with open(os.path.join(carpeta, "biblioteca.json"), "w", encoding="utf-8") as f:
+            f.write(contenidos[0])
+        historial = HistorialVersiones(carpeta)
+        shutil.copytree(carpeta, carpeta + ".inicial")
+
+        propias = []
+        for v in range(1, num_logouts + 1):
+            inicio = time.perf_counter()
+            _, escrituras = historial.preparar(contenidos[v], f"v{v}")
+            segundos_preparar += time.perf_counter() - inicio
+            escrituras.append((REEMPLAZAR, os.path.join(carpeta, "biblioteca.json"), contenidos[v].encode()))
+            aplicar_escrituras(escrituras)
+            historial.confirmar()
+            propias.append(escrituras)
+        preparadas.append(propias)
+
+        shutil.rmtree(carpeta)
+        os.rename(carpeta + ".inicial", carpeta)
+
+    latencias = []
+    cerrojo = threading.Lock()
+    salida = threading.Barrier(num_usuarios + 1)
+
+    def usuario(u):
+        propias = []
+        salida.wait()
+        for escrituras in preparadas[u]:
+            inicio = time.perf_counter()
+            if diario_grupo:
+                diario_grupo.confirmar(escrituras)
+            else:
+                aplicar_escrituras(escrituras)
+                fsync_escrituras(escrituras)
+            propias.append(time.perf_counter() - inicio)
+        with cerrojo:
+            latencias.extend(propias)
+
+    hilos = [threading.Thread(target=usuario, args=(u,)) for u in range(num_usuarios)]
+    for hilo in hilos:
+        hilo.start()
+    salida.wait()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    extra = ""
+    if diario_grupo:
+        diario_grupo.cerrar()
+        stats = diario_grupo.estadisticas()
+        extra = f"  ({stats['grupos']} fsyncs para {stats['confirmaciones']} guardados)"
+
+    latencias.sort()
+    p50 = latencias[len(latencias) // 2] * 1000
+    p99 = latencias[int(len(latencias) * 0.99)] * 1000
+    print(f"{modo:18s} {len(latencias) / duracion:9.0f} guardados/s"
+          f"   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms{extra}")
+    return segundos_preparar / len(latencias)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=32, help="logouts simultáneos")
+    parser.add_argument("--logouts", type=int, default=20, help="logouts de cada usuario")
+    parser.add_argument("--canciones", type=int, default=500, help="canciones de cada biblioteca")
+    parser.add_argument("--fsync-ms", type=float, default=0, help="espera extra en cada fsync")
+    parser.add_argument("--dir", default=None, help="carpeta donde medir (por defecto una temporal)")
+    args = parser.parse_args()
+
+    if args.fsync_ms:
+        fsync_real = os.fsync
+        disco = threading.Lock()  # el disco confirma un fsync detrás de otro
+
+        def fsync_lento(fd):
+            fsync_real(fd)
+            with disco:
+                time.sleep(args.fsync_ms / 1000)
+
+        os.fsync = fsync_lento
+
+    for modo in ("fsync por fichero", "diario"):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            preparar = medir(tmp, args.usuarios, args.logouts, args.canciones, modo)
+    print(f"(preparar las escrituras, igual en los dos: {preparar * 1000:.2f} ms por guardado, sin contar)")
+
+
+if __name__ == "__main__":
+    main()
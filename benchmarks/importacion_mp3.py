@@ -0,0 +1,94 @@
+"""Mide la importación de una carpeta de MP3 (musica/importador.py) en
+ficheros por segundo:
+- 1 proceso: leyendo todos los ficheros en el proceso principal
+- N procesos: repartiendo la lectura entre --procesos procesos
+- caché: volviendo a importar la carpeta sin cambios (no se lee ninguno)
+
+Crea en una carpeta temporal --ficheros MP3 sintéticos de --kb KB con
+etiquetas ID3v2 distintas: un tercio con bitrate constante, un tercio VBR
+con cabecera Xing y un tercio VBR sin ella (hay que recorrer sus tramas).
+
+Uso:
+    python benchmarks/importacion_mp3.py [--ficheros 5000] [--kb 256] [--procesos 4]
+"""
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musica.importador import NOMBRE_CACHE, importar_carpeta, trama
+from musica.plataforma import PlataformaMusical
+
+
+def trama_mp3(indice_bitrate):
+    """Una trama MPEG-1 capa III a 44100 Hz en estéreo."""
+    cabecera = bytes([0xFF, 0xFB, indice_bitrate << 4, 0x00])
+    longitud = trama(cabecera + bytes(2000), 0)[5]
+    return cabecera + b"\x55" * (longitud - 4)
+
+
+def etiqueta(titulo, artista, genero):
+    cuerpo = b""
+    for marco, texto in (("TIT2", titulo), ("TPE1", artista), ("TCON", genero)):
+        datos = b"\x03" + texto.encode("utf-8")
+        cuerpo += marco.encode() + struct.pack(">I", len(datos)) + b"\0\0" + datos
+    tam = len(cuerpo)
+    return b"ID3\x04\x00\x00" + bytes([(tam >> 21) & 127, (tam >> 14) & 127, (tam >> 7) & 127, tam & 127]) + cuerpo
+
+
+def audios(kb):
+    """Audio de unos kb KB de los tres tipos."""
+    cbr = trama_mp3(9)
+    n = kb * 1024 // len(cbr)
+    constante = cbr * n
+    variable = b"".join(trama_mp3(9 if i % 3 else 14) for i in range(n))
+    # Trama Xing: cabecera + 32 bytes de información lateral + "Xing", flags y número de tramas
+    xing = bytearray(trama_mp3(9))
+    xing[36:48] = b"Xing" + struct.pack(">II", 1, n)
+    return [constante, bytes(xing) + variable, variable]
+
+
+def crear_carpeta(carpeta, num_ficheros, kb):
+    tipos = audios(kb)
+    for i in range(num_ficheros):
+        subcarpeta = os.path.join(carpeta, f"artista_{i % 100}")
+        os.makedirs(subcarpeta, exist_ok=True)
+        with open(os.path.join(subcarpeta, f"cancion_{i}.mp3"), "wb") as f:
+            f.write(etiqueta(f"Canción {i}", f"Artista {i % 100}", "Rock"))
+            f.write(tipos[i % 3])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ficheros", type=int, default=5000)
+    parser.add_argument("--kb", type=int, default=256, help="tamaño de cada MP3")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        carpeta = os.path.join(tmp, "musica")
+        crear_carpeta(carpeta, args.ficheros, args.kb)
+        print(f"{args.ficheros} MP3 de {args.kb} KB, {os.cpu_count()} CPU")
+
+        for nombre, procesos in (("1 proceso", 1), (f"{args.procesos} procesos", args.procesos), ("caché", 1)):
+            if nombre != "caché":
+                cache = os.path.join(tmp, NOMBRE_CACHE)
+                if os.path.exists(cache):
+                    os.remove(cache)
+            plataforma = PlataformaMusical()
+            inicio = time.perf_counter()
+            resultado = importar_carpeta(plataforma, carpeta, procesos=procesos, carpeta_cache=tmp)
+            segundos = time.perf_counter() - inicio
+            assert resultado["anadidas"] == args.ficheros
+            print(f"{nombre:12s} {segundos:7.2f} s {args.ficheros / segundos:9.0f} ficheros/s"
+                  f"   (leídos: {resultado['leidos']})")
+        shutil.rmtree(carpeta)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Mide con tracemalloc la memoria de un catálogo de N canciones:
+- antigua: Cancion con __dict__ y la ruta completa del MP3 en cada una
+  (como era antes)
+- compacta: Cancion actual (__slots__, artista y género compartidos y la
+  carpeta de los MP3 guardada una vez)
+Las canciones se crean con from_dict a partir de un JSON, como las crea el
+cliente al recibir su biblioteca (cada texto del JSON es un objeto aparte).
+
+Uso:
+    python benchmarks/memoria_canciones.py [--canciones 1000000] [--artistas 5000] [--generos 20]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musica.cancion import Cancion
+
+
+class CancionAntigua:
+    """Cancion tal y como era antes (solo lo que ocupa memoria)."""
+
+    def __init__(self, id, titulo, artista, duracion, genero, archivo_mp3):
+        self.id = id
+        self.titulo = titulo
+        self.artista = artista
+        self.duracion = duracion
+        self.genero = genero
+        self.archivo_mp3 = archivo_mp3
+
+    def from_dict(data, base_path):
+        ruta = os.path.join(base_path, data["archivo_mp3"])
+        return CancionAntigua(data["id"], data["titulo"], data["artista"], data["duracion"], data["genero"], ruta)
+
+
+def biblioteca_json(num_canciones, num_artistas, num_generos):
+    return json.dumps([
+        {"id": i, "titulo": f"Cancion {i}", "artista": f"Artista {i % num_artistas}",
+         "duracion": 120 + i % 240, "genero": f"Genero {i % num_generos}", "archivo_mp3": f"cancion_{i}.mp3"}
+        for i in range(1, num_canciones + 1)
+    ])
+
+
+def medir(clase, texto, base_path):
+    """Bytes que siguen ocupados tras crear las canciones (y soltar el JSON
+    decodificado) y pico durante la carga."""
+    gc.collect()
+    tracemalloc.start()
+    datos = json.loads(texto)
+    canciones = [clase.from_dict(d, base_path) for d in datos]
+    del datos
+    gc.collect()
+    actual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(canciones) > 0
+    return actual, pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=1000000)
+    parser.add_argument("--artistas", type=int, default=5000, help="artistas distintos")
+    parser.add_argument("--generos", type=int, default=20, help="géneros distintos")
+    args = parser.parse_args()
+
+    texto = biblioteca_json(args.canciones, args.artistas, args.generos)
+    base_path = os.path.join("datos_cliente_usuario_de_prueba", "")
+
+    print(f"{args.canciones} canciones, {args.artistas} artistas, {args.generos} géneros")
+    resultados = {}
+    for nombre, clase in (("antigua", CancionAntigua), ("compacta", Cancion)):
+        actual, pico = medir(clase, texto, base_path)
+        resultados[nombre] = actual
+        print(f"{nombre:9s} {actual / 1e6:9.1f} MB ({actual / args.canciones:6.0f} B por canción)"
+              f"   pico {pico / 1e6:9.1f} MB")
+    print(f"ahorro: {(1 - resultados['compacta'] / resultados['antigua']) * 100:.0f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Mide el tiempo hasta el primer sonido de un MP3 que no está en local:
+- completa: se descarga entero y luego se reproduce
+- progresiva: se reproduce en cuanto llegan los primeros --buffer-kb KB
+
+Arranca un servidor.py en una carpeta temporal con un MP3 de --mb MB y
+limita el ancho de banda de bajada a --kbps con un proxy entre el cliente y
+el servidor (en local la red es tan rápida que no se vería la diferencia).
+
+Uso:
+    python benchmarks/primer_sonido.py [--mb 8] [--kbps 4000] [--buffer-kb 256] [--repeticiones 3]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from descarga_progresiva import DescargaProgresiva
+from protocolo import Conexion, recibir_mp3
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def proxy_limitado(puerto_servidor, bytes_por_segundo):
+    """Proxy TCP que deja pasar como mucho bytes_por_segundo hacia el
+    cliente. Devuelve el puerto en el que escucha."""
+    escucha = socket.create_server(("127.0.0.1", 0))
+
+    def copiar(origen, destino, limitar):
+        try:
+            while True:
+                datos = origen.recv(16384)
+                if not datos:
+                    break
+                destino.sendall(datos)
+                if limitar:
+                    time.sleep(len(datos) / bytes_por_segundo)
+        except OSError:
+            pass
+        finally:
+            destino.close()
+
+    def aceptar():
+        while True:
+            cliente, _ = escucha.accept()
+            servidor = socket.create_connection(("127.0.0.1", puerto_servidor))
+            threading.Thread(target=copiar, args=(cliente, servidor, False), daemon=True).start()
+            threading.Thread(target=copiar, args=(servidor, cliente, True), daemon=True).start()
+
+    threading.Thread(target=aceptar, daemon=True).start()
+    return escucha.getsockname()[1]
+
+
+def conexion_transferencia(puerto, token, nombre):
+    con = Conexion(socket.create_connection(("127.0.0.1", puerto)))
+    con.enviar_linea(f"TRANSFER:{token}")
+    if con.leer_linea() != "OK":
+        raise Exception("Token rechazado")
+    con.enviar_linea(f"GET:0:{nombre}")
+    return con
+
+
+def completa(puerto, token, nombre, carpeta, buffer):
+    inicio = time.perf_counter()
+    con = conexion_transferencia(puerto, token, nombre)
+    recibir_mp3(con, carpeta)
+    con.cerrar()
+    return time.perf_counter() - inicio
+
+
+def progresiva(puerto, token, nombre, carpeta, buffer):
+    inicio = time.perf_counter()
+    con = conexion_transferencia(puerto, token, nombre)
+    descarga = DescargaProgresiva(con, carpeta, al_terminar=lambda d: con.cerrar())
+    descarga.iniciar()
+    descarga.esperar(buffer)
+    primer_sonido = time.perf_counter() - inicio
+    descarga.esperar(descarga.total)  # antes de la siguiente repetición
+    return primer_sonido
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=8, help="tamaño del MP3")
+    parser.add_argument("--kbps", type=float, default=4000, help="ancho de banda de bajada (kilobits/s)")
+    parser.add_argument("--buffer-kb", type=int, default=256, help="prefijo antes de empezar a sonar")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--puerto", type=int, default=39999, help="puerto del servidor de prueba")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        carpeta_usuario = os.path.join(tmp, "servidor", "datos_server", "bench")
+        os.makedirs(carpeta_usuario)
+        with open(os.path.join(carpeta_usuario, "cancion.mp3"), "wb") as f:
+            f.write(os.urandom(int(args.mb * 1024 * 1024)))
+
+        servidor = subprocess.Popen(
+            [sys.executable, os.path.join(RAIZ, "servidor.py"), "--puerto", str(args.puerto)],
+            cwd=os.path.join(tmp, "servidor"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                try:
+                    sesion = Conexion(socket.create_connection(("127.0.0.1", args.puerto)))
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            else:
+                raise Exception("El servidor no ha arrancado")
+
+            # La sesión queda abierta para que el token siga valiendo
+            sesion.enviar_linea("LOGIN:bench:PARALELO")
+            sesion.leer_linea()
+            token = sesion.leer_linea().split(":", 1)[1]
+
+            puerto = proxy_limitado(args.puerto, args.kbps * 1000 / 8)
+            print(f"MP3 de {args.mb} MB a {args.kbps:.0f} kbit/s, prefijo de {args.buffer_kb} KB")
+            for nombre_modo, medir in (("completa", completa), ("progresiva", progresiva)):
+                tiempos = []
+                for i in range(args.repeticiones):
+                    carpeta = os.path.join(tmp, f"{nombre_modo}{i}")
+                    os.makedirs(carpeta)
+                    tiempos.append(medir(puerto, token, "cancion.mp3", carpeta, args.buffer_kb * 1024))
+                tiempos.sort()
+                print(f"{nombre_modo:12s} primer sonido: mediana {tiempos[len(tiempos) // 2] * 1000:8.0f} ms"
+                      f"   máx {tiempos[-1] * 1000:8.0f} ms")
+            sesion.cerrar()
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
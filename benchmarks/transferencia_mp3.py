@@ -0,0 +1,112 @@
+"""Compara el rendimiento de la transferencia de MP3 antigua (bloques de
+1024 bytes leídos en Python) con la actual (sendfile + recv_into).
+
+Uso:
+    python benchmarks/transferencia_mp3.py [--mb 200] [--bloque 262144]
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocolo import Conexion, enviar_mp3, recibir_mp3
+
+
+def enviar_clasico(sock, ruta):
+    """Camino de envío anterior: read(1024) + sendall por bloque."""
+    size = os.path.getsize(ruta)
+    sock.sendall(f"MP3_SIZE:{size}\n".encode())
+    sock.sendall(f"MP3_NAME:{os.path.basename(ruta)}\n".encode())
+    with open(ruta, "rb") as f:
+        while True:
+            chunk = f.read(1024)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+
+
+def recibir_clasico(sock, carpeta):
+    """Camino de recepción anterior: recv(1) para cabeceras y recv(1024) + write."""
+    def linea():
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(1)
+            if not chunk:
+                break
+            data += chunk
+        return data.decode().strip()
+
+    size = int(linea().split(":")[1])
+    nombre = linea().split(":")[1]
+    with open(os.path.join(carpeta, nombre), "wb") as f:
+        restantes = size
+        while restantes > 0:
+            chunk = sock.recv(min(1024, restantes))
+            if not chunk:
+                break
+            f.write(chunk)
+            restantes -= len(chunk)
+
+
+def medir(ruta, destino, emisor, receptor):
+    """Devuelve los segundos que tarda en llegar el fichero por TCP local."""
+    servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen(1)
+
+    def enviar():
+        sock, _ = servidor.accept()
+        emisor(sock, ruta)
+        sock.close()
+
+    hilo = threading.Thread(target=enviar)
+    hilo.start()
+
+    cliente = socket.create_connection(servidor.getsockname())
+    inicio = time.perf_counter()
+    receptor(cliente, destino)
+    duracion = time.perf_counter() - inicio
+
+    hilo.join()
+    cliente.close()
+    servidor.close()
+    return duracion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=200, help="tamaño del MP3 de prueba")
+    parser.add_argument("--bloque", type=int, default=256 * 1024, help="bloque de recepción")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        origen = os.path.join(tmp, "origen")
+        destino = os.path.join(tmp, "destino")
+        os.makedirs(origen)
+        os.makedirs(destino)
+
+        ruta = os.path.join(origen, "prueba.mp3")
+        with open(ruta, "wb") as f:
+            for _ in range(args.mb):
+                f.write(os.urandom(1024 * 1024))
+
+        caminos = {
+            "clasico (1024 B)": (enviar_clasico, recibir_clasico),
+            f"sendfile + recv_into ({args.bloque} B)": (
+                lambda sock, r: enviar_mp3(Conexion(sock, args.bloque), r),
+                lambda sock, d: recibir_mp3(Conexion(sock, args.bloque), d),
+            ),
+        }
+
+        for nombre, (emisor, receptor) in caminos.items():
+            segundos = medir(ruta, destino, emisor, receptor)
+            print(f"{nombre:35s} {args.mb / segundos:8.1f} MB/s ({segundos:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import json
+import os
+
+
+# CACHÉS EN FICHEROS JSON
+#
+# Las cachés que se guardan en disco (.manifiesto.json, .importados.json,
+# .cache_mp3.json) se leen y se escriben igual: si no se pueden leer se
+# empieza con una vacía, y se escriben en un temporal que luego sustituye a
+# la vieja con os.replace, así que si se corta a medias la vieja sigue
+# entera. Si no se pueden guardar solo se pierde rendimiento.
+
+
+def leer(ruta):
+    """Contenido de la caché, o {} si no existe o está estropeada."""
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            datos = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return datos if isinstance(datos, dict) else {}
+
+
+def guardar(ruta, datos):
+    """Guarda la caché. Devuelve False si no se ha podido."""
+    ruta_tmp = ruta + ".tmp"
+    try:
+        with open(ruta_tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        os.replace(ruta_tmp, ruta)
+    except OSError:
+        return False
+    return True
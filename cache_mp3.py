@@ -0,0 +1,94 @@
+import os
+import time
+from collections import OrderedDict
+import cache_json
+from manifiesto import calcular_manifiesto
+
+# CACHÉ LOCAL DE MP3 DEL CLIENTE
+#
+# Con descarga bajo demanda, en el login solo viaja la metadata: la carpeta
+# local (datos_cliente_<usuario>) guarda los MP3 que se han ido
+# reproduciendo, hasta max_bytes. Cuando falta uno se pide al servidor y, si
+# con él se pasa del límite, se borran los usados hace más tiempo.
+#
+# Solo se borran los que el servidor tiene iguales (mismo hash en su
+# manifiesto): un MP3 añadido en este equipo que aún no se ha subido no se
+# toca nunca. El orden de uso se guarda en .cache_mp3.json para que dure
+# entre sesiones.
+
+NOMBRE_INDICE = ".cache_mp3.json"
+
+
+class CacheMP3:
+    def __init__(self, carpeta, max_bytes, descargar, manifiesto_servidor):
+        """descargar(nombre) trae ese MP3 del servidor a la carpeta y
+        devuelve True si lo ha conseguido, False si no, o un fichero del que
+        se puede ir leyendo mientras se termina de descargar."""
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        self.descargar = descargar
+        self.manifiesto_servidor = manifiesto_servidor
+        self._usos = OrderedDict()  # nombre -> momento del último uso (el último, el más reciente)
+        self._leer_indice()
+
+    def _leer_indice(self):
+        usos = cache_json.leer(os.path.join(self.carpeta, NOMBRE_INDICE))
+        for nombre, momento in sorted(usos.items(), key=lambda x: x[1]):
+            self._usos[nombre] = momento
+
+    def _guardar_indice(self):
+        # Si no se puede guardar solo se pierde el orden de uso
+        cache_json.guardar(os.path.join(self.carpeta, NOMBRE_INDICE), self._usos)
+
+    def obtener(self, ruta):
+        """Se asegura de que el MP3 esté en local (descargándolo si falta) y
+        lo marca como usado. Devuelve su ruta, el fichero que se está
+        descargando o None si no se puede conseguir."""
+        nombre = os.path.basename(ruta)
+        ruta = os.path.join(self.carpeta, nombre)
+        origen = ruta
+        if not os.path.exists(ruta):
+            if nombre not in self.manifiesto_servidor:
+                return None
+            print(f"[Cliente] Descargando {nombre}...")
+            resultado = self.descargar(nombre)
+            if not resultado:
+                return None
+            if resultado is not True:
+                origen = resultado
+
+        self._usos[nombre] = time.time()
+        self._usos.move_to_end(nombre)
+        self.liberar(conservar=nombre)
+        return origen
+
+    def liberar(self, conservar=None):
+        """Borra los MP3 usados hace más tiempo hasta no pasar de max_bytes.
+        Devuelve los bytes liberados."""
+        manifiesto = calcular_manifiesto(self.carpeta)
+        total = sum(info["tam"] for info in manifiesto.values())
+        liberados = 0
+
+        # Primero los que nunca se han reproducido, luego del más antiguo al más reciente
+        orden = [n for n in manifiesto if n not in self._usos] + list(self._usos)
+        for nombre in orden:
+            if total <= self.max_bytes:
+                break
+            info = manifiesto.get(nombre)
+            en_servidor = self.manifiesto_servidor.get(nombre)
+            if nombre == conservar or info is None or en_servidor is None or en_servidor["hash"] != info["hash"]:
+                continue
+            try:
+                os.remove(os.path.join(self.carpeta, nombre))
+            except OSError:
+                continue
+            total -= info["tam"]
+            liberados += info["tam"]
+            self._usos.pop(nombre, None)
+
+        # Olvidar los que ya no están (borrados a mano, por ejemplo)
+        for nombre in [n for n in self._usos if n not in manifiesto and n != conservar]:
+            del self._usos[nombre]
+
+        self._guardar_indice()
+        return liberados
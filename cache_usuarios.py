@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+
+
+class EntradaUsuario:
+    """Lo que el servidor guarda en memoria de un usuario:
+    - metadata: texto de su biblioteca.json actual
+    - version: número de versión de esa metadata
+    - versiones: su HistorialVersiones (con la pila de versiones)
+    - codificadas: la metadata ya codificada para la red
+      (capacidades -> (bytes, etiqueta)), para no recomprimir en cada login
+      mientras no cambie
+    - tam: bytes de la metadata y sus codificaciones
+    Los cambios de tamaño se hacen a través de CacheUsuarios
+    (anadir_codificada, actualizar_metadata), que lleva la cuenta del total.
+    """
+
+    def __init__(self, metadata, versiones, version=0):
+        self.metadata = metadata
+        self.version = version
+        self.versiones = versiones
+        self.codificadas = {}
+        self.tam = len(metadata)
+        self.en_cache = False
+
+    def actualizar_metadata(self, metadata, version):
+        self.metadata = metadata
+        self.version = version
+        self.codificadas = {}
+        self.tam = len(metadata)
+
+    def anadir_codificada(self, clave, codificada):
+        anterior = self.codificadas.get(clave)
+        if anterior is not None:
+            self.tam -= len(anterior[0])
+        self.codificadas[clave] = codificada
+        self.tam += len(codificada[0])
+
+
+class CacheUsuarios:
+    """Caché LRU y segura entre hilos de EntradaUsuario.
+    Está limitada por número de usuarios y por bytes de metadata; al pasarse
+    se desaloja el usuario usado hace más tiempo. Un usuario desalojado se
+    vuelve a cargar de disco en su siguiente login.
+    El total de bytes se lleva al día con cada cambio (con el cerrojo), así
+    que aplicar los límites no recorre todas las entradas.
+    """
+
+    def __init__(self, max_usuarios=1000, max_bytes=256 * 1024 * 1024):
+        self.max_usuarios = max_usuarios
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # usuario -> EntradaUsuario (la última, la más reciente)
+        self._cerrojo = threading.Lock()
+        self._bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def obtener(self, usuario, cargar):
+        """Devuelve la entrada del usuario. Si no está, la crea con cargar()
+        (que lee de disco) fuera del cerrojo para no frenar a los demás."""
+        with self._cerrojo:
+            entrada = self._entradas.get(usuario)
+            if entrada is not None:
+                self._entradas.move_to_end(usuario)
+                self.aciertos += 1
+                return entrada
+            self.fallos += 1
+
+        entrada = cargar()
+
+        with self._cerrojo:
+            # Otro hilo pudo cargarla a la vez: nos quedamos con la primera
+            existente = self._entradas.get(usuario)
+            if existente is not None:
+                self._entradas.move_to_end(usuario)
+                return existente
+            self._entradas[usuario] = entrada
+            entrada.en_cache = True
+            self._bytes += entrada.tam
+            self._desalojar()
+        return entrada
+
+    def _cambiar(self, entrada, cambio):
+        """Aplica cambio() a la entrada y suma al total lo que cambie su
+        tamaño (si sigue en la caché; una desalojada aún puede usarla una
+        sesión abierta)."""
+        with self._cerrojo:
+            antes = entrada.tam
+            cambio()
+            if entrada.en_cache:
+                self._bytes += entrada.tam - antes
+                self._desalojar()
+
+    def anadir_codificada(self, entrada, clave, codificada):
+        """Guarda en la entrada una codificación de su metadata."""
+        self._cambiar(entrada, lambda: entrada.anadir_codificada(clave, codificada))
+
+    def actualizar_metadata(self, entrada, metadata, version):
+        """Cambia la metadata de la entrada (y olvida sus codificaciones)."""
+        self._cambiar(entrada, lambda: entrada.actualizar_metadata(metadata, version))
+
+    def _desalojar(self):
+        while self._entradas and (len(self._entradas) > self.max_usuarios or self._bytes > self.max_bytes):
+            _, entrada = self._entradas.popitem(last=False)
+            entrada.en_cache = False
+            self._bytes -= entrada.tam
+            self.desalojos += 1
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def estadisticas(self):
+        with self._cerrojo:
+            return {
+                "usuarios": len(self._entradas),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+            }
@@ -1,4 +1,6 @@
 import socket
+import threading
+import queue
 import json
 import os
 import copy  # Para copiar estados de la plataforma sin compartir referencias
@@ -7,54 +9,369 @@ from musica.cancion import Cancion
 from musica.lista_reproduccion import ListaReproduccion
 from app import menu_canciones, menu_listas, menu_reproduccion
 from lista_historial import HistorialEstados
+from manifiesto import calcular_manifiesto, ficheros_distintos
+from codificacion import codificar_metadata, decodificar_metadata, capacidades_de_etiqueta, cabecera_tam, leer_cabecera_tam
+from protocolo import Conexion, enviar_mp3, recibir_mp3, tam_parcial
+from operaciones import huella
+from cache_mp3 import CacheMP3
+from descarga_progresiva import DescargaProgresiva
+
+
+PUERTO = 9999
+
+# Conexiones extra que se abren para mover MP3 en paralelo
+NUM_CONEXIONES = 4
+
+# Con descarga bajo demanda en el login solo viaja la metadata y cada MP3 se
+# descarga al reproducirlo; la carpeta local no pasa de MAX_BYTES_CACHE_MP3
+# (se borran los usados hace más tiempo). Necesita conexiones de
+# transferencia (PARALELO); si el servidor no las da se descarga todo.
+BAJO_DEMANDA = True
+MAX_BYTES_CACHE_MP3 = 2 * 1024 * 1024 * 1024
+
+# Reproducción progresiva: un MP3 descargado bajo demanda empieza a sonar en
+# cuanto han llegado sus primeros BUFFER_INICIAL_MP3 bytes; el resto se sigue
+# descargando mientras suena
+REPRODUCCION_PROGRESIVA = True
+BUFFER_INICIAL_MP3 = 256 * 1024
+
+# Puntos de control: durante la sesión los cambios se suben en segundo plano
+# cada PUNTO_CONTROL_CADA_SEGUNDOS o tras PUNTO_CONTROL_CADA_CAMBIOS cambios
+# en el historial, así la subida del logout es casi nada y si el cliente se
+# cae no se pierde todo lo hecho
+PUNTO_CONTROL_CADA_SEGUNDOS = 60
+PUNTO_CONTROL_CADA_CAMBIOS = 5
+
+
+# TRANSFERENCIAS EN PARALELO
+
+def transferir_en_paralelo(host, token, tareas, hacer):
+    """Reparte 'tareas' entre varias conexiones extra de transferencia
+    (TRANSFER:<token>). hacer(con, tarea) realiza una tarea y devuelve True
+    si ha ido bien. Devuelve la lista de tareas que no se han podido hacer,
+    para repetirlas por la conexión principal.
+    """
+    cola = queue.Queue()
+    for tarea in tareas:
+        cola.put(tarea)
+    fallidas = []
+
+    def trabajador():
+        try:
+            con = Conexion(socket.create_connection((host, PUERTO)))
+        except OSError:
+            return
+
+        try:
+            con.enviar_linea(f"TRANSFER:{token}")
+            if con.leer_linea() != "OK":
+                return
+
+            while True:
+                try:
+                    tarea = cola.get_nowait()
+                except queue.Empty:
+                    break
+
+                try:
+                    if not hacer(con, tarea):
+                        fallidas.append(tarea)
+                except Exception:
+                    # La conexión ha quedado en mal estado: dejamos el resto
+                    # de tareas para los demás trabajadores
+                    fallidas.append(tarea)
+                    return
+
+            con.enviar_linea("FIN")
+        except OSError:
+            pass
+        finally:
+            con.cerrar()
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(min(NUM_CONEXIONES, len(tareas)))]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    # Si no se pudo abrir ninguna conexión quedan tareas sin hacer en la cola
+    while not cola.empty():
+        fallidas.append(cola.get_nowait())
+
+    return fallidas
+
+
+def descargar_bajo_demanda(host, token, nombre, carpeta_destino, hashes):
+    """Descarga un MP3 durante la sesión por una conexión de transferencia."""
+    try:
+        con = Conexion(socket.create_connection((host, PUERTO)))
+    except OSError:
+        return False
+    try:
+        con.enviar_linea(f"TRANSFER:{token}")
+        if con.leer_linea() != "OK":
+            return False
+        ok = descargar_mp3(con, nombre, carpeta_destino, hashes)
+        con.enviar_linea("FIN")
+        return ok
+    except OSError:
+        return False
+    finally:
+        con.cerrar()
+
+
+def descargar_progresivo(host, token, nombre, carpeta_destino, hashes):
+    """Pide un MP3 por una conexión de transferencia y, en cuanto han
+    llegado BUFFER_INICIAL_MP3 bytes, devuelve un fichero del que se puede
+    ir leyendo mientras se descarga el resto (True si ya ha llegado entero,
+    False si falla)."""
+    try:
+        con = Conexion(socket.create_connection((host, PUERTO)))
+    except OSError:
+        return False
+    try:
+        con.enviar_linea(f"TRANSFER:{token}")
+        if con.leer_linea() != "OK":
+            con.cerrar()
+            return False
+        con.enviar_linea(f"GET:{tam_parcial(carpeta_destino, nombre)}:{nombre}")
+    except OSError:
+        con.cerrar()
+        return False
+
+    def al_terminar(descarga):
+        try:
+            if descarga.error is None:
+                con.enviar_linea("FIN")
+        except OSError:
+            pass
+        finally:
+            con.cerrar()
+
+    descarga = DescargaProgresiva(con, carpeta_destino, hashes, al_terminar)
+    descarga.iniciar()
+    if not descarga.esperar(BUFFER_INICIAL_MP3):
+        return False
+    fichero = descarga.abrir()
+    if fichero is None:
+        # Ha terminado entre medias: ya está en su sitio (o ha fallado)
+        return descarga.ruta is not None
+    return fichero
+
+
+def descargar_mp3(con, nombre, carpeta_destino, hashes):
+    """Pide un MP3 por una conexión de transferencia, reanudando desde lo
+    que ya haya en su .part si una descarga anterior se cortó."""
+    desde = tam_parcial(carpeta_destino, nombre)
+    con.enviar_linea(f"GET:{desde}:{nombre}")
+    return recibir_mp3(con, carpeta_destino, hashes) is not None
+
+
+def subir_mp3(con, ruta, hash_mp3):
+    """Sube un MP3 por una conexión de transferencia. El servidor contesta
+    cuántos bytes tiene ya de una subida anterior y se envía el resto."""
+    con.enviar_linea(f"PUT:{hash_mp3}:{os.path.basename(ruta)}")
+    desde = int(con.leer_linea().split(":")[1])
+    enviar_mp3(con, ruta, desde)
+    return con.leer_linea() == "OK"
+
+
+# SUBIDA DE LA METADATA
+
+def mostrar_conflictos(conflictos):
+    if conflictos.get("base") is not None:
+        print(f"La versión {conflictos['base']} sobre la que trabajabas ya no está en el servidor.")
+    if conflictos.get("canciones"):
+        print("Canciones modificadas también en otro dispositivo (ids): "
+              + ", ".join(str(i) for i in conflictos["canciones"]))
+    if conflictos.get("listas"):
+        print("Listas modificadas también en otro dispositivo: " + ", ".join(conflictos["listas"]))
+
+
+def operaciones_pendientes(operaciones, enviadas):
+    """Operaciones que faltan por subir si las ya enviadas son las primeras
+    de la lista, o None si no (por ejemplo, tras deshacer algo ya enviado):
+    entonces hay que subir la biblioteca entera."""
+    if operaciones[:len(enviadas)] != enviadas:
+        return None
+    return operaciones[len(enviadas):]
+
+
+def enviar_subida(con, data, operaciones, version_base, capacidades_servidor):
+    """Envía una subida de metadata: las operaciones hechas sobre
+    version_base (UPLOAD_OPS) o, si operaciones es None, la biblioteca
+    entera (UPLOAD_METADATA)."""
+    if operaciones is not None:
+        paquete = {"ops": operaciones, "huella": huella(data)}
+        # Las operaciones no son una biblioteca: nunca en formato binario
+        cuerpo, etiqueta = codificar_metadata(paquete, capacidades_servidor - {"BIN"})
+        con.enviar_linea("UPLOAD_OPS")
+        con.enviar_linea(f"BASE:{version_base}")
+        con.enviar(cabecera_tam("OPS_SIZE", cuerpo, etiqueta) + cuerpo)
+    else:
+        cuerpo, etiqueta = codificar_metadata(data, capacidades_servidor)
+        con.enviar_linea("UPLOAD_METADATA")
+        if version_base is not None:
+            con.enviar_linea(f"BASE:{version_base}")
+        con.enviar(cabecera_tam("SIZE", cuerpo, etiqueta) + cuerpo)
+
+
+def subir_metadata(con, plataforma, version_base, capacidades_servidor, enviadas=()):
+    """Sube la biblioteca indicando la versión sobre la que se ha trabajado.
+    Si el servidor entiende OPS se suben solo las operaciones hechas en la
+    sesión que no estén ya en version_base ('enviadas' en un punto de
+    control), y si no le cuadran, la biblioteca entera.
+    Si otro dispositivo subió cambios entretanto, el servidor los combina
+    (MERGED) o, si chocan, responde CONFLICT y el usuario decide si sus
+    cambios sustituyen a los del servidor o se descartan."""
+    data = plataforma.to_dict()
+    operaciones = None
+    if "OPS" in capacidades_servidor and version_base is not None:
+        operaciones = operaciones_pendientes(plataforma.operaciones, list(enviadas))
 
-
-# FUNCIONES AUXILIARES PARA ENVÍO Y RECEPCIÓN DE MP3
-
-def recibir_linea(sock):
-    data = b""
-    while not data.endswith(b"\n"):
-        chunk = sock.recv(1)
-        if not chunk:
-            break
-        data += chunk
-    return data.decode().strip()
-
-
-def recibir_mp3(sock, carpeta_destino):
-    header = recibir_linea(sock)
-    size = int(header.split(":")[1])
-
-    header = recibir_linea(sock)
-    nombre = header.split(":")[1]
-
-    ruta = os.path.join(carpeta_destino, nombre)
-
-    with open(ruta, "wb") as f:
-        restantes = size
-        while restantes > 0:
-            chunk = sock.recv(min(1024, restantes))
-            if not chunk:
-                break
-            f.write(chunk)
-            restantes -= len(chunk)
-
-    return ruta
-
-
-def enviar_mp3(sock, ruta):
-    size = os.path.getsize(ruta)
-    nombre = os.path.basename(ruta)
-
-    sock.sendall(f"MP3_SIZE:{size}\n".encode())
-    sock.sendall(f"MP3_NAME:{nombre}\n".encode())
-
-    with open(ruta, "rb") as f:
+    while True:
+        enviar_subida(con, data, operaciones, version_base, capacidades_servidor)
+
+        # Servidor sin versiones: no contesta
+        if version_base is None:
+            return
+
+        respuesta, version = con.leer_linea().split(":")
+        if respuesta == "SAVED":
+            return
+        if respuesta == "MERGED":
+            print(f"[Cliente] Tus cambios se han combinado con los de otro dispositivo (versión {version}).")
+            return
+        if respuesta == "RESEND":
+            operaciones = None
+            continue
+
+        conflictos = json.loads(con.leer_datos("CONFLICT_SIZE").decode())
+        print("\n[Cliente] Otro dispositivo ha cambiado lo mismo que tú mientras trabajabas.")
+        mostrar_conflictos(conflictos)
+        print("1) Guardar mis cambios (sustituyen a los del servidor)")
+        print("2) Descartar mis cambios")
+        if input("> ").strip() != "1":
+            con.enviar_linea("DISCARD")
+            print("[Cliente] Tus cambios de metadata se han descartado.")
+            return
+
+        version_base = int(version)
+        operaciones = None  # Sobre otra versión las operaciones ya no valen
+
+
+# PUNTOS DE CONTROL
+
+class PuntosControl:
+    """Sube en un hilo aparte, por la conexión principal, los cambios de la
+    sesión (y los MP3 nuevos) mientras el usuario trabaja. El hilo principal
+    avisa de cada cambio del historial con cambio(plataforma) y no vuelve a
+    usar la conexión hasta después de detener().
+
+    Un punto de control solo se guarda si nadie ha subido nada desde la
+    última versión que tenemos (BEHIND si no): combinar cambios o resolver
+    conflictos se deja para la subida final, en la que el usuario puede
+    elegir. Tras un BEHIND no se mandan más puntos de control."""
+
+    def __init__(self, con, host, token, carpeta_local, version_base,
+                 capacidades_servidor, capacidades_confirmadas, manifiesto_servidor):
+        self.con = con
+        self.host = host
+        self.token = token
+        self.carpeta_local = carpeta_local
+        self.capacidades_servidor = capacidades_servidor
+        self.con_blobs = "BLOBS" in capacidades_confirmadas
+        # Lo que tiene ya el servidor: se actualiza con lo que se va subiendo
+        self.manifiesto_servidor = manifiesto_servidor
+        self.version_base = version_base
+        self.enviadas = []  # operaciones que ya están en version_base
+        self.atrasado = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._estado = None  # (biblioteca, operaciones) pendiente de subir
+        self._cambios = 0
+        self._parar = False
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def cambio(self, plataforma):
+        """Anota el estado tras un cambio (o deshacer/rehacer)."""
+        with self._cond:
+            self._estado = (plataforma.to_dict(), list(plataforma.operaciones))
+            self._cambios += 1
+            if self._cambios >= PUNTO_CONTROL_CADA_CAMBIOS:
+                self._cond.notify()
+
+    def detener(self):
+        """Espera a que acabe el punto de control en curso y para el hilo."""
+        with self._cond:
+            self._parar = True
+            self._cond.notify()
+        self._hilo.join()
+
+    def _bucle(self):
         while True:
-            chunk = f.read(1024)
-            if not chunk:
+            with self._cond:
+                self._cond.wait_for(lambda: self._parar or self._cambios >= PUNTO_CONTROL_CADA_CAMBIOS,
+                                    timeout=PUNTO_CONTROL_CADA_SEGUNDOS)
+                if self._parar:
+                    return
+                estado = self._estado
+                self._estado = None
+                self._cambios = 0
+
+            if estado is None:
+                continue
+            try:
+                self._subir(*estado)
+            except Exception as e:
+                self.error = e
+                return
+            if self.atrasado:
+                return
+
+    def _subir(self, data, operaciones):
+        operaciones_subida = None
+        if "OPS" in self.capacidades_servidor:
+            operaciones_subida = operaciones_pendientes(operaciones, self.enviadas)
+
+        self.con.enviar_linea("CHECKPOINT")
+        while True:
+            enviar_subida(self.con, data, operaciones_subida, self.version_base, self.capacidades_servidor)
+            respuesta, version = self.con.leer_linea().split(":")
+            if respuesta != "RESEND":
                 break
-            sock.sendall(chunk)
+            operaciones_subida = None
+
+        if respuesta != "SAVED":
+            print("\n[Cliente] Otro dispositivo ha subido cambios: los tuyos se combinarán al salir.")
+            self.atrasado = True
+            return
+
+        self.version_base = int(version)
+        self.enviadas = operaciones
+
+        # MP3 nuevos: se ofrecen (BLOBS) y se suben por las conexiones de
+        # transferencia; si no hay, se quedan para el logout
+        manifiesto_local = calcular_manifiesto(self.carpeta_local)
+        mp3s = ficheros_distintos(manifiesto_local, self.manifiesto_servidor)
+        faltan = mp3s
+        if self.con_blobs:
+            oferta = {nombre: manifiesto_local[nombre]["hash"] for nombre in mp3s}
+            self.con.enviar_datos("OFERTA_SIZE", json.dumps(oferta).encode())
+            faltan = json.loads(self.con.leer_datos("FALTAN_SIZE").decode())
+
+        fallidos = faltan
+        if faltan and self.token is not None:
+            fallidos = transferir_en_paralelo(
+                self.host, self.token, faltan,
+                lambda c, nombre: subir_mp3(c, os.path.join(self.carpeta_local, nombre),
+                                            manifiesto_local[nombre]["hash"]))
+        for nombre in mp3s:
+            if nombre not in fallidos:
+                self.manifiesto_servidor[nombre] = manifiesto_local[nombre]
 
 
 # CLIENTE
@@ -64,43 +381,114 @@ def main():
     host = input("IP del servidor (enter = localhost): ").strip() or "localhost"
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((host, 9999))
+    sock.connect((host, PUERTO))
+    con = Conexion(sock)
 
     # 1. LOGIN
-    sock.sendall(f"LOGIN:{usuario}\n".encode())
-
-    resp = recibir_linea(sock)
+    # Anunciamos que sabemos hacer sincronización incremental (DELTA),
+    # transferencias por varias conexiones (PARALELO), metadata comprimida
+    # (ZLIB) o en formato binario (BIN), versiones de la biblioteca (VERSION)
+    # subida de solo las operaciones hechas (OPS), no subir los MP3 que el
+    # servidor ya tiene de otros usuarios (BLOBS) y subidas durante la
+    # sesión (CHECKPOINT)
+    con.enviar_linea(f"LOGIN:{usuario}:DELTA,PARALELO,ZLIB,BIN,VERSION,OPS,BLOBS,CHECKPOINT")
+
+    resp = con.leer_linea()
     if resp == "REJECTED":
         print("Ese usuario ya está siendo usado. Intenta más tarde.")
-        sock.close()
+        con.cerrar()
         return
 
+    # El servidor confirma las capacidades que entiende (OK:CAP1,CAP2)
+    capacidades_confirmadas = set(resp.split(":", 1)[1].split(",")) if ":" in resp else set()
+
     print("[Cliente] Conectado correctamente.")
 
+    # Token para las conexiones de transferencia: solo si el servidor
+    # entiende PARALELO (si no, no lo manda y todo va por esta conexión)
+    token = None
+    if "PARALELO" in capacidades_confirmadas:
+        token = con.leer_linea().split(":", 1)[1]
+
     # Carpeta local
     carpeta_local = f"datos_cliente_{usuario}"
     os.makedirs(carpeta_local, exist_ok=True)
 
-    # 2. RECIBIR METADATA
-    linea = recibir_linea(sock)
-    size = int(linea.split(":")[1])
-    metadata = sock.recv(size).decode()
+    # 2. RECIBIR METADATA (y la versión sobre la que vamos a trabajar)
+    cabecera = con.leer_linea()
+    version_base = None
+    if cabecera.startswith("VERSION:"):
+        version_base = int(cabecera.split(":")[1])
+        cabecera = con.leer_linea()
+
+    tam, etiqueta = leer_cabecera_tam(cabecera, "METADATA_SIZE")
+    data = decodificar_metadata(con.leer_exacto(tam), etiqueta)
+
+    # Al subir usaremos solo los formatos que el servidor ha usado con nosotros
+    capacidades_servidor = capacidades_de_etiqueta(etiqueta) | (capacidades_confirmadas & {"OPS"})
 
-    data = json.loads(metadata)
     plataforma = PlataformaMusical.from_dict(data, carpeta_local)
 
-    # 3. RECIBIR MP3
-    linea = recibir_linea(sock)
+    # 3. RECIBIR MP3 (solo los que faltan o han cambiado)
+    manifiesto_servidor = json.loads(con.leer_datos("MANIFEST_SIZE").decode())
+
+    manifiesto_local = calcular_manifiesto(carpeta_local)
+    pedidos = ficheros_distintos(manifiesto_servidor, manifiesto_local)
+    hashes_servidor = {nombre: info["hash"] for nombre, info in manifiesto_servidor.items()}
+
+    # Bajo demanda solo se piden ahora los que tenemos en una versión
+    # distinta de la del servidor; los que faltan se traen al reproducirlos
+    cache_mp3 = None
+    if BAJO_DEMANDA and token is not None:
+        descargar = descargar_progresivo if REPRODUCCION_PROGRESIVA else descargar_bajo_demanda
+        cache_mp3 = CacheMP3(
+            carpeta_local, MAX_BYTES_CACHE_MP3,
+            lambda nombre: descargar(host, token, nombre, carpeta_local, hashes_servidor),
+            manifiesto_servidor)
+        Cancion.proveedor_mp3 = cache_mp3.obtener
+        pedidos = [nombre for nombre in pedidos if nombre in manifiesto_local]
+
+    # Tiempo desde que se pide una canción hasta que suena
+    tiempos_primer_sonido = []
+
+    def al_empezar(cancion, segundos):
+        tiempos_primer_sonido.append(segundos)
+        print(f"[Cliente] Primer sonido en {segundos * 1000:.0f} ms")
+
+    Cancion.al_empezar = al_empezar
+
+    # Descargamos en paralelo; lo que falle se pide por la conexión principal
+    if len(pedidos) > 1 and token is not None:
+        pedidos = transferir_en_paralelo(
+            host, token, pedidos,
+            lambda c, nombre: descargar_mp3(c, nombre, carpeta_local, hashes_servidor))
+
+    # Para cada MP3 pedido indicamos desde qué byte lo tenemos ya (.part)
+    pedidos = {nombre: tam_parcial(carpeta_local, nombre) for nombre in pedidos}
+    con.enviar_datos("PEDIR_SIZE", json.dumps(pedidos).encode())
+
+    linea = con.leer_linea()
     num_mp3 = int(linea.split(":")[1])
 
     for _ in range(num_mp3):
-        recibir_mp3(sock, carpeta_local)
+        recibir_mp3(con, carpeta_local, hashes_servidor)
+
+    if cache_mp3 is not None:
+        cache_mp3.liberar()
 
     # === HISTORIAL DE ESTADOS (DESHACER / REHACER) ===
     historial = HistorialEstados()
     # Estado inicial: tras sincronizar con el servidor
     historial.inicializar_con_estado(copy.deepcopy(plataforma))
 
+    # Subidas en segundo plano mientras se usa el menú
+    puntos_control = None
+    if {"CHECKPOINT", "VERSION"} <= capacidades_confirmadas and version_base is not None:
+        puntos_control = PuntosControl(
+            con, host, token, carpeta_local, version_base,
+            capacidades_servidor, capacidades_confirmadas, manifiesto_servidor)
+        puntos_control.iniciar()
+
     # MENÚS
     while True:
         print("\n=== Plataforma Musical ===")
@@ -126,12 +514,14 @@ def main():
             # Guardamos el estado anterior como texto para detectar cambios
             estado_antes = json.dumps(plataforma.to_dict(), sort_keys=True)
 
-            menu_canciones(plataforma)
+            menu_canciones(plataforma, carpeta_local)
 
             estado_despues = json.dumps(plataforma.to_dict(), sort_keys=True)
             # Si ha cambiado algo, registramos nuevo estado en el historial
             if estado_despues != estado_antes:
                 historial.registrar_nuevo_estado(copy.deepcopy(plataforma))
+                if puntos_control is not None:
+                    puntos_control.cambio(plataforma)
 
         elif opc == "2":
             estado_antes = json.dumps(plataforma.to_dict(), sort_keys=True)
@@ -141,6 +531,8 @@ def main():
             estado_despues = json.dumps(plataforma.to_dict(), sort_keys=True)
             if estado_despues != estado_antes:
                 historial.registrar_nuevo_estado(copy.deepcopy(plataforma))
+                if puntos_control is not None:
+                    puntos_control.cambio(plataforma)
 
         elif opc == "3":
             menu_reproduccion(plataforma)
@@ -150,6 +542,8 @@ def main():
             if historial.puede_deshacer():
                 plataforma = historial.deshacer()
                 print("[Historial] Se ha deshecho la última acción.")
+                if puntos_control is not None:
+                    puntos_control.cambio(plataforma)
             else:
                 print("[Historial] No hay acciones que se puedan deshacer.")
 
@@ -158,6 +552,8 @@ def main():
             if historial.puede_rehacer():
                 plataforma = historial.rehacer()
                 print("[Historial] Se ha rehecho la última acción.")
+                if puntos_control is not None:
+                    puntos_control.cambio(plataforma)
             else:
                 print("[Historial] No hay acciones que se puedan rehacer.")
 
@@ -167,24 +563,56 @@ def main():
         else:
             print("Opción no válida. Intenta de nuevo.")
 
-    # 4. ENVIAR METADATA
-    metadata = json.dumps(plataforma.to_dict())
-    metadata_bytes = metadata.encode()
-
-    sock.sendall("UPLOAD_METADATA\n".encode())
-    sock.sendall(f"SIZE:{len(metadata_bytes)}\n".encode())
-    sock.sendall(metadata_bytes)
-
-    # 5. ENVIAR MP3
-    mp3s = [f for f in os.listdir(carpeta_local) if f.lower().endswith(".mp3")]
-
-    sock.sendall(f"NUM_MP3:{len(mp3s)}\n".encode())
+    # 4. ENVIAR METADATA (lo que no se haya subido ya en un punto de control)
+    enviadas = ()
+    if puntos_control is not None:
+        puntos_control.detener()
+        if puntos_control.error is not None:
+            print(f"[Cliente] Error en un punto de control: {puntos_control.error}")
+        version_base = puntos_control.version_base
+        enviadas = puntos_control.enviadas
+    subir_metadata(con, plataforma, version_base, capacidades_servidor, enviadas)
+
+    # 5. ENVIAR MP3 (solo los nuevos o modificados respecto al servidor)
+    manifiesto_local = calcular_manifiesto(carpeta_local)
+    mp3s = ficheros_distintos(manifiesto_local, manifiesto_servidor)
+    subidos = list(mp3s)
+
+    # De esos, el servidor no necesita los que ya tiene (por su contenido)
+    if "BLOBS" in capacidades_confirmadas:
+        oferta = {nombre: manifiesto_local[nombre]["hash"] for nombre in mp3s}
+        con.enviar_datos("OFERTA_SIZE", json.dumps(oferta).encode())
+        faltan = json.loads(con.leer_datos("FALTAN_SIZE").decode())
+        if len(faltan) < len(mp3s):
+            print(f"[Cliente] {len(mp3s) - len(faltan)} MP3 ya estaban en el servidor: no se suben.")
+        mp3s = faltan
+
+    # Subimos por las conexiones de transferencia (en paralelo y reanudables);
+    # lo que falle se envía entero por la conexión principal
+    if mp3s and token is not None:
+        mp3s = transferir_en_paralelo(
+            host, token, mp3s,
+            lambda c, nombre: subir_mp3(c, os.path.join(carpeta_local, nombre),
+                                        manifiesto_local[nombre]["hash"]))
+
+    con.enviar_linea(f"NUM_MP3:{len(mp3s)}")
     for mp3 in mp3s:
-        enviar_mp3(sock, os.path.join(carpeta_local, mp3))
+        enviar_mp3(con, os.path.join(carpeta_local, mp3))
 
     # 6. LOGOUT
-    sock.sendall("LOGOUT\n".encode())
-    sock.close()
+    con.enviar_linea("LOGOUT")
+    con.cerrar()
+
+    # Lo recién subido ya está en el servidor: cuenta para el límite de la caché
+    if cache_mp3 is not None:
+        cache_mp3.manifiesto_servidor = {**manifiesto_servidor, **{m: manifiesto_local[m] for m in subidos}}
+        cache_mp3.liberar()
+
+    if tiempos_primer_sonido:
+        tiempos_primer_sonido.sort()
+        print(f"[Cliente] Tiempo hasta el primer sonido ({len(tiempos_primer_sonido)} reproducciones): "
+              f"mediana {tiempos_primer_sonido[len(tiempos_primer_sonido) // 2] * 1000:.0f} ms, "
+              f"máximo {tiempos_primer_sonido[-1] * 1000:.0f} ms")
 
     print("Datos sincronizados correctamente. Adiós.")
 
@@ -0,0 +1,253 @@
+import json
+import struct
+import sys
+import zlib
+from array import array
+from protocolo import ErrorProtocolo
+
+
+# CODIFICACIÓN DE LA METADATA EN LA RED
+#
+# La biblioteca (PlataformaMusical.to_dict()) puede viajar de cuatro formas,
+# indicadas con una etiqueta tras el tamaño en la cabecera
+# ("METADATA_SIZE:<tam>:<etiqueta>" o "SIZE:<tam>:<etiqueta>"):
+#   json       -> texto JSON en UTF-8 (lo de siempre, sin etiqueta)
+#   json+zlib  -> texto JSON comprimido con zlib
+#   bin        -> formato binario compacto (ver codificar_binario)
+#   bin+zlib   -> formato binario comprimido con zlib
+# Cada extremo solo usa las variantes que el otro anunció en el LOGIN
+# (capacidades ZLIB y BIN); a un cliente antiguo le llega JSON plano.
+
+MAGIA_BINARIO = b"BIB1"
+NIVEL_ZLIB = 6
+# Lo más que puede ocupar una metadata al descomprimirla: unos pocos KB
+# comprimidos pueden ser gigas, y el servidor descomprime lo que le manden
+TAM_MAX_DESCOMPRIMIDO = 512 * 1024 * 1024
+
+
+class ErrorCodificacion(Exception):
+    pass
+
+
+# FORMATO BINARIO (por columnas)
+#
+#   "BIB1"
+#   tabla de cadenas: número de cadenas, bytes totales y las cadenas en UTF-8
+#                     separadas por '\0'
+#   canciones: n y seis columnas de n enteros (id, titulo, artista, duracion,
+#              genero, archivo)
+#   listas: m, una columna con el nombre de cada lista, otra con cuántos ids
+#           tiene y otra con todos los ids seguidos
+# Las cadenas son índices a la tabla, así un artista o género repetido en
+# miles de canciones se guarda una sola vez. Los enteros son de 32 bits en
+# little-endian; al ir por columnas se empaquetan y desempaquetan con array
+# en C en vez de campo a campo en Python, y zlib comprime mucho mejor.
+
+def _columna(valores):
+    try:
+        col = array("i", valores)
+    except (OverflowError, TypeError) as e:
+        raise ErrorCodificacion(f"Valor no representable en binario: {e}")
+    if sys.byteorder != "little":
+        col.byteswap()
+    return col.tobytes()
+
+
+def _sin_negativos(col, que):
+    """Los índices a la tabla de cadenas y las longitudes no pueden ser
+    negativos (cadenas[-1] daría otra cadena sin avisar)."""
+    if col and min(col) < 0:
+        raise ErrorCodificacion(f"Metadata binaria corrupta: {que} negativo")
+
+
+def _leer_columna(datos, pos, n):
+    col = array("i")
+    fin = pos + n * col.itemsize
+    if fin > len(datos):
+        raise ErrorCodificacion("Metadata binaria truncada")
+    col.frombytes(datos[pos:fin])
+    if sys.byteorder != "little":
+        col.byteswap()
+    return col, fin
+
+
+def codificar_binario(data):
+    cadenas = {}
+
+    def indice(texto):
+        if not isinstance(texto, str) or "\0" in texto:
+            raise ErrorCodificacion(f"Cadena no representable en binario: {texto!r}")
+        i = cadenas.get(texto)
+        if i is None:
+            i = cadenas[texto] = len(cadenas)
+        return i
+
+    canciones = data.get("canciones", [])
+    columnas_canciones = [
+        _columna([c["id"] for c in canciones]),
+        _columna([indice(c["titulo"]) for c in canciones]),
+        _columna([indice(c["artista"]) for c in canciones]),
+        _columna([c["duracion"] for c in canciones]),
+        _columna([indice(c["genero"]) for c in canciones]),
+        _columna([indice(c["archivo_mp3"]) for c in canciones]),
+    ]
+
+    listas = data.get("listas", [])
+    columnas_listas = [
+        _columna([indice(l["nombre"]) for l in listas]),
+        _columna([len(l.get("canciones", [])) for l in listas]),
+        _columna([id_c for l in listas for id_c in l.get("canciones", [])]),
+    ]
+
+    tabla = "\0".join(cadenas).encode()  # los dict conservan el orden de inserción
+
+    partes = [MAGIA_BINARIO, struct.pack("<II", len(cadenas), len(tabla)), tabla,
+              struct.pack("<I", len(canciones))]
+    partes += columnas_canciones
+    partes.append(struct.pack("<I", len(listas)))
+    partes += columnas_listas
+    return b"".join(partes)
+
+
+def decodificar_binario(datos):
+    if not datos.startswith(MAGIA_BINARIO):
+        raise ErrorCodificacion("No es metadata binaria")
+    try:
+        pos = len(MAGIA_BINARIO)
+        num_cadenas, tam_tabla = struct.unpack_from("<II", datos, pos)
+        pos += 8
+        cadenas = datos[pos:pos + tam_tabla].decode().split("\0") if num_cadenas else []
+        pos += tam_tabla
+        if len(cadenas) != num_cadenas:
+            raise ErrorCodificacion("Tabla de cadenas corrupta")
+
+        (n,) = struct.unpack_from("<I", datos, pos)
+        pos += 4
+        ids, pos = _leer_columna(datos, pos, n)
+        titulos, pos = _leer_columna(datos, pos, n)
+        artistas, pos = _leer_columna(datos, pos, n)
+        duraciones, pos = _leer_columna(datos, pos, n)
+        generos, pos = _leer_columna(datos, pos, n)
+        archivos, pos = _leer_columna(datos, pos, n)
+        for col in (titulos, artistas, generos, archivos):
+            _sin_negativos(col, "índice de cadena")
+
+        canciones = [
+            {
+                "id": id_cancion,
+                "titulo": cadenas[titulo],
+                "artista": cadenas[artista],
+                "duracion": duracion,
+                "genero": cadenas[genero],
+                "archivo_mp3": cadenas[archivo],
+            }
+            for id_cancion, titulo, artista, duracion, genero, archivo
+            in zip(ids, titulos, artistas, duraciones, generos, archivos)
+        ]
+
+        (m,) = struct.unpack_from("<I", datos, pos)
+        pos += 4
+        nombres, pos = _leer_columna(datos, pos, m)
+        longitudes, pos = _leer_columna(datos, pos, m)
+        _sin_negativos(nombres, "índice de cadena")
+        _sin_negativos(longitudes, "número de canciones de una lista")
+        todos_ids, pos = _leer_columna(datos, pos, sum(longitudes))
+
+        listas = []
+        inicio = 0
+        for nombre, longitud in zip(nombres, longitudes):
+            listas.append({"nombre": cadenas[nombre], "canciones": todos_ids[inicio:inicio + longitud].tolist()})
+            inicio += longitud
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ErrorCodificacion(f"Metadata binaria corrupta: {e}")
+
+    return {"canciones": canciones, "listas": listas}
+
+
+# NEGOCIACIÓN
+
+def codificar_metadata(data, capacidades):
+    """Codifica la biblioteca para enviarla a un extremo con esas capacidades.
+    'data' puede ser el diccionario o el texto JSON tal cual está en disco.
+    Devuelve (bytes, etiqueta)."""
+    etiqueta = "json"
+    cuerpo = None
+
+    if "BIN" in capacidades:
+        if isinstance(data, str):
+            data = json.loads(data)
+        try:
+            cuerpo = codificar_binario(data)
+            etiqueta = "bin"
+        except (ErrorCodificacion, KeyError, TypeError):
+            # Algo que el formato binario no sabe representar: va en JSON
+            cuerpo = None
+
+    if cuerpo is None:
+        cuerpo = (data if isinstance(data, str) else json.dumps(data)).encode()
+
+    if "ZLIB" in capacidades:
+        cuerpo = zlib.compress(cuerpo, NIVEL_ZLIB)
+        etiqueta += "+zlib"
+
+    return cuerpo, etiqueta
+
+
+def decodificar_metadata(cuerpo, etiqueta):
+    """Inverso de codificar_metadata: devuelve el diccionario de la biblioteca."""
+    etiqueta = etiqueta or "json"
+    formato, _, compresion = etiqueta.partition("+")
+
+    if compresion == "zlib":
+        descompresor = zlib.decompressobj()
+        try:
+            cuerpo = descompresor.decompress(cuerpo, TAM_MAX_DESCOMPRIMIDO)
+        except zlib.error as e:
+            raise ErrorCodificacion(f"Metadata comprimida corrupta: {e}")
+        if descompresor.unconsumed_tail:
+            raise ErrorCodificacion(f"La metadata descomprimida pasa de {TAM_MAX_DESCOMPRIMIDO} bytes")
+    elif compresion:
+        raise ErrorCodificacion(f"Compresión desconocida: {compresion}")
+
+    if formato == "bin":
+        return decodificar_binario(cuerpo)
+    if formato == "json":
+        return json.loads(cuerpo.decode())
+    raise ErrorCodificacion(f"Formato desconocido: {formato}")
+
+
+def decodificar_a_json(cuerpo, etiqueta):
+    """Como decodificar_metadata pero devuelve el texto JSON. Si ya venía en
+    JSON plano se devuelve tal cual, sin volver a generarlo."""
+    if (etiqueta or "json") == "json":
+        return cuerpo.decode()
+    return json.dumps(decodificar_metadata(cuerpo, etiqueta))
+
+
+def capacidades_de_etiqueta(etiqueta):
+    """Capacidades que demuestra tener quien envió algo con esa etiqueta.
+    El cliente solo sube en los formatos que el servidor ya ha usado con él,
+    así un servidor antiguo siempre recibe JSON plano."""
+    capacidades = set()
+    formato, _, compresion = (etiqueta or "json").partition("+")
+    if formato == "bin":
+        capacidades.add("BIN")
+    if compresion == "zlib":
+        capacidades.add("ZLIB")
+    return capacidades
+
+
+def cabecera_tam(prefijo, cuerpo, etiqueta="json"):
+    """Cabecera 'PREFIJO:<tam>[:<etiqueta>]' (sin etiqueta si es JSON plano)."""
+    if etiqueta == "json":
+        return f"{prefijo}:{len(cuerpo)}\n".encode()
+    return f"{prefijo}:{len(cuerpo)}:{etiqueta}\n".encode()
+
+
+def leer_cabecera_tam(cabecera, prefijo):
+    """Separa 'PREFIJO:<tam>[:<etiqueta>]' en (tam, etiqueta)."""
+    if not cabecera.startswith(prefijo + ":"):
+        raise ErrorProtocolo(f"Protocolo inválido (se esperaba {prefijo})")
+    partes = cabecera.split(":")
+    etiqueta = partes[2] if len(partes) > 2 else "json"
+    return int(partes[1]), etiqueta
@@ -0,0 +1,142 @@
+import io
+import threading
+from protocolo import leer_cabeceras_mp3, abrir_parcial, terminar_parcial
+
+
+# DESCARGA PROGRESIVA (REPRODUCIR MIENTRAS SE DESCARGA)
+#
+# DescargaProgresiva recibe un MP3 en un hilo aparte, a trozos, en su .part
+# de siempre (así sigue siendo reanudable) y va anotando cuántos bytes hay
+# ya en disco. FicheroCreciente es un fichero de solo lectura sobre ese .part
+# que, si se le pide algo que aún no ha llegado, espera a que llegue: se le
+# puede pasar a pygame.mixer.music.load en cuanto hay un prefijo suficiente
+# y la reproducción empieza sin esperar al fichero entero.
+#
+# Al terminar, el .part se renombra al nombre definitivo como en
+# recibir_mp3; el FicheroCreciente sigue leyendo del mismo fichero abierto.
+# Para que no se renombre entre que se decide abrir el .part y se abre, las
+# dos cosas se hacen con el cerrojo cogido y el renombrado se anuncia
+# (_renombrando) también con el cerrojo antes de hacerse.
+
+TAM_TROZO = 64 * 1024
+
+
+class DescargaProgresiva:
+    def __init__(self, con, carpeta_destino, hashes=None, al_terminar=None):
+        """'con' es una conexión a la que ya se ha pedido el MP3 (GET).
+        al_terminar(descarga) se llama al acabar, haya ido bien o no."""
+        self.con = con
+        self.carpeta_destino = carpeta_destino
+        self.hashes = hashes
+        self.al_terminar = al_terminar
+        self._cond = threading.Condition()
+        self.nombre = None
+        self.ruta_parcial = None
+        self.ruta = None            # ruta final, cuando ha terminado bien
+        self.total = None           # tamaño completo del MP3
+        self.disponibles = 0        # bytes del principio del fichero que ya están en disco
+        self.terminada = False
+        self.error = None
+        self._renombrando = False   # ya no se pueden abrir lectores sobre el .part
+
+    def iniciar(self):
+        threading.Thread(target=self._descargar, daemon=True).start()
+
+    def _descargar(self):
+        try:
+            cabeceras = leer_cabeceras_mp3(self.con)
+            if cabeceras is None:
+                raise Exception("El servidor no tiene ese MP3")
+            desde, size, nombre = cabeceras
+
+            f, ruta_parcial, ruta = abrir_parcial(self.carpeta_destino, nombre, desde)
+            with self._cond:
+                self.nombre = nombre
+                self.ruta_parcial = ruta_parcial
+                self.total = desde + size
+                self.disponibles = desde
+                self._cond.notify_all()
+
+            with f:
+                restantes = size
+                while restantes > 0:
+                    n = min(TAM_TROZO, restantes)
+                    self.con.recibir_en_fichero(f, n)
+                    f.flush()
+                    restantes -= n
+                    with self._cond:
+                        self.disponibles += n
+                        self._cond.notify_all()
+
+            with self._cond:
+                self._renombrando = True
+            hash_esperado = self.hashes.get(nombre) if self.hashes else None
+            self.ruta = terminar_parcial(ruta_parcial, ruta, desde, hash_esperado)
+            if self.ruta is None:
+                raise Exception(f"{nombre} no coincide con el del servidor")
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.terminada = True
+                self._cond.notify_all()
+            if self.al_terminar is not None:
+                self.al_terminar(self)
+
+    def esperar(self, hasta):
+        """Espera a que estén en disco los primeros 'hasta' bytes (o el
+        fichero entero si es más pequeño). Devuelve False si la descarga
+        ha fallado antes."""
+        with self._cond:
+            while not self.terminada and (self.total is None or self.disponibles < min(hasta, self.total)):
+                self._cond.wait()
+            return self.error is None or (self.total is not None and self.disponibles >= min(hasta, self.total))
+
+    def abrir(self):
+        """Fichero para leer el MP3 mientras se descarga, o None si la
+        descarga ya ha terminado (o está terminando): entonces el MP3 está
+        en self.ruta, o self.ruta es None si ha fallado."""
+        with self._cond:
+            if not self._renombrando:
+                try:
+                    return FicheroCreciente(self, open(self.ruta_parcial, "rb"))
+                except FileNotFoundError:
+                    pass  # El .part ya no está: se espera al final
+            while not self.terminada:
+                self._cond.wait()
+            return None
+
+
+class FicheroCreciente(io.RawIOBase):
+    def __init__(self, descarga, f):
+        """'f' es el .part de la descarga, ya abierto para leer."""
+        self.descarga = descarga
+        self._f = f
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            offset += self.descarga.total
+            whence = io.SEEK_SET
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def readinto(self, b):
+        pos = self._f.tell()
+        descarga = self.descarga
+        with descarga._cond:
+            while not descarga.terminada and descarga.disponibles < min(pos + len(b), descarga.total):
+                descarga._cond.wait()
+        return self._f.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
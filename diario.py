@@ -0,0 +1,338 @@
+import json
+import os
+import struct
+import threading
+import zlib
+
+
+# DIARIO DE ESCRITURAS (write-ahead log con confirmación en grupo)
+#
+# Las escrituras de metadata del servidor (biblioteca.json y el historial de
+# versiones) no se hacen directamente sobre los ficheros: cada sesión manda
+# su lista de escrituras al diario y espera. Una de las sesiones que esperan
+# junta todo lo pendiente y lo añade a diario.log con un solo fsync para
+# todas (group commit) y después se aplican a los ficheros de verdad:
+#   ("reemplazar", ruta, datos)         -> fichero temporal + os.replace
+#   ("escribir", ruta, offset, datos)   -> escribe los datos en ese offset
+#   ("borrar", ruta)                    -> borra el fichero si existe
+# Las tres son idempotentes, así que si el servidor se cae se vuelven a
+# aplicar en orden todas las del diario al arrancar (recuperar). Los
+# ficheros aplicados no se sincronizan uno a uno: cada cierto tamaño el
+# diario pasa a <ruta>.viejo, se sigue en uno vacío y un hilo aparte hace el
+# checkpoint del viejo (fsync de los ficheros que tocaron sus registros) y
+# lo borra. Así las sesiones no esperan a esos fsync; al recuperar se
+# aplica primero el viejo, si quedó, y luego el actual.
+#
+# Formato de diario.log, un registro por lista de escrituras:
+#   <tam:u32><crc32:u32> cabecera_tam:u32, cabecera JSON
+#                        [[tipo, ruta, offset, tam_datos], ...] y los datos
+# Un registro incompleto o con CRC erróneo (caída a mitad) se descarta.
+
+REEMPLAZAR = "reemplazar"
+ESCRIBIR = "escribir"
+BORRAR = "borrar"
+
+TAM_CHECKPOINT = 8 * 1024 * 1024
+
+
+# APLICAR ESCRITURAS
+
+def aplicar_escrituras(escrituras):
+    """Aplica una lista de escrituras sobre los ficheros (sin fsync)."""
+    for escritura in escrituras:
+        tipo, ruta = escritura[0], escritura[1]
+        if tipo == REEMPLAZAR:
+            ruta_tmp = ruta + ".tmp"
+            with open(ruta_tmp, "wb") as f:
+                f.write(escritura[2])
+            os.replace(ruta_tmp, ruta)
+        elif tipo == ESCRIBIR:
+            offset, datos = escritura[2], escritura[3]
+            modo = "r+b" if os.path.exists(ruta) else "wb"
+            with open(ruta, modo) as f:
+                f.seek(offset)
+                f.write(datos)
+        elif tipo == BORRAR:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        else:
+            raise ValueError(f"Escritura desconocida: {tipo}")
+
+
+def _fsync_ruta(ruta):
+    try:
+        fd = os.open(ruta, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sincronizar(rutas):
+    """fsync de los ficheros y de sus carpetas (por los rename)."""
+    carpetas = set()
+    for ruta in rutas:
+        _fsync_ruta(ruta)
+        carpetas.add(os.path.dirname(ruta) or ".")
+    for carpeta in carpetas:
+        _fsync_ruta(carpeta)
+
+
+# FORMATO DE LOS REGISTROS
+
+def _codificar_registro(escrituras):
+    cabecera = []
+    datos = []
+    for escritura in escrituras:
+        tipo, ruta = escritura[0], escritura[1]
+        if tipo == REEMPLAZAR:
+            offset, contenido = 0, escritura[2]
+        elif tipo == ESCRIBIR:
+            offset, contenido = escritura[2], escritura[3]
+        else:
+            offset, contenido = 0, b""
+        cabecera.append([tipo, ruta, offset, len(contenido)])
+        datos.append(contenido)
+
+    cabecera = json.dumps(cabecera).encode()
+    cuerpo = struct.pack("<I", len(cabecera)) + cabecera + b"".join(datos)
+    return struct.pack("<II", len(cuerpo), zlib.crc32(cuerpo)) + cuerpo
+
+
+def _decodificar_registro(cuerpo):
+    (tam_cabecera,) = struct.unpack_from("<I", cuerpo)
+    pos = 4 + tam_cabecera
+    escrituras = []
+    for tipo, ruta, offset, tam in json.loads(cuerpo[4:pos].decode()):
+        contenido = cuerpo[pos:pos + tam]
+        pos += tam
+        if tipo == REEMPLAZAR:
+            escrituras.append((REEMPLAZAR, ruta, contenido))
+        elif tipo == ESCRIBIR:
+            escrituras.append((ESCRIBIR, ruta, offset, contenido))
+        else:
+            escrituras.append((tipo, ruta))
+    return escrituras
+
+
+def leer_registros(ruta):
+    """Devuelve las listas de escrituras completas que hay en el diario."""
+    registros = []
+    if not os.path.exists(ruta):
+        return registros
+
+    with open(ruta, "rb") as f:
+        contenido = f.read()
+
+    pos = 0
+    while pos + 8 <= len(contenido):
+        tam, crc = struct.unpack_from("<II", contenido, pos)
+        cuerpo = contenido[pos + 8:pos + 8 + tam]
+        if len(cuerpo) < tam or zlib.crc32(cuerpo) != crc:
+            break  # Registro a medio escribir: aquí termina lo confirmado
+        registros.append(_decodificar_registro(cuerpo))
+        pos += 8 + tam
+    return registros
+
+
+# DIARIO
+
+class Diario:
+    """Diario de escrituras compartido por todas las sesiones.
+    Uso: recuperar() al arrancar, iniciar() y luego confirmar(escrituras)
+    desde cualquier hilo; confirmar vuelve cuando las escrituras son
+    duraderas y ya están aplicadas.
+
+    Confirmación en grupo sin hilo propio: la primera sesión que llega
+    cuando nadie está escribiendo hace de líder, escribe en el diario lo de
+    todas las que esperan y hace un único fsync; las demás solo esperan.
+    Después cada sesión aplica sus propias escrituras en su hilo (cada una
+    toca los ficheros de un usuario distinto, así que el orden entre ellas
+    no importa).
+
+    El checkpoint tampoco para a las sesiones: el líder solo cambia de
+    fichero y el hilo del checkpoint espera a que estén aplicados los
+    registros del diario viejo (los primeros _limite_viejo) antes de
+    sincronizar sus ficheros. Hasta que termina no se vuelve a cambiar.
+    """
+
+    def __init__(self, ruta, tam_checkpoint=TAM_CHECKPOINT):
+        self.ruta = ruta
+        self.ruta_vieja = ruta + ".viejo"
+        self.tam_checkpoint = tam_checkpoint
+        self._cond = threading.Condition()
+        self._f = None
+        self._pendientes = []      # registros codificados esperando al líder
+        self._encolados = 0        # número de registros recibidos
+        self._confirmados = 0      # número de registros ya duraderos
+        self._escribiendo = False  # hay un líder escribiendo
+        self._aplicados = 0        # número de registros ya aplicados a los ficheros
+        self._error = None         # si un fsync falla el diario deja de aceptar
+        self._tocadas = set()      # rutas aplicadas desde el último checkpoint
+        self._rotando = False      # hay un checkpoint del diario viejo en marcha
+        self._limite_viejo = 0     # los registros hasta este están en el viejo
+        self._pendientes_viejo = 0  # de esos, cuántos faltan por aplicar
+        self._tocadas_viejo = set()  # rutas que tocaron los del viejo
+
+        # Estadísticas
+        self.confirmaciones = 0
+        self.grupos = 0
+        self.checkpoints = 0
+
+    def recuperar(self):
+        """Vuelve a aplicar lo que quedó en el diario y lo vacía. Devuelve
+        cuántos registros se han aplicado."""
+        registros = leer_registros(self.ruta_vieja) + leer_registros(self.ruta)
+        for escrituras in registros:
+            aplicar_escrituras(escrituras)
+            self._tocadas.update(e[1] for e in escrituras)
+        self._checkpoint()
+        return len(registros)
+
+    def iniciar(self):
+        self._f = open(self.ruta, "ab")
+
+    def confirmar(self, escrituras):
+        if not escrituras:
+            return
+        registro = _codificar_registro(escrituras)
+
+        with self._cond:
+            if self._f is None:
+                raise Exception("El diario no está abierto")
+            self._pendientes.append(registro)
+            self._encolados += 1
+            mio = self._encolados
+
+            while self._confirmados < mio and self._error is None:
+                if self._escribiendo:
+                    self._cond.wait()
+                else:
+                    self._escribir_grupo()
+
+            if self._error is not None:
+                raise Exception(f"El diario no está disponible: {self._error}")
+
+        try:
+            aplicar_escrituras(escrituras)
+        finally:
+            with self._cond:
+                self._aplicados += 1
+                rutas = [e[1] for e in escrituras]
+                self._tocadas.update(rutas)
+                if mio <= self._limite_viejo:
+                    self._tocadas_viejo.update(rutas)
+                    self._pendientes_viejo -= 1
+                self._cond.notify_all()
+
+    def _escribir_grupo(self):
+        """Se llama como líder con el cerrojo cogido; lo suelta mientras
+        escribe para que se sigan encolando registros."""
+        self._escribiendo = True
+
+        # Lo confirmado hasta ahora se queda en el diario viejo; lo aplicado
+        # ya tocó sus rutas, lo que falte las añade al aplicarse
+        rotar = self._f.tell() >= self.tam_checkpoint and not self._rotando
+        if rotar:
+            self._rotando = True
+            self._limite_viejo = self._confirmados
+            self._pendientes_viejo = self._confirmados - self._aplicados
+            self._tocadas_viejo, self._tocadas = self._tocadas, set()
+
+        grupo, self._pendientes = self._pendientes, []
+        hasta = self._encolados
+
+        self._cond.release()
+        try:
+            if rotar:
+                self._rotar()
+            self._f.write(b"".join(grupo))
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self._cond.acquire()
+
+        self._escribiendo = False
+        if error is not None:
+            # No se sabe qué ha llegado al disco: no se acepta nada más
+            self._error = error
+            self._rotando = False
+        else:
+            self._confirmados = hasta
+            self.confirmaciones += len(grupo)
+            self.grupos += 1
+            if rotar:
+                threading.Thread(target=self._checkpoint_viejo, daemon=True).start()
+        self._cond.notify_all()
+
+    def _rotar(self):
+        """Pasa el diario a ruta_vieja y sigue en uno vacío (lo hace el
+        líder, sin el cerrojo)."""
+        self._f.close()
+        os.replace(self.ruta, self.ruta_vieja)
+        self._f = open(self.ruta, "ab")
+        _fsync_ruta(os.path.dirname(self.ruta) or ".")
+
+    def _checkpoint_viejo(self):
+        with self._cond:
+            while self._pendientes_viejo > 0:
+                self._cond.wait()
+            tocadas, self._tocadas_viejo = self._tocadas_viejo, set()
+
+        try:
+            _sincronizar(tocadas)
+            os.remove(self.ruta_vieja)
+            _fsync_ruta(os.path.dirname(self.ruta) or ".")
+            error = None
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            self._rotando = False
+            if error is not None:
+                self._error = error
+            else:
+                self.checkpoints += 1
+            self._cond.notify_all()
+
+    def cerrar(self):
+        with self._cond:
+            while self._escribiendo or self._rotando or self._aplicados < self._confirmados:
+                self._cond.wait()
+            if self._f is not None:
+                if self._error is None:
+                    self._checkpoint()
+                self._f.close()
+                self._f = None
+
+    def _checkpoint(self):
+        """Sincroniza los ficheros tocados y vacía el diario (y borra el
+        viejo, si quedó de una caída)."""
+        _sincronizar(self._tocadas)
+        self._tocadas = set()
+
+        if self._f is not None:
+            self._f.truncate(0)
+            self._f.seek(0)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        else:
+            with open(self.ruta, "wb") as f:
+                os.fsync(f.fileno())
+        if os.path.exists(self.ruta_vieja):
+            os.remove(self.ruta_vieja)
+            _fsync_ruta(os.path.dirname(self.ruta) or ".")
+        self.checkpoints += 1
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "confirmaciones": self.confirmaciones,
+                "grupos": self.grupos,
+                "checkpoints": self.checkpoints,
+            }
@@ -0,0 +1,259 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from codificacion import leer_cabecera_tam
+from protocolo import ErrorProtocolo
+
+
+# ESTADÍSTICAS DEL SERVIDOR
+#
+# Cada sesión marca en qué fase del protocolo está (operación FASE de
+# sesion_cliente) y el motor que la ejecuta mide, por fase, el tiempo y los
+# bytes recibidos y enviados por la conexión. Además se cuentan las
+# sesiones, los errores por tipo y una serie de medidores (sesiones
+# activas, hilos, caché, diario...) que se leen en el momento de consultar.
+# Se pueden ver:
+#   - con la orden STATS por el mismo puerto del servidor (JSON) o
+#     STATS:PROMETHEUS (formato de texto de Prometheus)
+#   - en un fichero de texto de Prometheus que se reescribe cada cierto
+#     tiempo (--stats-fichero)
+#   - con "python estadisticas.py [host] [puerto]"
+
+# Fases de una sesión principal
+LOGIN = "login"
+DESCARGA_METADATA = "descarga_metadata"
+DESCARGA_MP3 = "descarga_mp3"
+EDICION = "edicion"                   # el usuario trabaja con el menú
+SUBIDA_METADATA = "subida_metadata"
+SUBIDA_MP3 = "subida_mp3"
+PUNTO_CONTROL = "punto_control"       # subida en segundo plano mientras se edita
+LOGOUT = "logout"
+
+# Fases de una conexión extra de transferencia (una por fichero)
+TRANSFERENCIA_DESCARGA = "transferencia_descarga"
+TRANSFERENCIA_SUBIDA = "transferencia_subida"
+
+# Límites superiores (segundos) de las cubetas del histograma de duraciones
+LIMITES = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300)
+
+PREFIJO = "sync"
+
+
+class EstadisticasFase:
+    def __init__(self):
+        self.veces = 0
+        self.segundos = 0.0
+        self.bytes_recibidos = 0
+        self.bytes_enviados = 0
+        self.cubetas = [0] * (len(LIMITES) + 1)  # la última es +Inf
+
+    def registrar(self, segundos, recibidos, enviados):
+        self.veces += 1
+        self.segundos += segundos
+        self.bytes_recibidos += recibidos
+        self.bytes_enviados += enviados
+        for i, limite in enumerate(LIMITES):
+            if segundos <= limite:
+                self.cubetas[i] += 1
+                break
+        else:
+            self.cubetas[-1] += 1
+
+    def to_dict(self):
+        return {
+            "veces": self.veces,
+            "segundos": round(self.segundos, 6),
+            "media_ms": round(self.segundos / self.veces * 1000, 3) if self.veces else 0,
+            "bytes_recibidos": self.bytes_recibidos,
+            "bytes_enviados": self.bytes_enviados,
+        }
+
+
+class Estadisticas:
+    """Contadores del servidor, seguros entre hilos."""
+
+    def __init__(self):
+        self._cerrojo = threading.Lock()
+        self.inicio = time.time()
+        self.fases = {}            # nombre -> EstadisticasFase
+        self.errores = {}          # tipo -> número
+        self.sesiones_totales = 0
+        self.sesiones_activas = 0
+        self._medidores = {}       # nombre -> (ayuda, función sin argumentos)
+
+    def registrar_fase(self, fase, segundos, recibidos=0, enviados=0):
+        with self._cerrojo:
+            estadisticas = self.fases.get(fase)
+            if estadisticas is None:
+                estadisticas = self.fases[fase] = EstadisticasFase()
+            estadisticas.registrar(segundos, recibidos, enviados)
+
+    def registrar_error(self, tipo):
+        with self._cerrojo:
+            self.errores[tipo] = self.errores.get(tipo, 0) + 1
+
+    def sesion_abierta(self):
+        with self._cerrojo:
+            self.sesiones_totales += 1
+            self.sesiones_activas += 1
+
+    def sesion_cerrada(self):
+        with self._cerrojo:
+            self.sesiones_activas -= 1
+
+    def registrar_medidor(self, nombre, ayuda, funcion):
+        """Valor que se lee al consultar. 'funcion' devuelve un número o un
+        dict {etiqueta: número} (un medidor por etiqueta)."""
+        self._medidores[nombre] = (ayuda, funcion)
+
+    def _leer_medidores(self):
+        valores = {}
+        for nombre, (_, funcion) in self._medidores.items():
+            try:
+                valores[nombre] = funcion()
+            except Exception:
+                continue  # Un medidor roto no puede tumbar la consulta
+        return valores
+
+    def instantanea(self):
+        with self._cerrojo:
+            datos = {
+                "segundos_activo": round(time.time() - self.inicio, 3),
+                "sesiones_totales": self.sesiones_totales,
+                "sesiones_activas": self.sesiones_activas,
+                "fases": {nombre: f.to_dict() for nombre, f in self.fases.items()},
+                "errores": dict(self.errores),
+            }
+        datos["medidores"] = self._leer_medidores()
+        return datos
+
+    # FORMATO DE PROMETHEUS
+
+    def formato_prometheus(self):
+        lineas = []
+
+        def metrica(nombre, tipo, ayuda):
+            lineas.append(f"# HELP {PREFIJO}_{nombre} {ayuda}")
+            lineas.append(f"# TYPE {PREFIJO}_{nombre} {tipo}")
+
+        with self._cerrojo:
+            metrica("sesiones_totales", "counter", "Sesiones atendidas desde el arranque")
+            lineas.append(f"{PREFIJO}_sesiones_totales {self.sesiones_totales}")
+            metrica("sesiones_activas", "gauge", "Sesiones abiertas ahora")
+            lineas.append(f"{PREFIJO}_sesiones_activas {self.sesiones_activas}")
+
+            metrica("fase_segundos", "histogram", "Duración de cada fase del protocolo")
+            for nombre, f in self.fases.items():
+                acumulado = 0
+                for limite, n in zip(LIMITES, f.cubetas):
+                    acumulado += n
+                    lineas.append(f'{PREFIJO}_fase_segundos_bucket{{fase="{nombre}",le="{limite}"}} {acumulado}')
+                lineas.append(f'{PREFIJO}_fase_segundos_bucket{{fase="{nombre}",le="+Inf"}} {f.veces}')
+                lineas.append(f'{PREFIJO}_fase_segundos_sum{{fase="{nombre}"}} {f.segundos:.6f}')
+                lineas.append(f'{PREFIJO}_fase_segundos_count{{fase="{nombre}"}} {f.veces}')
+
+            metrica("fase_bytes_total", "counter", "Bytes recibidos y enviados en cada fase")
+            for nombre, f in self.fases.items():
+                lineas.append(f'{PREFIJO}_fase_bytes_total{{fase="{nombre}",sentido="recibidos"}} {f.bytes_recibidos}')
+                lineas.append(f'{PREFIJO}_fase_bytes_total{{fase="{nombre}",sentido="enviados"}} {f.bytes_enviados}')
+
+            metrica("errores_total", "counter", "Sesiones terminadas con error, por tipo")
+            for tipo, n in self.errores.items():
+                lineas.append(f'{PREFIJO}_errores_total{{tipo="{tipo}"}} {n}')
+
+        for nombre, valor in self._leer_medidores().items():
+            metrica(nombre, "gauge", self._medidores[nombre][0])
+            if isinstance(valor, dict):
+                for etiqueta, v in valor.items():
+                    lineas.append(f'{PREFIJO}_{nombre}{{clave="{etiqueta}"}} {v}')
+            else:
+                lineas.append(f"{PREFIJO}_{nombre} {valor}")
+
+        return "\n".join(lineas) + "\n"
+
+    def escribir_prometheus(self, ruta):
+        """Reescribe el fichero de golpe (temporal + rename) para que quien
+        lo lea nunca vea uno a medias."""
+        ruta_tmp = ruta + ".tmp"
+        with open(ruta_tmp, "w", encoding="utf-8") as f:
+            f.write(self.formato_prometheus())
+        os.replace(ruta_tmp, ruta)
+
+    def iniciar_volcado(self, ruta, cada_segundos):
+        """Hilo que escribe el fichero de Prometheus cada 'cada_segundos'."""
+        def volcar():
+            while True:
+                try:
+                    self.escribir_prometheus(ruta)
+                except OSError as e:
+                    print(f"[ERROR] No se pudieron escribir las estadísticas: {e}")
+                time.sleep(cada_segundos)
+
+        hilo = threading.Thread(target=volcar, daemon=True)
+        hilo.start()
+        return hilo
+
+
+class MedidorSesion:
+    """Mide una conexión fase a fase. La conexión tiene que llevar la
+    cuenta de bytes_recibidos y bytes_enviados."""
+
+    def __init__(self, estadisticas, con):
+        self.estadisticas = estadisticas
+        self.con = con
+        self.fase = None
+        self._inicio = 0.0
+        self._recibidos = 0
+        self._enviados = 0
+
+    def empezar(self, fase):
+        """Cierra la fase en curso (si hay) y empieza otra."""
+        self.terminar()
+        self.fase = fase
+        self._inicio = time.perf_counter()
+        self._recibidos = self.con.bytes_recibidos
+        self._enviados = self.con.bytes_enviados
+
+    def terminar(self):
+        if self.fase is None:
+            return
+        self.estadisticas.registrar_fase(
+            self.fase,
+            time.perf_counter() - self._inicio,
+            self.con.bytes_recibidos - self._recibidos,
+            self.con.bytes_enviados - self._enviados,
+        )
+        self.fase = None
+
+
+# CONSULTA DESDE FUERA
+
+def consultar(host, puerto, prometheus=False):
+    """Pide las estadísticas a un servidor en marcha (arrancado con
+    --stats-publicas)."""
+    with socket.create_connection((host, puerto)) as sock:
+        sock.sendall(b"STATS:PROMETHEUS\n" if prometheus else b"STATS\n")
+        datos = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            datos += chunk
+
+    cabecera, _, cuerpo = datos.partition(b"\n")
+    if cabecera == b"ERROR":
+        raise ErrorProtocolo("El servidor no responde a STATS (se arranca con --stats-publicas)")
+    tam, _ = leer_cabecera_tam(cabecera.decode(), "STATS_SIZE")
+    if len(cuerpo) != tam:
+        raise ErrorProtocolo(f"Estadísticas incompletas: {len(cuerpo)} de {tam} bytes")
+    return cuerpo.decode() if prometheus else json.loads(cuerpo.decode())
+
+
+if __name__ == "__main__":
+    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
+    puerto = int(sys.argv[2]) if len(sys.argv) > 2 else 9999
+    print(json.dumps(consultar(host, puerto), indent=2, ensure_ascii=False))
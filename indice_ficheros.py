@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+from manifiesto import hash_fichero
+
+
+# ÍNDICE DE FICHEROS DEL SERVIDOR
+#
+# Para no recorrer la carpeta de cada usuario (listdir + stat de cada MP3 +
+# .manifiesto.json) en cada login, el servidor guarda en una base de datos
+# SQLite (datos_server/indice.sqlite) los MP3 de cada usuario con su tamaño,
+# mtime y hash. La carpeta de un usuario solo se lee entera la primera vez
+# (usuario que aún no está en el índice); después el índice se actualiza
+# cada vez que el servidor pone un MP3 en ella (recibido o enlazado desde el
+# almacén) y el manifiesto, la lista de MP3 y los tamaños que se envían
+# salen de él.
+#
+# El índice solo puede quedarse atrás (si el servidor se cae entre poner el
+# fichero y anotarlo): el cliente ve el MP3 viejo o ninguno y lo vuelve a
+# subir. Si se tocan a mano los MP3 de un usuario hay que olvidarlo
+# (python indice_ficheros.py <usuario>) para que se vuelva a leer su carpeta.
+#
+# Con varios procesos trabajadores todos usan la misma base de datos (modo
+# WAL); cada usuario solo lo escribe su trabajador dueño.
+
+NOMBRE_INDICE = "indice.sqlite"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (
+    usuario TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS ficheros (
+    usuario TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    tam INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (usuario, nombre)
+);
+"""
+
+
+class IndiceFicheros:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        # Una conexión para todos los hilos (las consultas son muy cortas)
+        self._con = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._cerrojo = threading.Lock()
+        with self._cerrojo:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.executescript(ESQUEMA)
+        self.lecturas_carpeta = 0  # carpetas que se han tenido que recorrer
+
+    def conocido(self, carpeta_usuario):
+        """True si la carpeta del usuario ya se ha pasado al índice."""
+        usuario = os.path.basename(carpeta_usuario)
+        with self._cerrojo:
+            fila = self._con.execute("SELECT 1 FROM usuarios WHERE usuario = ?", (usuario,)).fetchone()
+        return fila is not None
+
+    def _leer_carpeta(self, carpeta_usuario):
+        """Recorre la carpeta (solo la primera vez) y la pasa al índice."""
+        usuario = os.path.basename(carpeta_usuario)
+        filas = []
+        if os.path.isdir(carpeta_usuario):
+            for entrada in os.scandir(carpeta_usuario):
+                if not entrada.name.lower().endswith(".mp3") or not entrada.is_file():
+                    continue
+                st = entrada.stat()
+                filas.append((usuario, entrada.name, st.st_size, st.st_mtime_ns, hash_fichero(entrada.path)))
+
+        with self._cerrojo, self._con:
+            self._con.execute("DELETE FROM ficheros WHERE usuario = ?", (usuario,))
+            self._con.executemany("INSERT INTO ficheros VALUES (?, ?, ?, ?, ?)", filas)
+            self._con.execute("INSERT OR IGNORE INTO usuarios VALUES (?)", (usuario,))
+        self.lecturas_carpeta += 1
+        return filas
+
+    def manifiesto(self, carpeta_usuario):
+        """Manifiesto (nombre -> {"tam", "hash"}) de los MP3 del usuario."""
+        usuario = os.path.basename(carpeta_usuario)
+        if not self.conocido(carpeta_usuario):
+            filas = self._leer_carpeta(carpeta_usuario)
+            return {nombre: {"tam": tam, "hash": h} for _, nombre, tam, _, h in filas}
+
+        with self._cerrojo:
+            filas = self._con.execute(
+                "SELECT nombre, tam, hash FROM ficheros WHERE usuario = ?", (usuario,)).fetchall()
+        return {nombre: {"tam": tam, "hash": h} for nombre, tam, h in filas}
+
+    def info(self, carpeta_usuario, nombre):
+        """(tam, hash) de un MP3 del usuario, o None si no lo tiene."""
+        if not self.conocido(carpeta_usuario):
+            info = self.manifiesto(carpeta_usuario).get(nombre)
+            return (info["tam"], info["hash"]) if info else None
+
+        with self._cerrojo:
+            return self._con.execute(
+                "SELECT tam, hash FROM ficheros WHERE usuario = ? AND nombre = ?",
+                (os.path.basename(carpeta_usuario), nombre)).fetchone()
+
+    def anotar(self, ruta, hash_mp3):
+        """Anota (o actualiza) un MP3 que el servidor acaba de poner en la
+        carpeta de un usuario. Si el usuario aún no está en el índice no
+        hace nada: se leerá su carpeta entera cuando haga falta."""
+        carpeta_usuario = os.path.dirname(ruta)
+        if not self.conocido(carpeta_usuario):
+            return
+        st = os.stat(ruta)
+        with self._cerrojo, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO ficheros VALUES (?, ?, ?, ?, ?)",
+                (os.path.basename(carpeta_usuario), os.path.basename(ruta), st.st_size, st.st_mtime_ns, hash_mp3))
+
+    def olvidar(self, usuario):
+        """Quita al usuario del índice (se volverá a leer su carpeta)."""
+        with self._cerrojo, self._con:
+            self._con.execute("DELETE FROM ficheros WHERE usuario = ?", (usuario,))
+            self._con.execute("DELETE FROM usuarios WHERE usuario = ?", (usuario,))
+
+    def estadisticas(self):
+        with self._cerrojo:
+            usuarios = self._con.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
+            ficheros = self._con.execute("SELECT COUNT(*) FROM ficheros").fetchone()[0]
+        return {"usuarios": usuarios, "ficheros": ficheros, "lecturas_carpeta": self.lecturas_carpeta}
+
+
+if __name__ == "__main__":
+    import sys
+    from servidor import BASE_DATOS
+
+    # python indice_ficheros.py <usuario>...: vuelve a leer sus carpetas en el siguiente login
+    indice = IndiceFicheros(os.path.join(BASE_DATOS, NOMBRE_INDICE))
+    for usuario in sys.argv[1:]:
+        indice.olvidar(usuario)
+        print(f"{usuario}: se leerá su carpeta en el próximo login.")
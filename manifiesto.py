@@ -0,0 +1,70 @@
+import hashlib
+import os
+import cache_json
+
+
+# MANIFIESTO DE FICHEROS MP3
+#
+# Un manifiesto es un diccionario nombre -> {"tam": bytes, "hash": sha256}
+# con los .mp3 de una carpeta. Cliente y servidor se intercambian sus
+# manifiestos para enviar solo los ficheros que faltan o han cambiado.
+
+NOMBRE_CACHE = ".manifiesto.json"
+TAM_BLOQUE_HASH = 1024 * 1024
+
+
+def hash_fichero(ruta):
+    """Calcula el sha256 (en hexadecimal) del contenido de un fichero."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        while True:
+            bloque = f.read(TAM_BLOQUE_HASH)
+            if not bloque:
+                break
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def calcular_manifiesto(carpeta):
+    """Devuelve el manifiesto de los .mp3 de la carpeta.
+    Para no leer ficheros enteros en cada sesión, el hash se guarda en una
+    caché (.manifiesto.json) y solo se recalcula si cambian tamaño o mtime.
+    """
+    if not os.path.isdir(carpeta):
+        return {}
+
+    ruta_cache = os.path.join(carpeta, NOMBRE_CACHE)
+    cache = cache_json.leer(ruta_cache)
+    nueva_cache = {}
+    manifiesto = {}
+
+    for nombre in os.listdir(carpeta):
+        if not nombre.lower().endswith(".mp3"):
+            continue
+
+        st = os.stat(os.path.join(carpeta, nombre))
+        previa = cache.get(nombre)
+        if previa and previa["tam"] == st.st_size and previa["mtime"] == st.st_mtime_ns:
+            h = previa["hash"]
+        else:
+            h = hash_fichero(os.path.join(carpeta, nombre))
+
+        nueva_cache[nombre] = {"tam": st.st_size, "mtime": st.st_mtime_ns, "hash": h}
+        manifiesto[nombre] = {"tam": st.st_size, "hash": h}
+
+    if nueva_cache != cache:
+        cache_json.guardar(ruta_cache, nueva_cache)
+
+    return manifiesto
+
+
+def ficheros_distintos(origen, destino):
+    """Devuelve los nombres del manifiesto 'origen' que no están en 'destino'
+    o que están con otro tamaño o contenido.
+    """
+    distintos = []
+    for nombre, info in origen.items():
+        otro = destino.get(nombre)
+        if otro is None or otro["tam"] != info["tam"] or otro["hash"] != info["hash"]:
+            distintos.append(nombre)
+    return distintos
@@ -0,0 +1,317 @@
+import bisect
+import heapq
+import itertools
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Set
+
+from musica.cancion import Cancion
+
+
+# BUSCADOR DE CANCIONES (índice invertido)
+#
+# Para cada palabra que aparece en el título, el artista o el género de
+# alguna canción se guardan los ids de las canciones que la tienen. Las
+# palabras se comparan sin mayúsculas ni tildes ("Canción" = "cancion").
+# Una búsqueda de varias palabras devuelve las canciones que las tienen
+# todas; la última puede ser solo el principio de una palabra ("beat" ->
+# "beatles"), para buscar mientras se escribe. Para los prefijos el
+# vocabulario se guarda además ordenado (se busca con bisect).
+#
+# Las duraciones tienen su propio índice (duración -> ids, con las
+# duraciones distintas ordenadas) para filtrar por rango sin recorrer todo.
+# Y los ids se guardan también ordenados por título: sin texto (lo que
+# muestra el menú al entrar) o con un prefijo muy corto que tienen muchas
+# canciones ("a"), con orden por título y límite, se recorre esa lista y se
+# para al tener las que hacen falta en vez de juntar o ordenar todas.
+# Como el vocabulario, se pone al día en la primera búsqueda que la usa.
+#
+# El índice se actualiza con cada canción que se añade, cambia o quita
+# (PlataformaMusical llama a anadir y quitar), así que el coste de una
+# búsqueda depende de cuántas canciones coinciden y no del tamaño del
+# catálogo.
+#
+# Limitación: esos recorridos en orden solo se hacen con orden por título
+# (sin filtro de duración) y con orden por duración (sin texto). Con los
+# demás órdenes, o un rango amplio ordenado por título, o un prefijo corto
+# ordenado por artista, hay que calcular la clave de todos los candidatos:
+# cuesta lo proporcional a las canciones que coinciden (decenas o cientos
+# de ms con un millón de canciones), no unos pocos ms.
+
+# Con menos candidatos que esto, el prefijo se comprueba en cada canción
+# en vez de juntar los ids de todas las palabras que empiezan así
+UMBRAL_FILTRO = 256
+# Con más ids que esto en las palabras de un prefijo (orden por título y
+# límite), se recorre la lista por título en vez de juntarlos
+UMBRAL_RECORRIDO = 20000
+# Con más títulos nuevos que esto se reordena la lista entera en vez de
+# insertarlos uno a uno
+MAX_INSERTAR = 1000
+
+ORDENES = {
+    "titulo": lambda c: (c.titulo.casefold(), c.id),
+    "artista": lambda c: (c.artista.casefold(), c.titulo.casefold(), c.id),
+    "duracion": lambda c: (c.duracion, c.id),
+    "id": lambda c: c.id,
+}
+
+_PALABRA = re.compile(r"\w+")
+
+
+def palabras(texto) -> List[str]:
+    """Palabras de un texto en minúsculas y sin tildes."""
+    texto = str(texto).casefold()
+    if not texto.isascii():
+        texto = "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+    return _PALABRA.findall(texto)
+
+
+def palabras_cancion(cancion: Cancion) -> Set[str]:
+    return set(palabras(cancion.titulo)) | set(palabras(cancion.artista)) | set(palabras(cancion.genero))
+
+
+class Buscador:
+    def __init__(self, canciones: Dict[int, Cancion]):
+        """'canciones' es el diccionario id -> Cancion de la plataforma (se
+        comparte, no se copia)."""
+        self.canciones = canciones
+        # palabra -> id (si solo la tiene una canción, que es lo más
+        # frecuente con los títulos) o conjunto de ids
+        self._indice: Dict[str, object] = {}
+        self._vocabulario: List[str] = []   # palabras ordenadas (puede haber alguna ya sin canciones)
+        self._nuevas: Set[str] = set()      # palabras aún sin pasar al vocabulario ordenado
+        self._por_duracion: Dict[object, Set[int]] = {}
+        self._duraciones: List = []         # duraciones distintas, ordenadas
+        self._por_titulo: List[int] = []    # ids ordenados por título (ORDENES["titulo"])
+        self._titulos_nuevos: List[int] = []  # ids aún sin pasar a _por_titulo
+        # id -> clave de título con la que está en _por_titulo, de las quitadas
+        self._titulos_quitados: Dict[int, tuple] = {}
+
+        for cancion in canciones.values():
+            self.anadir(cancion)
+
+    # MANTENIMIENTO
+
+    def anadir(self, cancion: Cancion) -> None:
+        for palabra in palabras_cancion(cancion):
+            ids = self._indice.get(palabra)
+            if ids is None:
+                self._indice[palabra] = cancion.id
+                self._nuevas.add(palabra)
+            elif type(ids) is int:
+                if ids != cancion.id:
+                    self._indice[palabra] = {ids, cancion.id}
+            else:
+                ids.add(cancion.id)
+
+        ids = self._por_duracion.get(cancion.duracion)
+        if ids is None:
+            self._por_duracion[cancion.duracion] = {cancion.id}
+            bisect.insort(self._duraciones, cancion.duracion)
+        else:
+            ids.add(cancion.id)
+
+        self._titulos_nuevos.append(cancion.id)
+
+    def quitar(self, cancion: Cancion) -> None:
+        """Quita la canción del índice. Hay que llamarla antes de cambiarle
+        los datos (se buscan sus palabras actuales)."""
+        for palabra in palabras_cancion(cancion):
+            ids = self._indice.get(palabra)
+            if ids is None:
+                continue
+            if type(ids) is int:
+                if ids == cancion.id:
+                    del self._indice[palabra]
+            else:
+                ids.discard(cancion.id)
+                if len(ids) == 1:
+                    self._indice[palabra] = next(iter(ids))
+
+        ids = self._por_duracion.get(cancion.duracion)
+        if ids is not None:
+            ids.discard(cancion.id)
+            if not ids:
+                del self._por_duracion[cancion.duracion]
+                posicion = bisect.bisect_left(self._duraciones, cancion.duracion)
+                del self._duraciones[posicion]
+
+        # Si se vuelve a añadir (al editarla) entra otra vez como nueva. La
+        # clave que vale es la de la primera vez: con la que está en la lista
+        self._titulos_quitados.setdefault(cancion.id, ORDENES["titulo"](cancion))
+
+    # CONSULTAS
+
+    def _ids(self, palabra: str) -> Set[int]:
+        ids = self._indice.get(palabra)
+        if ids is None:
+            return set()
+        return {ids} if type(ids) is int else ids
+
+    def _con_prefijo(self, prefijo: str) -> Iterable[str]:
+        """Palabras del índice que empiezan por 'prefijo'."""
+        if self._nuevas:
+            # Dos tramos ordenados: sort los junta en tiempo lineal. De paso
+            # se quitan las palabras que ya no tiene ninguna canción y las
+            # que se quitaron y han vuelto (están también en _nuevas).
+            self._vocabulario = [p for p in self._vocabulario if p in self._indice and p not in self._nuevas]
+            self._vocabulario.extend(sorted(self._nuevas))
+            self._vocabulario.sort()
+            self._nuevas.clear()
+
+        inicio = bisect.bisect_left(self._vocabulario, prefijo)
+        for palabra in itertools.islice(self._vocabulario, inicio, None):
+            if not palabra.startswith(prefijo):
+                break
+            if palabra in self._indice:
+                yield palabra
+
+    def _num_ids(self, palabra: str) -> int:
+        ids = self._indice.get(palabra)
+        return 1 if type(ids) is int else len(ids or ())
+
+    def _ordenar_titulos(self) -> None:
+        """Pone al día _por_titulo con las canciones añadidas y quitadas:
+        con pocas, una a una con bisect; con muchas, rehaciéndola."""
+        clave = ORDENES["titulo"]
+        quitados = self._titulos_quitados
+        if len(quitados) <= MAX_INSERTAR:
+            # Las que ya no están se buscan con la clave que tenían (las de
+            # _por_titulo que siguen ahí tienen la suya de siempre)
+            for i, clave_vieja in quitados.items():
+                posicion = bisect.bisect_left(self._por_titulo, clave_vieja,
+                                              key=lambda j: self._clave_titulo(j, clave))
+                if posicion < len(self._por_titulo) and self._por_titulo[posicion] == i:
+                    del self._por_titulo[posicion]
+        else:
+            self._por_titulo = [i for i in self._por_titulo if i not in quitados]
+        quitados.clear()
+
+        # Un id puede estar repetido (añadido, quitado y vuelto a añadir) o
+        # ser de una canción ya eliminada
+        nuevos = {i for i in self._titulos_nuevos if i in self.canciones}
+        self._titulos_nuevos.clear()
+        if len(nuevos) <= MAX_INSERTAR:
+            for i in nuevos:
+                bisect.insort(self._por_titulo, i, key=lambda j: clave(self.canciones[j]))
+        else:
+            self._por_titulo.extend(nuevos)
+            self._por_titulo.sort(key=lambda j: clave(self.canciones[j]))
+
+    def _clave_titulo(self, id_cancion, clave):
+        """Clave con la que está id_cancion en _por_titulo: la que tenía al
+        quitarla o, si no se ha quitado, la actual."""
+        vieja = self._titulos_quitados.get(id_cancion)
+        return vieja if vieja is not None else clave(self.canciones[id_cancion])
+
+    def _primeras_por_titulo(self, descendente, limite, filtro=None) -> List[Cancion]:
+        """Las 'limite' primeras por título que cumplen filtro(cancion),
+        recorriendo _por_titulo hasta tenerlas."""
+        self._ordenar_titulos()
+        resultado = []
+        if limite <= 0:
+            return resultado
+        for i in (reversed(self._por_titulo) if descendente else self._por_titulo):
+            cancion = self.canciones[i]
+            if filtro is None or filtro(cancion):
+                resultado.append(cancion)
+                if len(resultado) >= limite:
+                    break
+        return resultado
+
+    def _tramo(self, duracion_min, duracion_max):
+        """Posiciones [inicio, fin) de _duraciones dentro del rango."""
+        inicio = 0 if duracion_min is None else bisect.bisect_left(self._duraciones, duracion_min)
+        fin = len(self._duraciones) if duracion_max is None else bisect.bisect_right(self._duraciones, duracion_max)
+        return inicio, fin
+
+    def _por_rango(self, duracion_min, duracion_max) -> Set[int]:
+        inicio, fin = self._tramo(duracion_min, duracion_max)
+        ids = set()
+        for duracion in self._duraciones[inicio:fin]:
+            ids |= self._por_duracion[duracion]
+        return ids
+
+    def _primeras_por_duracion(self, duracion_min, duracion_max, descendente, limite) -> List[Cancion]:
+        """Las 'limite' primeras del rango por (duracion, id), recorriendo
+        las duraciones en orden hasta tenerlas."""
+        inicio, fin = self._tramo(duracion_min, duracion_max)
+        posiciones = range(fin - 1, inicio - 1, -1) if descendente else range(inicio, fin)
+        elegir = heapq.nlargest if descendente else heapq.nsmallest
+        resultado = []
+        for posicion in posiciones:
+            if len(resultado) >= limite:
+                break
+            ids = elegir(limite - len(resultado), self._por_duracion[self._duraciones[posicion]])
+            resultado.extend(self.canciones[i] for i in ids)
+        return resultado
+
+    def buscar(self, texto: str = "", duracion_min=None, duracion_max=None, orden: str = "titulo",
+               descendente: bool = False, limite: int | None = None, prefijo: bool = True) -> List[Cancion]:
+        """
+        Canciones que tienen todas las palabras de 'texto' (la última como
+        prefijo si 'prefijo') y duran entre duracion_min y duracion_max
+        (incluidos; None = sin límite), ordenadas por 'orden' (titulo,
+        artista, duracion o id) y como mucho 'limite'.
+        """
+        if orden not in ORDENES:
+            raise ValueError(f"Orden desconocido: {orden}")
+
+        buscadas = palabras(texto)
+        ultima = buscadas.pop() if prefijo and buscadas else None
+
+        # Palabras completas: se cruzan empezando por la que tienen menos canciones
+        candidatos = None  # None = todas
+        for ids in sorted((self._ids(p) for p in buscadas), key=len):
+            candidatos = set(ids) if candidatos is None else candidatos & ids
+            if not candidatos:
+                return []
+
+        sin_rango = duracion_min is None and duracion_max is None
+        en_orden_titulo = orden == "titulo" and limite is not None and sin_rango
+
+        if ultima is not None:
+            if candidatos is not None and len(candidatos) <= UMBRAL_FILTRO:
+                candidatos = {i for i in candidatos
+                              if any(p.startswith(ultima) for p in palabras_cancion(self.canciones[i]))}
+            else:
+                con_prefijo = list(self._con_prefijo(ultima))
+                if en_orden_titulo and sum(self._num_ids(p) for p in con_prefijo) > UMBRAL_RECORRIDO:
+                    # Prefijo muy corto: tantas canciones lo tienen que es
+                    # más rápido ir por orden de título comprobándolo
+                    completas = candidatos
+
+                    def filtro(c):
+                        return ((completas is None or c.id in completas)
+                                and any(p.startswith(ultima) for p in palabras_cancion(c)))
+                    return self._primeras_por_titulo(descendente, limite, filtro)
+
+                ids_prefijo = set()
+                for palabra in con_prefijo:
+                    ids_prefijo |= self._ids(palabra)
+                candidatos = ids_prefijo if candidatos is None else candidatos & ids_prefijo
+
+        if candidatos is None and en_orden_titulo:
+            return self._primeras_por_titulo(descendente, limite)
+
+        if candidatos is None and orden == "duracion" and limite is not None:
+            return self._primeras_por_duracion(duracion_min, duracion_max, descendente, limite)
+
+        if not sin_rango:
+            if candidatos is None:
+                candidatos = self._por_rango(duracion_min, duracion_max)
+            else:
+                candidatos = {i for i in candidatos
+                              if (duracion_min is None or self.canciones[i].duracion >= duracion_min)
+                              and (duracion_max is None or self.canciones[i].duracion <= duracion_max)}
+
+        clave = ORDENES[orden]
+        if candidatos is None:
+            resultado = self.canciones.values()  # sin filtros: todo el catálogo
+        else:
+            resultado = [self.canciones[i] for i in candidatos]
+
+        if limite is not None and limite < len(resultado):
+            elegir = heapq.nlargest if descendente else heapq.nsmallest
+            return elegir(limite, resultado, key=clave)
+        return sorted(resultado, key=clave, reverse=descendente)
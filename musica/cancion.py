@@ -1,13 +1,57 @@
 import pygame
 import os
+import sys
+import time
+
+
+def _compartir(texto):
+    """Devuelve la copia única (sys.intern) de un texto que se repite mucho
+    entre canciones, como el artista o el género."""
+    return sys.intern(texto) if type(texto) is str else texto
+
 
 class Cancion:
-    def __init__(self, id: int, titulo: str, artista: str, duracion: int, genero: str, archivo_mp3: str):
+    # Con catálogos de millones de canciones lo que más ocupa es cada objeto:
+    # sin __dict__ (solo estos huecos), con artista y género compartidos y
+    # con la carpeta de los MP3 guardada una vez (todas las canciones de
+    # from_dict apuntan al mismo texto) y no repetida en cada ruta
+    __slots__ = ("id", "titulo", "artista", "duracion", "genero", "_carpeta", "_archivo")
+
+    # Si se asigna, reproducir() la llama con la ruta del MP3 antes de
+    # abrirlo, para que lo traiga si no está en local (el cliente descarga
+    # así los MP3 bajo demanda). Devuelve lo que hay que reproducir: la ruta,
+    # un fichero que aún se está descargando o None si no se puede conseguir.
+    proveedor_mp3 = None
+    # Si se asigna, reproducir() la llama con la canción y los segundos que
+    # han pasado desde que se pidió hasta que empieza a sonar
+    al_empezar = None
+
+    def __init__(self, id: int, titulo: str, artista: str, duracion: int, genero: str, archivo_mp3: str,
+                 carpeta: str = ""):
         self.id = id
         self.titulo = titulo
-        self.artista = artista
+        self.artista = _compartir(artista)
+        self.duracion = duracion
+        self.genero = _compartir(genero)
+        self._carpeta = carpeta
+        self._archivo = archivo_mp3
+
+    @property
+    def archivo_mp3(self) -> str:
+        """Ruta del MP3 (la carpeta unida al nombre del fichero)."""
+        return os.path.join(self._carpeta, self._archivo) if self._carpeta else self._archivo
+
+    @archivo_mp3.setter
+    def archivo_mp3(self, ruta: str) -> None:
+        self._carpeta = ""
+        self._archivo = ruta
+
+    def actualizar(self, titulo: str, artista: str, duracion: int, genero: str, archivo_mp3: str) -> None:
+        """Cambia todos los datos de la canción (menos el id)."""
+        self.titulo = titulo
+        self.artista = _compartir(artista)
         self.duracion = duracion
-        self.genero = genero
+        self.genero = _compartir(genero)
         self.archivo_mp3 = archivo_mp3
 
     def reproducir(self) -> None:
@@ -15,7 +59,12 @@ class Cancion:
         Reproduce la canción.
         Usa pygame.mixer para reproducir el archivo MP3.
         """
-        if not os.path.exists(self.archivo_mp3):
+        inicio = time.perf_counter()
+        origen = self.archivo_mp3
+        if Cancion.proveedor_mp3 is not None:
+            origen = Cancion.proveedor_mp3(self.archivo_mp3)
+
+        if origen is None or (isinstance(origen, str) and not os.path.exists(origen)):
             print(f'No se encontró el archivo: {self.archivo_mp3}')
             return
 
@@ -24,9 +73,16 @@ class Cancion:
             pygame.mixer.init()
 
         # Al reproducir una nueva canción, pygame detiene automáticamente la anterior
-        pygame.mixer.music.load(self.archivo_mp3)
+        if isinstance(origen, str):
+            pygame.mixer.music.load(origen)
+        else:
+            # Fichero que se sigue descargando mientras suena
+            pygame.mixer.music.load(origen, "mp3")
         pygame.mixer.music.play()
 
+        if Cancion.al_empezar is not None:
+            Cancion.al_empezar(self, time.perf_counter() - inicio)
+
         print(f'Reproduciendo: {self.titulo} - {self.artista} ({self.duracion}s)')
 
     def __str__(self) -> str:
@@ -47,7 +103,7 @@ class Cancion:
             "artista": self.artista,
             "duracion": self.duracion,
             "genero": self.genero,
-            "archivo_mp3": os.path.basename(self.archivo_mp3),
+            "archivo_mp3": os.path.basename(self._archivo),
         }
 
 
@@ -56,12 +112,12 @@ class Cancion:
         Crea una Cancion a partir de un diccionario.
         base_path es la carpeta donde están los mp3 en el cliente.
         """
-        ruta = os.path.join(base_path, data["archivo_mp3"])
         return Cancion(
             id=data["id"],
             titulo=data["titulo"],
             artista=data["artista"],
             duracion=data["duracion"],
             genero=data["genero"],
-            archivo_mp3=ruta,
+            archivo_mp3=data["archivo_mp3"],
+            carpeta=_compartir(base_path),
         )
\ No newline at end of file
@@ -0,0 +1,487 @@
+import json
+import os
+import shutil
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import cache_json
+
+
+# IMPORTACIÓN DE UNA CARPETA DE MP3
+#
+# Recorre una carpeta (y sus subcarpetas), saca de cada MP3 el título, el
+# artista y el género de sus etiquetas ID3 (v2 o, si no tiene, v1) y la
+# duración de las cabeceras de sus tramas MPEG, y registra todas las
+# canciones de una vez (las que ya están, por título y artista, no se
+# repiten).
+#
+# Leer los ficheros es lo que cuesta: se reparte entre varios procesos y lo
+# leído se guarda en una caché por ruta, tamaño y mtime, así que al volver a
+# importar la misma carpeta solo se leen los ficheros nuevos o cambiados.
+# La caché (.importados.json) va en la carpeta de datos del usuario, no en
+# la importada (puede ser de solo lectura o estar en un repositorio), con
+# lo de cada carpeta importada bajo su ruta absoluta.
+#
+# La duración sale de la cabecera Xing/Info o VBRI de la primera trama si la
+# hay (número de tramas exacto). Si no, y las primeras tramas tienen todas
+# el mismo bitrate, se calcula con el tamaño del audio (CBR); si no, se
+# recorren todas las tramas del fichero.
+
+NOMBRE_CACHE = ".importados.json"
+DESCONOCIDO = "Desconocido"
+
+# Con menos ficheros que esto no compensa arrancar procesos
+MIN_PARA_PROCESOS = 32
+# Bytes que se leen tras la etiqueta ID3v2 para buscar la primera trama y
+# ver si el bitrate es constante
+TAM_CABEZA = 64 * 1024
+
+# Géneros de ID3v1 (TCON también puede traerlos como "(17)" o "17")
+GENEROS_ID3 = [
+    "Blues", "Classic Rock", "Country", "Dance", "Disco", "Funk", "Grunge", "Hip-Hop", "Jazz", "Metal",
+    "New Age", "Oldies", "Other", "Pop", "R&B", "Rap", "Reggae", "Rock", "Techno", "Industrial",
+    "Alternative", "Ska", "Death Metal", "Pranks", "Soundtrack", "Euro-Techno", "Ambient", "Trip-Hop",
+    "Vocal", "Jazz+Funk", "Fusion", "Trance", "Classical", "Instrumental", "Acid", "House", "Game",
+    "Sound Clip", "Gospel", "Noise", "AlternRock", "Bass", "Soul", "Punk", "Space", "Meditative",
+    "Instrumental Pop", "Instrumental Rock", "Ethnic", "Gothic", "Darkwave", "Techno-Industrial",
+    "Electronic", "Pop-Folk", "Eurodance", "Dream", "Southern Rock", "Comedy", "Cult", "Gangsta", "Top 40",
+    "Christian Rap", "Pop/Funk", "Jungle", "Native American", "Cabaret", "New Wave", "Psychadelic", "Rave",
+    "Showtunes", "Trailer", "Lo-Fi", "Tribal", "Acid Punk", "Acid Jazz", "Polka", "Retro", "Musical",
+    "Rock & Roll", "Hard Rock",
+]
+
+# Marcos de texto de ID3v2 que interesan (v2.2 tiene ids de 3 letras)
+MARCOS = {"TIT2": "titulo", "TT2": "titulo", "TPE1": "artista", "TP1": "artista",
+          "TCON": "genero", "TCO": "genero"}
+
+# Bitrates en kbit/s por (versión MPEG 1 o 2, capa); MPEG 2.5 usa los de 2
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+FRECUENCIAS = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+
+# ETIQUETAS ID3
+
+def _syncsafe(b: bytes) -> int:
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+def _texto(datos: bytes) -> str:
+    """Texto de un marco ID3v2 (el primer byte dice la codificación)."""
+    if not datos:
+        return ""
+    codificacion, datos = datos[0], datos[1:]
+    if codificacion == 1:
+        texto = datos.decode("utf-16", errors="replace")
+    elif codificacion == 2:
+        texto = datos.decode("utf-16-be", errors="replace")
+    elif codificacion == 3:
+        texto = datos.decode("utf-8", errors="replace")
+    else:
+        texto = datos.decode("latin-1")
+    # v2.4 separa varios valores con \0: nos quedamos con el primero
+    return texto.split("\0", 1)[0].strip()
+
+
+def _genero(texto: str) -> str:
+    """Convierte las referencias a géneros de ID3v1 ("(17)", "17") en su nombre."""
+    if texto.startswith("(") and ")" in texto:
+        numero, resto = texto[1:].split(")", 1)
+        if resto.strip():
+            return resto.strip()
+        texto = numero
+    if texto.isdigit():
+        numero = int(texto)
+        return GENEROS_ID3[numero] if numero < len(GENEROS_ID3) else ""
+    return texto
+
+
+def leer_id3v2(cabecera: bytes, etiqueta: bytes) -> Dict[str, str]:
+    """Título, artista y género de una etiqueta ID3v2 ('cabecera' son sus
+    10 primeros bytes y 'etiqueta' lo que viene detrás)."""
+    version, flags = cabecera[3], cabecera[5]
+    if flags & 0x80 and version < 4:
+        # Desincronización de toda la etiqueta (en v2.4 va por marco)
+        etiqueta = etiqueta.replace(b"\xff\x00", b"\xff")
+
+    pos = 0
+    if flags & 0x40 and version >= 3:
+        # Cabecera extendida
+        tam = _syncsafe(etiqueta[:4]) if version >= 4 else 4 + struct.unpack(">I", etiqueta[:4])[0]
+        pos = tam
+
+    datos = {}
+    tam_id, tam_cabecera = (3, 6) if version == 2 else (4, 10)
+    while pos + tam_cabecera <= len(etiqueta) and len(datos) < 3:
+        id_marco = etiqueta[pos:pos + tam_id]
+        if not id_marco.strip(b"\0") or not id_marco.isalnum():
+            break  # Relleno del final
+        if version == 2:
+            tam = int.from_bytes(etiqueta[pos + 3:pos + 6], "big")
+            flags_marco = 0
+        else:
+            bytes_tam = etiqueta[pos + 4:pos + 8]
+            tam = _syncsafe(bytes_tam) if version >= 4 else struct.unpack(">I", bytes_tam)[0]
+            flags_marco = etiqueta[pos + 9]
+        inicio = pos + tam_cabecera
+        pos = inicio + tam
+
+        campo = MARCOS.get(id_marco.decode("latin-1"))
+        if campo is None or campo in datos:
+            continue
+        contenido = etiqueta[inicio:pos]
+        if version >= 3 and flags_marco & (0x0C if version == 4 else 0xC0):
+            continue  # Comprimido o cifrado
+        if version == 4 and flags_marco & 0x02:
+            contenido = contenido.replace(b"\xff\x00", b"\xff")
+        if version == 4 and flags_marco & 0x01:
+            contenido = contenido[4:]  # Tamaño original delante
+        datos[campo] = _texto(contenido)
+    return datos
+
+
+def leer_id3v1(cola: bytes) -> Dict[str, str]:
+    """Título, artista y género de una etiqueta ID3v1 (los 128 últimos bytes)."""
+    if len(cola) < 128 or not cola.startswith(b"TAG"):
+        return {}
+
+    def texto(b):
+        return b.split(b"\0", 1)[0].decode("latin-1").strip()
+
+    numero = cola[127]
+    return {
+        "titulo": texto(cola[3:33]),
+        "artista": texto(cola[33:63]),
+        "genero": GENEROS_ID3[numero] if numero < len(GENEROS_ID3) else "",
+    }
+
+
+# DURACIÓN
+
+def trama(datos: bytes, pos: int):
+    """Datos de la trama MPEG que empieza en 'pos' (versión, capa,
+    bitrate en kbit/s, frecuencia, muestras, longitud en bytes y si es mono),
+    o None si ahí no hay una cabecera válida."""
+    if pos + 4 > len(datos) or datos[pos] != 0xFF or datos[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = datos[pos + 1], datos[pos + 2], datos[pos + 3]
+    version = {0: 2.5, 2: 2, 3: 1}.get((b1 >> 3) & 3)
+    capa = {1: 3, 2: 2, 3: 1}.get((b1 >> 1) & 3)
+    indice_bitrate, indice_frecuencia = b2 >> 4, (b2 >> 2) & 3
+    if version is None or capa is None or indice_bitrate in (0, 15) or indice_frecuencia == 3:
+        return None
+
+    bitrate = BITRATES[(1 if version == 1 else 2, capa)][indice_bitrate]
+    frecuencia = FRECUENCIAS[version][indice_frecuencia]
+    if capa == 1:
+        muestras = 384
+    elif capa == 3 and version != 1:
+        muestras = 576
+    else:
+        muestras = 1152
+    relleno = (b2 >> 1) & 1
+    longitud = muestras // 8 * bitrate * 1000 // frecuencia + relleno * (4 if capa == 1 else 1)
+    return version, capa, bitrate, frecuencia, muestras, longitud, b3 >> 6 == 3
+
+
+def _primera_trama(datos: bytes, pos: int):
+    """Posición y datos de la primera trama a partir de 'pos': una cabecera
+    válida seguida de otra (para no confundirse con bytes sueltos a 0xFF)."""
+    while True:
+        pos = datos.find(b"\xff", pos)
+        if pos < 0:
+            return None, None
+        t = trama(datos, pos)
+        if t is not None and (pos + t[5] >= len(datos) or trama(datos, pos + t[5]) is not None):
+            return pos, t
+        pos += 1
+
+
+def _tramas_vbr(datos: bytes, pos: int, t) -> int | None:
+    """Número de tramas de la cabecera Xing/Info o VBRI de la primera trama."""
+    version, _, _, _, _, _, mono = t
+    if version == 1:
+        lateral = 17 if mono else 32
+    else:
+        lateral = 9 if mono else 17
+    xing = pos + 4 + lateral
+    if datos[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", datos[xing + 4:xing + 8])[0]
+        if flags & 1 and len(datos) >= xing + 12:
+            return struct.unpack(">I", datos[xing + 8:xing + 12])[0]
+    vbri = pos + 36
+    if datos[vbri:vbri + 4] == b"VBRI" and len(datos) >= vbri + 18:
+        return struct.unpack(">I", datos[vbri + 14:vbri + 18])[0]
+    return None
+
+
+def _contar_tramas(datos: bytes, pos: int, fin: int) -> float:
+    """Segundos de audio recorriendo todas las tramas (VBR sin cabecera)."""
+    segundos = 0.0
+    while pos < fin:
+        t = trama(datos, pos)
+        if t is None:
+            # Basura entre tramas: se busca la siguiente
+            pos, t = _primera_trama(datos, pos + 1)
+            if pos is None or pos >= fin:
+                break
+        segundos += t[4] / t[3]
+        pos += t[5]
+    return segundos
+
+
+# LECTURA DE UN FICHERO (en los procesos trabajadores)
+
+def leer_mp3(ruta: str) -> Dict[str, object] | None:
+    """Título, artista, género (los que haya en las etiquetas) y duración en
+    segundos de un MP3, o None si no se puede leer o no tiene audio MPEG."""
+    try:
+        with open(ruta, "rb") as f:
+            tam_fichero = os.fstat(f.fileno()).st_size
+            datos = {}
+            inicio_audio = 0
+            cabecera = f.read(10)
+            if len(cabecera) == 10 and cabecera.startswith(b"ID3"):
+                tam = _syncsafe(cabecera[6:10])
+                datos = leer_id3v2(cabecera, f.read(tam))
+                inicio_audio = 10 + tam + (10 if cabecera[5] & 0x10 else 0)
+
+            fin_audio = tam_fichero
+            if tam_fichero >= inicio_audio + 128:
+                f.seek(tam_fichero - 128)
+                cola = f.read(128)
+                if cola.startswith(b"TAG"):
+                    fin_audio -= 128
+                    for campo, valor in leer_id3v1(cola).items():
+                        if not datos.get(campo):
+                            datos[campo] = valor
+
+            f.seek(inicio_audio)
+            cabeza = f.read(TAM_CABEZA)
+            pos, t = _primera_trama(cabeza, 0)
+            if pos is None:
+                return None
+
+            tramas = _tramas_vbr(cabeza, pos, t)
+            if tramas is not None:
+                segundos = tramas * t[4] / t[3]
+            else:
+                # ¿Bitrate constante en las tramas de la cabeza?
+                p, constante = pos, True
+                while constante:
+                    siguiente = trama(cabeza, p)
+                    if siguiente is None or p + siguiente[5] > len(cabeza):
+                        break
+                    constante = siguiente[2] == t[2]
+                    p += siguiente[5]
+                if constante:
+                    segundos = (fin_audio - inicio_audio - pos) * 8 / (t[2] * 1000)
+                else:
+                    f.seek(inicio_audio)
+                    todo = f.read(fin_audio - inicio_audio)
+                    segundos = _contar_tramas(todo, pos, len(todo))
+    except Exception:
+        # Cualquier fichero mal formado (etiquetas con tamaños que no
+        # cuadran, tramas cortadas...) cuenta como no válido, no para la
+        # importación
+        return None
+
+    return {
+        "titulo": datos.get("titulo", ""),
+        "artista": datos.get("artista", ""),
+        "genero": _genero(datos.get("genero", "")),
+        "duracion": round(segundos),
+    }
+
+
+# IMPORTACIÓN
+
+def buscar_mp3(carpeta: str):
+    """Recorre la carpeta y sus subcarpetas: (ruta relativa, ruta, stat) de cada MP3."""
+    pendientes = [carpeta]
+    while pendientes:
+        actual = pendientes.pop()
+        try:
+            entradas = list(os.scandir(actual))
+        except OSError:
+            continue
+        for entrada in sorted(entradas, key=lambda e: e.name):
+            if entrada.is_dir(follow_symlinks=False):
+                pendientes.append(entrada.path)
+            elif entrada.name.lower().endswith(".mp3") and entrada.is_file():
+                yield os.path.relpath(entrada.path, carpeta), entrada.path, entrada.stat()
+
+
+def leer_en_paralelo(rutas: List[str], procesos: int | None = None) -> List[Dict[str, object] | None]:
+    """leer_mp3 de cada ruta (en el mismo orden), repartidas entre
+    'procesos' procesos (por defecto, uno por CPU)."""
+    procesos = procesos or os.cpu_count() or 1
+    if procesos <= 1 or len(rutas) < MIN_PARA_PROCESOS:
+        return [leer_mp3(r) for r in rutas]
+    # Trozos grandes para no pagar un viaje entre procesos por fichero
+    trozo = max(1, min(64, len(rutas) // (procesos * 4)))
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        return list(pool.map(leer_mp3, rutas, chunksize=trozo))
+
+
+def _destino(origen: str, st: os.stat_result, carpeta_mp3: str, ocupados: set) -> str:
+    """Ruta que tendrá el MP3 en la carpeta del usuario: su nombre o, si ya
+    hay otro fichero con ese nombre, el nombre con un número. Si el que hay
+    es el mismo (mismo tamaño y mtime) se aprovecha."""
+    base, extension = os.path.splitext(os.path.basename(origen))
+    n = 1
+    while True:
+        nombre = f"{base}{extension}" if n == 1 else f"{base} ({n}){extension}"
+        destino = os.path.join(carpeta_mp3, nombre)
+        if nombre not in ocupados:
+            try:
+                st_destino = os.stat(destino)
+            except FileNotFoundError:
+                break
+            if (st_destino.st_size, st_destino.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                break
+        n += 1
+    ocupados.add(nombre)
+    return destino
+
+
+def _copiar(origen: str, destino: str) -> None:
+    """Pone el MP3 en la carpeta del usuario (enlace duro si se puede).
+    Si falla no deja un fichero a medias y lanza OSError."""
+    if os.path.exists(destino):
+        return
+    try:
+        os.link(origen, destino)
+    except OSError:
+        try:
+            shutil.copy2(origen, destino)
+        except OSError:
+            if os.path.exists(destino):
+                os.remove(destino)
+            raise
+
+
+def importar_carpeta(plataforma, carpeta: str, carpeta_mp3: str | None = None,
+                     procesos: int | None = None, carpeta_cache: str | None = None) -> Dict[str, float]:
+    """
+    Importa todos los MP3 de 'carpeta' (y sus subcarpetas) a la plataforma.
+    - Sin título en las etiquetas se usa el nombre del fichero, y sin
+      artista o género, "Desconocido".
+    - Las canciones que ya están (mismo título y artista) no se añaden.
+    - Si se da carpeta_mp3, los MP3 de las canciones añadidas se ponen ahí
+      (es la carpeta local de la que el cliente sube los MP3) antes de
+      registrarlas: las que no se pueden copiar no se añaden.
+    - La caché de lo leído se guarda en carpeta_cache (por defecto,
+      carpeta_mp3); sin ninguna de las dos no se usa caché.
+    Devuelve un resumen: ficheros encontrados, leídos, sacados de la caché,
+    no válidos, canciones añadidas, repetidas y sin copiar, y segundos que
+    ha tardado.
+    """
+    inicio = time.perf_counter()
+    carpeta_cache = carpeta_cache or carpeta_mp3
+    ruta_cache = os.path.join(carpeta_cache, NOMBRE_CACHE) if carpeta_cache else None
+    caches = cache_json.leer(ruta_cache) if ruta_cache else {}
+    origen = os.path.abspath(carpeta)
+    cache = caches.get(origen, {})
+    nueva_cache = {}
+
+    encontrados = []  # (ruta relativa, ruta, stat)
+    por_leer = []
+    for relativa, ruta, st in buscar_mp3(carpeta):
+        encontrados.append((relativa, ruta, st))
+        previa = cache.get(relativa)
+        if previa and previa["tam"] == st.st_size and previa["mtime"] == st.st_mtime_ns:
+            nueva_cache[relativa] = previa
+        else:
+            nueva_cache[relativa] = {"tam": st.st_size, "mtime": st.st_mtime_ns}
+            por_leer.append((relativa, ruta))
+
+    for (relativa, _), datos in zip(por_leer, leer_en_paralelo([r for _, r in por_leer], procesos)):
+        nueva_cache[relativa]["datos"] = datos
+
+    if carpeta_mp3 is not None:
+        try:
+            os.makedirs(carpeta_mp3, exist_ok=True)
+        except OSError:
+            pass  # Fallará cada copia y se contarán como sin copiar
+
+    # Las canciones que faltan, con su MP3 ya en carpeta_mp3, y luego se
+    # registran de una vez
+    nuevas = []
+    claves = set()
+    ocupados = set()
+    no_validos = repetidas = sin_copiar = 0
+    for relativa, ruta, st in encontrados:
+        datos = nueva_cache[relativa]["datos"]
+        if datos is None:
+            no_validos += 1
+            continue
+        titulo = datos["titulo"] or os.path.splitext(os.path.basename(ruta))[0].replace("_", " ")
+        artista = datos["artista"] or DESCONOCIDO
+        if (titulo, artista) in claves or plataforma.existe_cancion(titulo, artista):
+            repetidas += 1
+            continue
+        archivo = ruta
+        if carpeta_mp3 is not None:
+            archivo = _destino(ruta, st, carpeta_mp3, ocupados)
+            try:
+                _copiar(ruta, archivo)
+            except OSError:
+                sin_copiar += 1
+                continue
+        claves.add((titulo, artista))
+        nuevas.append((titulo, artista, datos["duracion"], datos["genero"] or DESCONOCIDO, archivo))
+    anadidas = plataforma.registrar_canciones(nuevas)
+
+    if ruta_cache and nueva_cache != cache:
+        caches[origen] = nueva_cache
+        cache_json.guardar(ruta_cache, caches)
+
+    return {
+        "ficheros": len(encontrados),
+        "leidos": len(por_leer),
+        "en_cache": len(encontrados) - len(por_leer),
+        "no_validos": no_validos,
+        "anadidas": len(anadidas),
+        "repetidas": repetidas + len(nuevas) - len(anadidas),
+        "sin_copiar": sin_copiar,
+        "segundos": time.perf_counter() - inicio,
+    }
+
+
+def resumen(resultado: Dict[str, float]) -> str:
+    """Texto con el resumen de una importación."""
+    segundos = resultado["segundos"]
+    velocidad = resultado["ficheros"] / segundos if segundos > 0 else 0
+    return (f'{resultado["ficheros"]} ficheros en {segundos:.1f} s ({velocidad:.0f} ficheros/s): '
+            f'{resultado["anadidas"]} canciones añadidas, {resultado["repetidas"]} ya estaban, '
+            f'{resultado["no_validos"]} no válidos'
+            + (f', {resultado["sin_copiar"]} sin copiar' if resultado["sin_copiar"] else '')
+            + f' ({resultado["en_cache"]} sin leer gracias a la caché)')
+
+
+if __name__ == "__main__":
+    import argparse
+    from musica.plataforma import PlataformaMusical
+
+    # python -m musica.importador <carpeta> [--procesos N] [--json biblioteca.json] [--cache carpeta]
+    parser = argparse.ArgumentParser(description="Importa los MP3 de una carpeta a una biblioteca.")
+    parser.add_argument("carpeta")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos lectores (por defecto, uno por CPU)")
+    parser.add_argument("--json", default=None, help="guarda la biblioteca importada en este fichero")
+    parser.add_argument("--cache", default=None, help="carpeta donde guardar la caché de lo leído (sin ella, no hay)")
+    args = parser.parse_args()
+
+    plataforma = PlataformaMusical()
+    print(resumen(importar_carpeta(plataforma, args.carpeta, procesos=args.procesos, carpeta_cache=args.cache)))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(plataforma.to_dict(), f, ensure_ascii=False, indent=2)
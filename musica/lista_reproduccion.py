@@ -1,23 +1,31 @@
-from typing import List
+from typing import Dict, KeysView
 
 class ListaReproduccion:
     """
     Esta clase es una lista de reproducción, que va a tener
     su propio nombre, y dentro de ella sus canciones sin duplicados.
     Implementamos los métodos anadir_cancion y quitar_cancion.
+    Los ids se guardan en un dict usado como conjunto ordenado: conserva el
+    orden en que se añadieron y comprobar, añadir o quitar uno no depende
+    del tamaño de la lista.
     """
 
     def __init__(self, nombre: str):
         self.nombre: str = nombre
-        self.canciones: List[int] = []
+        self._canciones: Dict[int, None] = {}
+
+    @property
+    def canciones(self) -> KeysView[int]:
+        """Ids de las canciones en el orden en que se añadieron (solo lectura)."""
+        return self._canciones.keys()
 
     def anadir_cancion(self, id_cancion: int) -> bool:
         """
         Añade el id de una canción si no estaba ya en la lista.
         Devuelve True si se añade, False si ya estaba.
         """
-        if id_cancion not in self.canciones:
-            self.canciones.append(id_cancion)
+        if id_cancion not in self._canciones:
+            self._canciones[id_cancion] = None
             return True
         return False
 
@@ -26,8 +34,8 @@ class ListaReproduccion:
         Quita el id de una canción si estaba en la lista.
         Devuelve True si se elimina, False si no estaba.
         """
-        if id_cancion in self.canciones:
-            self.canciones.remove(id_cancion)
+        if id_cancion in self._canciones:
+            del self._canciones[id_cancion]
             return True
         return False
 
@@ -39,7 +47,7 @@ class ListaReproduccion:
         """
         return {
             "nombre": self.nombre,
-            "canciones": self.canciones,  #lista de ids
+            "canciones": list(self._canciones),  #lista de ids
         }
 
     def from_dict(data: dict) -> "ListaReproduccion":
@@ -47,5 +55,5 @@ class ListaReproduccion:
         Crea una ListaReproduccion a partir de un diccionario.
         """
         lista = ListaReproduccion(data["nombre"])
-        lista.canciones = list(data.get("canciones", []))
-        return lista
\ No newline at end of file
+        lista._canciones = dict.fromkeys(data.get("canciones", []))
+        return lista
@@ -1,55 +1,150 @@
 from musica.cancion import Cancion
 from musica.lista_reproduccion import ListaReproduccion
-from typing import List
+from musica.buscador import Buscador
+from typing import Dict, Iterable, List, Set, Tuple, ValuesView
 
 
 class PlataformaMusical:
+    """
+    Catálogo de canciones y listas de reproducción.
+    Además de las canciones y las listas mantiene unos índices para no
+    recorrerlo todo en cada operación (con cientos de miles de canciones
+    importar un lote sería cuadrático):
+    - _canciones: id -> Cancion, en orden de registro
+    - _claves: (titulo, artista) -> cuántas canciones los tienen, para los duplicados
+    - _listas_por_nombre: nombre en casefold -> ListaReproduccion
+    - _listas_de: id de canción -> listas en las que está (índice inverso,
+      para quitar una canción solo de sus listas al eliminarla)
+    - _buscador: índice invertido para buscar (ver buscador.py); se crea en
+      la primera búsqueda y no se copia con copy.deepcopy
+    - _siguiente_id: id de la próxima canción que se registre
+    Todos los métodos que cambian la plataforma (y from_dict) los mantienen
+    al día, así que canciones y listas no se deben modificar directamente.
+    """
 
     def __init__(self):
-        self.canciones: List[Cancion] = []
+        self._canciones: Dict[int, Cancion] = {}
+        self._claves: Dict[Tuple[str, str], int] = {}
+        self._siguiente_id: int = 1
         self.listas: List[ListaReproduccion] = []
+        self._listas_por_nombre: Dict[str, ListaReproduccion] = {}
+        self._listas_de: Dict[int, Set[ListaReproduccion]] = {}
+        self._buscador: Buscador | None = None
+        # Cambios hechos desde que se creó (ver operaciones.py), para subir
+        # solo eso al servidor
+        self.operaciones: List[dict] = []
+
+    @property
+    def canciones(self) -> ValuesView[Cancion]:
+        """Canciones en orden de registro (solo lectura)."""
+        return self._canciones.values()
+
+    def obtener_cancion(self, id: int) -> Cancion | None:
+        """Devuelve la canción con ese id, o None si no existe."""
+        return self._canciones.get(id)
+
+    def __getstate__(self) -> dict:
+        # El historial de estados del cliente copia la plataforma entera en
+        # cada cambio: el buscador no se copia, se rehace si se busca
+        estado = self.__dict__.copy()
+        estado["_buscador"] = None
+        return estado
+
+    def _indexar_cancion(self, cancion: Cancion) -> None:
+        self._canciones[cancion.id] = cancion
+        if self._buscador is not None:
+            self._buscador.anadir(cancion)
+        clave = (cancion.titulo, cancion.artista)
+        self._claves[clave] = self._claves.get(clave, 0) + 1
+        if cancion.id >= self._siguiente_id:
+            self._siguiente_id = cancion.id + 1
+
+    def _quitar_clave(self, cancion: Cancion) -> None:
+        clave = (cancion.titulo, cancion.artista)
+        if self._claves[clave] == 1:
+            del self._claves[clave]
+        else:
+            self._claves[clave] -= 1
+
+    def _indexar_lista(self, lista: ListaReproduccion) -> None:
+        self.listas.append(lista)
+        # Con nombres repetidos (solo puede pasar con datos de fuera) se
+        # encuentra la primera, como antes
+        self._listas_por_nombre.setdefault(lista.nombre.casefold(), lista)
+        for id_cancion in lista.canciones:
+            self._listas_de.setdefault(id_cancion, set()).add(lista)
+
+    def _desindexar(self, id_cancion: int, lista: ListaReproduccion) -> None:
+        listas = self._listas_de.get(id_cancion)
+        if listas is not None:
+            listas.discard(lista)
+            if not listas:
+                del self._listas_de[id_cancion]
+
+    def _anotar(self, op: str, **datos) -> None:
+        """Añade una operación al registro de operaciones."""
+        self.operaciones.append({"op": op, **datos})
+
+    def existe_cancion(self, titulo: str, artista: str) -> bool:
+        """True si ya hay una canción con ese título y artista."""
+        return (titulo, artista) in self._claves
 
     def registrar_cancion(self, titulo: str, artista: str, duracion: int, genero: str, archivo: str) -> bool:
         """
         Registra una nueva canción en la plataforma.
         - Si ya existe una canción con el mismo título y artista, no la añade y devuelve False.
-        - Asigna un id autoincremental (1 + max id existente, o 1 si no hay canciones).
+        - Asigna un id autoincremental (1 + el mayor id que ha tenido la
+          plataforma, o 1 si no ha tenido canciones): los ids no se reutilizan.
         - Devuelve True si la canción se añadió correctamente.
         """
         # Comprueba duplicados por título y artista
-        for c in self.canciones:
-            if c.titulo == titulo and c.artista == artista:
-                # No añadimos duplicados
-                return False
-
-        # Calcular id autoincremental
-        next_id = 1
-        if self.canciones:
-            max_id = max((c.id for c in self.canciones), default=0)
-            next_id = max_id + 1
-
-        nueva = Cancion(next_id, titulo, artista, duracion, genero, archivo)
-        self.canciones.append(nueva)
+        if (titulo, artista) in self._claves:
+            # No añadimos duplicados
+            return False
+
+        nueva = Cancion(self._siguiente_id, titulo, artista, duracion, genero, archivo)
+        self._indexar_cancion(nueva)
+        self._anotar("registrar_cancion", **nueva.to_dict())
         return True
 
+    def registrar_canciones(self, datos: Iterable[Tuple[str, str, int, str, str]]) -> List[Cancion]:
+        """
+        Registra un lote de canciones, cada una como una tupla (titulo,
+        artista, duracion, genero, archivo), igual que registrar_cancion:
+        las que ya existen (o se repiten en el lote) no se añaden.
+        Devuelve las canciones añadidas, en el orden del lote.
+        """
+        anadidas = []
+        for titulo, artista, duracion, genero, archivo in datos:
+            if (titulo, artista) in self._claves:
+                continue
+            nueva = Cancion(self._siguiente_id, titulo, artista, duracion, genero, archivo)
+            self._indexar_cancion(nueva)
+            self._anotar("registrar_cancion", **nueva.to_dict())
+            anadidas.append(nueva)
+        return anadidas
+
     def editar_cancion(self, id: int, titulo: str, artista: str, duracion: int, genero: str, archivo: str) -> bool:
         """
         Edita una canción existente en la plataforma.
         Devuelve True si se modifica correctamente, False si no existe una canción con ese id.
         """
         # Buscar la canción por su ID
-        for c in self.canciones:
-            if c.id == id:
-                # Actualizar sus atributos
-                c.titulo = titulo
-                c.artista = artista
-                c.duracion = duracion
-                c.genero = genero
-                c.archivo_mp3 = archivo
-                return True
-
-        # Si no se encontró ninguna canción con ese ID
-        return False
+        c = self._canciones.get(id)
+        if c is None:
+            return False
+
+        # Actualizar sus atributos (y su clave de título y artista)
+        self._quitar_clave(c)
+        if self._buscador is not None:
+            self._buscador.quitar(c)
+        c.actualizar(titulo, artista, duracion, genero, archivo)
+        if self._buscador is not None:
+            self._buscador.anadir(c)
+        clave = (titulo, artista)
+        self._claves[clave] = self._claves.get(clave, 0) + 1
+        self._anotar("editar_cancion", **c.to_dict())
+        return True
 
     def eliminar_cancion(self, id: int) -> bool:
         """
@@ -58,19 +153,19 @@ class PlataformaMusical:
         - Si existe, la elimina de self.canciones y de todas las listas de reproducción, y devuelve True.
         """
         # Buscar la canción por id
-        for c in self.canciones:
-            if c.id == id:
-                self.canciones.remove(c)
-
-                # También eliminar de todas las listas de reproducción donde aparezca
-                for lista in self.listas:
-                    if id in lista.canciones:
-                        lista.canciones.remove(id)
+        c = self._canciones.pop(id, None)
+        if c is None:
+            return False
+        self._quitar_clave(c)
+        if self._buscador is not None:
+            self._buscador.quitar(c)
 
-                return True
+        # También eliminar de las listas de reproducción donde aparezca
+        for lista in self._listas_de.pop(id, ()):
+            lista.quitar_cancion(id)
 
-        # Si no se encuentra la canción
-        return False
+        self._anotar("eliminar_cancion", id=id)
+        return True
 
     def crear_lista(self, nombre: str) -> bool:
         """
@@ -79,12 +174,12 @@ class PlataformaMusical:
         - Si se crea correctamente, devuelve True.
         """
         # Comprobar si ya existe una lista con el mismo nombre
-        for lista in self.listas:
-            if lista.nombre.lower() == nombre.lower():
-                return False
+        if nombre.casefold() in self._listas_por_nombre:
+            return False
 
         nueva_lista = ListaReproduccion(nombre)
-        self.listas.append(nueva_lista)
+        self._indexar_lista(nueva_lista)
+        self._anotar("crear_lista", nombre=nombre)
         return True
 
     def borrar_lista(self, nombre: str) -> bool:
@@ -93,11 +188,20 @@ class PlataformaMusical:
         - Si existe una lista con ese nombre (sin importar mayúsculas), la elimina y devuelve True.
         - Si no existe ninguna lista con ese nombre, devuelve False.
         """
-        for lista in self.listas:
-            if lista.nombre.lower() == nombre.lower():
-                self.listas.remove(lista)
-                return True
-        return False
+        lista = self._listas_por_nombre.pop(nombre.casefold(), None)
+        if lista is None:
+            return False
+
+        self.listas.remove(lista)
+        for id_cancion in lista.canciones:
+            self._desindexar(id_cancion, lista)
+        # Si había otra con el mismo nombre, pasa a ser la que se encuentra
+        for otra in self.listas:
+            if otra.nombre.casefold() == nombre.casefold():
+                self._listas_por_nombre[nombre.casefold()] = otra
+                break
+        self._anotar("borrar_lista", nombre=lista.nombre)
+        return True
 
     def obtener_lista(self, nombre: str) -> ListaReproduccion | None:
         """
@@ -106,11 +210,55 @@ class PlataformaMusical:
         - Si no existe, devuelve None.
         - La comparación de nombres no distingue mayúsculas/minúsculas.
         """
-        for lista in self.listas:
-            if lista.nombre.lower() == nombre.lower():
-                return lista
-        return None
+        return self._listas_por_nombre.get(nombre.casefold())
 
+    def anadir_a_lista(self, nombre: str, id_cancion: int) -> bool:
+        """
+        Añade una canción a una lista de reproducción.
+        - Devuelve False si no existe la lista o la canción, o si la canción ya estaba en la lista.
+        - Devuelve True si se añade.
+        """
+        lista = self.obtener_lista(nombre)
+        if lista is None or id_cancion not in self._canciones:
+            return False
+
+        if lista.anadir_cancion(id_cancion):
+            self._listas_de.setdefault(id_cancion, set()).add(lista)
+            self._anotar("anadir_a_lista", nombre=lista.nombre, id=id_cancion)
+            return True
+        return False
+
+    def quitar_de_lista(self, nombre: str, id_cancion: int) -> bool:
+        """
+        Quita una canción de una lista de reproducción.
+        - Devuelve False si no existe la lista o la canción no estaba en ella.
+        - Devuelve True si se quita.
+        """
+        lista = self.obtener_lista(nombre)
+        if lista is None:
+            return False
+
+        if lista.quitar_cancion(id_cancion):
+            self._desindexar(id_cancion, lista)
+            self._anotar("quitar_de_lista", nombre=lista.nombre, id=id_cancion)
+            return True
+        return False
+
+    def buscar(self, texto: str = "", duracion_min: int | None = None, duracion_max: int | None = None,
+               orden: str = "titulo", descendente: bool = False, limite: int | None = None,
+               prefijo: bool = True) -> List[Cancion]:
+        """
+        Busca canciones por las palabras de su título, artista y género.
+        - Devuelve las que tienen todas las palabras de 'texto' (sin
+          distinguir mayúsculas ni tildes); la última basta con que sea el
+          principio de una palabra si 'prefijo' es True. Sin texto, todas.
+        - duracion_min / duracion_max: rango de duración en segundos (incluidos).
+        - orden: "titulo", "artista", "duracion" o "id"; descendente lo invierte.
+        - limite: número máximo de resultados (None = todos).
+        """
+        if self._buscador is None:
+            self._buscador = Buscador(self._canciones)
+        return self._buscador.buscar(texto, duracion_min, duracion_max, orden, descendente, limite, prefijo)
 
     # MÉTODOS PARA LA SERIALIZACIÓN
 
@@ -134,10 +282,10 @@ class PlataformaMusical:
 
         # Reconstruir canciones
         for cdata in data.get("canciones", []):
-            p.canciones.append(Cancion.from_dict(cdata, base_path))
+            p._indexar_cancion(Cancion.from_dict(cdata, base_path))
 
         # Reconstruir listas
         for ldata in data.get("listas", []):
-            p.listas.append(ListaReproduccion.from_dict(ldata))
+            p._indexar_lista(ListaReproduccion.from_dict(ldata))
 
         return p
\ No newline at end of file
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+
+# REGISTRO DE OPERACIONES SOBRE LA BIBLIOTECA
+#
+# PlataformaMusical anota en 'operaciones' cada cambio que se le hace con
+# éxito, como un dict {"op": <nombre del método>, ...datos}:
+#   registrar_cancion  id, titulo, artista, duracion, genero, archivo_mp3
+#   editar_cancion     id, titulo, artista, duracion, genero, archivo_mp3
+#   eliminar_cancion   id
+#   crear_lista        nombre
+#   borrar_lista       nombre
+#   anadir_a_lista     nombre, id
+#   quitar_de_lista    nombre, id
+# Al salir, el cliente sube solo esas operaciones (UPLOAD_OPS) y el servidor
+# las aplica sobre la versión de la que partió el cliente, así lo que viaja
+# depende de lo que se ha tocado y no del tamaño de la biblioteca.
+# Junto a las operaciones va la huella del resultado que tiene el cliente:
+# si al aplicarlas el servidor no llega a lo mismo, pide la biblioteca entera.
+
+
+class OperacionInvalida(Exception):
+    pass
+
+
+def huella(data):
+    """Resumen de una biblioteca (diccionario) independiente del formato."""
+    texto = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+def aplicar_operaciones(data, operaciones):
+    """Aplica las operaciones a una biblioteca (diccionario de
+    PlataformaMusical.to_dict) y devuelve la biblioteca resultante, sin
+    modificar la original. Sigue las mismas reglas que PlataformaMusical."""
+    canciones = {c["id"]: dict(c) for c in data.get("canciones", [])}
+    listas = {l["nombre"]: dict(l, canciones=list(l.get("canciones", []))) for l in data.get("listas", [])}
+
+    for operacion in operaciones:
+        try:
+            op = operacion["op"]
+            if op == "registrar_cancion":
+                cancion = {campo: operacion[campo] for campo in
+                           ("id", "titulo", "artista", "duracion", "genero", "archivo_mp3")}
+                if cancion["id"] in canciones:
+                    raise OperacionInvalida(f"Ya existe la canción {cancion['id']}")
+                canciones[cancion["id"]] = cancion
+
+            elif op == "editar_cancion":
+                cancion = canciones.get(operacion["id"])
+                if cancion is None:
+                    raise OperacionInvalida(f"No existe la canción {operacion['id']}")
+                for campo in ("titulo", "artista", "duracion", "genero", "archivo_mp3"):
+                    cancion[campo] = operacion[campo]
+
+            elif op == "eliminar_cancion":
+                if canciones.pop(operacion["id"], None) is None:
+                    raise OperacionInvalida(f"No existe la canción {operacion['id']}")
+                for lista in listas.values():
+                    if operacion["id"] in lista["canciones"]:
+                        lista["canciones"].remove(operacion["id"])
+
+            elif op == "crear_lista":
+                if operacion["nombre"] in listas:
+                    raise OperacionInvalida(f"Ya existe la lista {operacion['nombre']}")
+                listas[operacion["nombre"]] = {"nombre": operacion["nombre"], "canciones": []}
+
+            elif op == "borrar_lista":
+                if listas.pop(operacion["nombre"], None) is None:
+                    raise OperacionInvalida(f"No existe la lista {operacion['nombre']}")
+
+            elif op in ("anadir_a_lista", "quitar_de_lista"):
+                lista = listas.get(operacion["nombre"])
+                if lista is None:
+                    raise OperacionInvalida(f"No existe la lista {operacion['nombre']}")
+                if op == "anadir_a_lista":
+                    if operacion["id"] not in lista["canciones"]:
+                        lista["canciones"].append(operacion["id"])
+                elif operacion["id"] in lista["canciones"]:
+                    lista["canciones"].remove(operacion["id"])
+
+            else:
+                raise OperacionInvalida(f"Operación desconocida: {op}")
+        except (KeyError, TypeError) as e:
+            raise OperacionInvalida(f"Operación mal formada {operacion!r}: {e}")
+
+    # Los dict conservan el orden de inserción, igual que las listas de la
+    # plataforma (lo nuevo va al final)
+    return {"canciones": list(canciones.values()), "listas": list(listas.values())}
@@ -0,0 +1,165 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import zlib
+
+
+# SERVIDOR CON VARIOS PROCESOS
+#
+# Con --procesos N el proceso principal aplica los diarios y arranca N
+# procesos trabajadores (fork) que escuchan todos en el mismo puerto
+# (SO_REUSEPORT): el sistema reparte las conexiones entre ellos y cada uno
+# tiene su propio GIL, así el trabajo de CPU de una sesión (JSON, hashes,
+# compresión) no frena a las de los otros procesos.
+#
+# El estado de cada usuario (sesiones abiertas, cerrojo de subidas, caché
+# de metadata, historial de versiones, escrituras en el diario) vive en un
+# solo trabajador, su dueño: crc32(usuario) % N. Cuando una conexión llega a
+# otro trabajador, este mira su primera línea sin consumirla (MSG_PEEK) y le
+# pasa el socket al dueño por un socket Unix (SCM_RIGHTS), que la atiende
+# como si la hubiera aceptado él:
+#   LOGIN:<usuario>...  -> dueño del usuario
+#   TRANSFER:<token>    -> el token empieza por el número del trabajador que lo dio
+#   lo demás (STATS...) -> el que la ha aceptado
+
+TAM_MAX_LINEA = 1024
+ESPERA_LINEA = 0.001  # segundos entre miradas si la primera línea llega a trozos
+
+
+def trabajador_de(usuario, num_procesos):
+    """Trabajador dueño de un usuario. hash() de un str cambia de un
+    proceso a otro, así que se usa crc32."""
+    return zlib.crc32(usuario.encode()) % num_procesos
+
+
+def mirar_primera_linea(sock):
+    """Devuelve la primera línea que ha mandado el cliente sin sacarla del
+    socket (None si cierra antes de mandarla)."""
+    while True:
+        datos = sock.recv(TAM_MAX_LINEA, socket.MSG_PEEK)
+        if not datos:
+            return None
+        if b"\n" in datos or len(datos) >= TAM_MAX_LINEA:
+            return datos.split(b"\n", 1)[0].decode(errors="replace").strip()
+        time.sleep(ESPERA_LINEA)
+
+
+def destino(linea, num_procesos):
+    """Trabajador que tiene que atender una conexión según su primera línea
+    (None = cualquiera)."""
+    if linea.startswith("LOGIN:"):
+        return trabajador_de(linea.split(":")[1].strip(), num_procesos)
+    if linea.startswith("TRANSFER:"):
+        proceso = linea.split(":", 1)[1].split("-", 1)[0]
+        if proceso.isdigit() and int(proceso) < num_procesos:
+            return int(proceso)
+    return None
+
+
+class Reparto:
+    """Buzones (sockets Unix) por los que los trabajadores se pasan las
+    conexiones. Se crea antes del fork para que todos los compartan."""
+
+    def __init__(self, num_procesos):
+        self.num_procesos = num_procesos
+        self.proceso = None
+        self._buzones = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(num_procesos)]
+
+    def quedarse_con(self, proceso):
+        """En el hijo: se queda con su buzón de entrada y cierra los de los demás."""
+        self.proceso = proceso
+        for n, (entrada, _) in enumerate(self._buzones):
+            if n != proceso:
+                entrada.close()
+
+    def pasar(self, proceso, sock, addr):
+        socket.send_fds(self._buzones[proceso][1], [json.dumps(addr).encode()], [sock.fileno()])
+        sock.close()
+
+    def recibir(self):
+        datos, fds, _, _ = socket.recv_fds(self._buzones[self.proceso][0], TAM_MAX_LINEA, 1)
+        return socket.socket(fileno=fds[0]), tuple(json.loads(datos.decode()))
+
+    def servir(self, puerto, backlog, entregar):
+        """Bucle de un trabajador: acepta en el puerto compartido y reparte.
+        entregar(sock, addr) recibe las conexiones que le tocan a este
+        trabajador, cada una en su propio hilo (puede bloquearse)."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.bind(("0.0.0.0", puerto))
+        server.listen(backlog)
+
+        def recibir_de_otros():
+            while True:
+                sock, addr = self.recibir()
+                threading.Thread(target=entregar, args=(sock, addr), daemon=True).start()
+
+        def repartir(sock, addr):
+            try:
+                linea = mirar_primera_linea(sock)
+            except OSError:
+                sock.close()
+                return
+            proceso = destino(linea or "", self.num_procesos)
+            if proceso is None or proceso == self.proceso:
+                entregar(sock, addr)
+            else:
+                self.pasar(proceso, sock, addr)
+
+        threading.Thread(target=recibir_de_otros, daemon=True).start()
+
+        print(f"[Servidor {self.proceso}] Esperando conexiones en el puerto {puerto}...")
+        while True:
+            sock, addr = server.accept()
+            threading.Thread(target=repartir, args=(sock, addr), daemon=True).start()
+
+
+def _terminar(signum, frame):
+    raise SystemExit(0)
+
+
+def arrancar(reparto, trabajar):
+    """Crea un proceso por trabajador, que ejecuta trabajar(n), y espera a
+    que terminen. Si acaba uno (o se interrumpe o se hace kill al principal)
+    se paran todos y se espera a que salgan, para que ninguno se quede con
+    el puerto."""
+    # Antes del fork, para que un SIGTERM mientras se crean no deje hijos
+    # sueltos; los hijos vuelven al comportamiento por defecto
+    signal.signal(signal.SIGTERM, _terminar)
+    hijos = []
+    try:
+        for n in range(reparto.num_procesos):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                codigo = 1
+                try:
+                    reparto.quedarse_con(n)
+                    trabajar(n)
+                    codigo = 0
+                except KeyboardInterrupt:
+                    codigo = 0
+                finally:
+                    os._exit(codigo)
+            hijos.append(pid)
+
+        pid, estado = os.wait()
+        print(f"[Servidor] El trabajador {hijos.index(pid)} ha terminado (estado {estado}).")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for pid in hijos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in hijos:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass  # el que ya se recogió con os.wait
@@ -0,0 +1,261 @@
+import os
+import socket
+from manifiesto import hash_fichero
+
+
+# CAPA DE PROTOCOLO COMPARTIDA POR CLIENTE Y SERVIDOR
+#
+# El protocolo es de líneas de texto terminadas en '\n' (cabeceras) seguidas,
+# cuando hace falta, de un bloque binario cuyo tamaño va en la propia cabecera
+# (por ejemplo "METADATA_SIZE:123\n" + 123 bytes).
+
+TAM_BUFFER = 64 * 1024
+
+# Tamaño de bloque al recibir MP3 (se puede cambiar por conexión)
+TAM_BLOQUE_MP3 = 256 * 1024
+
+
+class ConexionCerrada(Exception):
+    """Se lanza cuando el otro extremo cierra la conexión a mitad de mensaje."""
+    pass
+
+
+class ErrorProtocolo(Exception):
+    """Se lanza cuando el otro extremo manda algo que no toca en ese momento."""
+    pass
+
+
+def sin_nagle(sock):
+    """Pone TCP_NODELAY en un socket TCP (en otros no hace nada)."""
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class Conexion:
+    """Envuelve un socket con un buffer de lectura.
+    - leer_linea() y leer_exacto() sacan los datos del buffer y solo llaman a
+      recv cuando se vacía, pidiendo bloques grandes en vez de byte a byte.
+    - Cuenta las llamadas a recv/send y los bytes para poder medir el coste
+      de una sesión.
+    - Desactiva Nagle (TCP_NODELAY): el protocolo manda a menudo dos líneas
+      cortas seguidas antes de esperar respuesta y, con Nagle y el ACK
+      retardado del otro lado, la segunda esperaba ~40 ms.
+    """
+
+    def __init__(self, sock, tam_bloque=TAM_BLOQUE_MP3):
+        self.sock = sock
+        sin_nagle(sock)
+        self.buffer = bytearray()
+        self.tam_bloque = tam_bloque
+        self._bloque = None  # Buffer reutilizable para recibir ficheros
+        self.num_recv = 0
+        self.num_send = 0
+        self.bytes_recibidos = 0
+        self.bytes_enviados = 0
+
+    # LECTURA
+
+    def _rellenar(self):
+        """Hace un recv y añade lo recibido al buffer. Devuelve False si el
+        otro extremo ha cerrado la conexión."""
+        chunk = self.sock.recv(TAM_BUFFER)
+        self.num_recv += 1
+        if not chunk:
+            return False
+        self.bytes_recibidos += len(chunk)
+        self.buffer += chunk
+        return True
+
+    def leer_linea(self):
+        """Recibe una línea terminada en '\n' y la devuelve sin el salto.
+        Si la conexión se cierra antes devuelve lo que haya (como antes)."""
+        inicio = 0
+        while True:
+            pos = self.buffer.find(b"\n", inicio)
+            if pos != -1:
+                linea = bytes(self.buffer[:pos])
+                del self.buffer[:pos + 1]
+                return linea.decode().strip()
+
+            inicio = len(self.buffer)
+            if not self._rellenar():
+                linea = bytes(self.buffer)
+                self.buffer.clear()
+                return linea.decode().strip()
+
+    def leer_exacto(self, tam):
+        """Recibe exactamente 'tam' bytes. Lanza ConexionCerrada si la
+        conexión se corta antes."""
+        while len(self.buffer) < tam:
+            if not self._rellenar():
+                raise ConexionCerrada(f"Se esperaban {tam} bytes y llegaron {len(self.buffer)}")
+
+        datos = bytes(self.buffer[:tam])
+        del self.buffer[:tam]
+        return datos
+
+    def recibir_en_fichero(self, f, tam):
+        """Recibe 'tam' bytes y los escribe en el fichero abierto 'f'.
+        Primero vacía lo que ya hubiera en el buffer de líneas y después hace
+        recv_into sobre un bloque preasignado, sin crear un bytes por trozo.
+        Lanza ConexionCerrada si la conexión se corta antes."""
+        restantes = tam
+
+        if self.buffer:
+            n = min(len(self.buffer), restantes)
+            f.write(self.buffer[:n])
+            del self.buffer[:n]
+            restantes -= n
+
+        if restantes > 0 and self._bloque is None:
+            self._bloque = memoryview(bytearray(self.tam_bloque))
+
+        while restantes > 0:
+            n = self.sock.recv_into(self._bloque, min(self.tam_bloque, restantes))
+            self.num_recv += 1
+            if n == 0:
+                raise ConexionCerrada(f"Faltaban {restantes} bytes de {tam}")
+            self.bytes_recibidos += n
+            f.write(self._bloque[:n])
+            restantes -= n
+
+    def leer_datos(self, prefijo):
+        """Lee una cabecera 'PREFIJO:tam' y el bloque de 'tam' bytes que la sigue."""
+        cabecera = self.leer_linea()
+        if not cabecera.startswith(prefijo + ":"):
+            raise ErrorProtocolo(f"Protocolo inválido (se esperaba {prefijo})")
+        tam = int(cabecera.split(":")[1])
+        return self.leer_exacto(tam)
+
+    # ESCRITURA
+
+    def enviar(self, datos):
+        self.sock.sendall(datos)
+        self.num_send += 1
+        self.bytes_enviados += len(datos)
+
+    def enviar_fichero(self, f, offset=0, tam=None):
+        """Envía el contenido del fichero abierto 'f' (en binario) desde
+        'offset'. socket.sendfile usa os.sendfile, así que los datos van del
+        disco al socket dentro del kernel sin pasar por Python."""
+        enviados = self.sock.sendfile(f, offset, tam)
+        self.num_send += 1
+        self.bytes_enviados += enviados
+        return enviados
+
+    def enviar_linea(self, linea):
+        self.enviar(f"{linea}\n".encode())
+
+    def enviar_datos(self, prefijo, datos):
+        """Envía 'PREFIJO:tam\n' seguido del bloque, en una sola llamada."""
+        self.enviar(f"{prefijo}:{len(datos)}\n".encode() + datos)
+
+    def cerrar(self):
+        self.sock.close()
+
+
+# FUNCIONES AUXILIARES PARA ENVÍO Y RECEPCIÓN DE MP3
+#
+# Un MP3 va precedido de las cabeceras MP3_SIZE (bytes que siguen) y
+# MP3_NAME. Si se reanuda una transferencia a medias, antes va además
+# MP3_RANGE:<desde>, y solo se envían los bytes a partir de esa posición.
+#
+# El receptor escribe siempre en '<nombre>.part' y lo renombra al nombre real
+# cuando ha llegado entero, así nunca queda un MP3 truncado con su nombre
+# definitivo y el .part sirve para reanudar en la siguiente sesión.
+
+EXTENSION_PARCIAL = ".part"
+
+
+def tam_parcial(carpeta, nombre):
+    """Bytes que ya hay de 'nombre' en su fichero .part (0 si no hay)."""
+    try:
+        return os.path.getsize(os.path.join(carpeta, nombre + EXTENSION_PARCIAL))
+    except OSError:
+        return 0
+
+
+def cabeceras_mp3(nombre, size, desde=0):
+    """Cabeceras que preceden a los bytes [desde, size) de un MP3."""
+    rango = f"MP3_RANGE:{desde}\n" if desde else ""
+    return f"{rango}MP3_SIZE:{size - desde}\nMP3_NAME:{nombre}\n".encode()
+
+
+def abrir_parcial(carpeta, nombre, desde):
+    """Abre el .part de 'nombre' para escribir a partir de 'desde'.
+    Devuelve (fichero, ruta_parcial, ruta_final)."""
+    ruta = os.path.join(carpeta, nombre)
+    ruta_parcial = ruta + EXTENSION_PARCIAL
+
+    if desde:
+        if tam_parcial(carpeta, nombre) < desde:
+            raise Exception(f"No se puede reanudar {nombre} desde {desde}")
+        f = open(ruta_parcial, "r+b")
+        f.seek(desde)
+        f.truncate()
+    else:
+        f = open(ruta_parcial, "wb")
+
+    return f, ruta_parcial, ruta
+
+
+def terminar_parcial(ruta_parcial, ruta, desde, hash_esperado=None):
+    """Pone el .part ya completo en su sitio. Si se ha reanudado y se conoce
+    el hash esperado, se comprueba antes: un .part viejo de otra versión del
+    fichero daría un MP3 corrupto. Devuelve la ruta final o None."""
+    if desde and hash_esperado is not None:
+        if hash_fichero(ruta_parcial) != hash_esperado:
+            os.remove(ruta_parcial)
+            return None
+
+    os.replace(ruta_parcial, ruta)
+    return ruta
+
+
+def enviar_mp3(con, ruta, desde=0):
+    # El tamaño del fichero ya abierto (fstat): sin volver a buscar la ruta
+    with open(ruta, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        desde = min(desde, size)
+
+        con.enviar(cabeceras_mp3(os.path.basename(ruta), size, desde))
+
+        if size > desde:
+            con.enviar_fichero(f, desde, size - desde)
+
+
+def leer_cabeceras_mp3(con):
+    """Lee las cabeceras de un MP3. Devuelve (desde, bytes que siguen,
+    nombre) o None si lo que llega no es un MP3."""
+    header = con.leer_linea()
+    desde = 0
+    if header.startswith("MP3_RANGE:"):
+        desde = int(header.split(":")[1])
+        header = con.leer_linea()
+
+    if not header.startswith("MP3_SIZE:"):
+        return None
+    size = int(header.split(":")[1])
+
+    header = con.leer_linea()
+    if not header.startswith("MP3_NAME:"):
+        return None
+    return desde, size, os.path.basename(header.split(":", 1)[1])
+
+
+def recibir_mp3(con, carpeta_destino, hashes=None):
+    """Recibe un MP3 en carpeta_destino. 'hashes' (nombre -> sha256, como en
+    el manifiesto) sirve para comprobar los ficheros reanudados.
+    Devuelve la ruta final, o None si la cabecera no es un MP3 o el fichero
+    reanudado no cuadra con su hash."""
+    cabeceras = leer_cabeceras_mp3(con)
+    if cabeceras is None:
+        return None
+    desde, size, nombre = cabeceras
+
+    f, ruta_parcial, ruta = abrir_parcial(carpeta_destino, nombre, desde)
+    with f:
+        con.recibir_en_fichero(f, size)
+
+    hash_esperado = hashes.get(nombre) if hashes else None
+    return terminar_parcial(ruta_parcial, ruta, desde, hash_esperado)
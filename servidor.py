@@ -1,234 +1,767 @@
 import socket
+import sys
 import threading
+import argparse
 import json
 import os
+import secrets
 from datetime import datetime  # Para timestamp de las versiones
-from pila import Pila
+from versiones import HistorialVersiones, fusionar
+from sesiones import TablaSesiones
+from diario import Diario, REEMPLAZAR, aplicar_escrituras
+from cache_usuarios import CacheUsuarios, EntradaUsuario
+from manifiesto import calcular_manifiesto
+from almacen import AlmacenBlobs
+from indice_ficheros import IndiceFicheros, NOMBRE_INDICE
+from codificacion import codificar_metadata, decodificar_metadata, decodificar_a_json, cabecera_tam, leer_cabecera_tam, ErrorCodificacion
+from operaciones import aplicar_operaciones, huella, OperacionInvalida
+import estadisticas
+from estadisticas import Estadisticas, MedidorSesion
+from protocolo import Conexion, ConexionCerrada, ErrorProtocolo, enviar_mp3, recibir_mp3, tam_parcial
 
 
-# FUNCIONES AUXILIARES PARA ENVÍO Y RECEPCIÓN DE MP3
+# SERVIDOR
 
-def recibir_linea(sock):
-    """Recibe una línea terminada en '\n'."""
-    data = b""
-    while not data.endswith(b"\n"):
-        chunk = sock.recv(1)
-        if not chunk:
-            break
-        data += chunk
-    return data.decode().strip()
+# Sesiones abiertas de cada usuario (puede haber varias: uno por dispositivo)
+SESIONES = TablaSesiones()
+BASE_DATOS = "datos_server"
+PUERTO = 9999
 
+# Capacidades que entiende este servidor (las comunes con el cliente se le
+# confirman en la respuesta al LOGIN: OK:<CAP1,CAP2>)
+CAPACIDADES = {"DELTA", "PARALELO", "ZLIB", "BIN", "VERSION", "OPS", "BLOBS", "CHECKPOINT"}
 
-def enviar_mp3(sock, ruta):
-    size = os.path.getsize(ruta)
-    nombre = os.path.basename(ruta)
+# Biblioteca de un usuario nuevo (es la versión 0)
+BIBLIOTECA_VACIA = {"canciones": [], "listas": []}
 
-    sock.sendall(f"MP3_SIZE:{size}\n".encode())
-    sock.sendall(f"MP3_NAME:{nombre}\n".encode())
+# Metadata actual e historial de versiones de los usuarios usados recientemente
+CACHE_USUARIOS = CacheUsuarios()
 
-    with open(ruta, "rb") as f:
-        while True:
-            chunk = f.read(1024)
-            if not chunk:
-                break
-            sock.sendall(chunk)
+# Tiempos y bytes por fase, errores y medidores (ver estadisticas.py)
+ESTADISTICAS = Estadisticas()
 
+# Diario de escrituras de metadata (se crea en main). Sin él, las
+# escrituras se aplican directamente.
+DIARIO = None
 
-def recibir_mp3(sock, carpeta_destino):
-    header = recibir_linea(sock)
-    if not header.startswith("MP3_SIZE:"):
-        return None
-    size = int(header.split(":")[1])
+# Tokens de las conexiones extra de transferencia (capacidad PARALELO).
+# Solo son válidos mientras la sesión principal que los creó sigue abierta.
+TOKENS_TRANSFERENCIA = {}  # token -> carpeta del usuario
 
-    header = recibir_linea(sock)
-    if not header.startswith("MP3_NAME:"):
-        return None
-    nombre = header.split(":")[1]
+# MP3 de todos los usuarios guardados una vez por contenido (ver almacen.py)
+ALMACEN = AlmacenBlobs(os.path.join(BASE_DATOS, ".blobs"))
 
-    ruta = os.path.join(carpeta_destino, nombre)
+# MP3 de cada usuario con su tamaño y hash (se crea en trabajar, ver
+# indice_ficheros.py). Sin él, se mira la carpeta del usuario cada vez.
+INDICE = None
 
-    with open(ruta, "wb") as f:
-        restantes = size
-        while restantes > 0:
-            chunk = sock.recv(min(1024, restantes))
-            if not chunk:
-                break
-            f.write(chunk)
-            restantes -= len(chunk)
+# Número de este proceso trabajador cuando hay varios (ver procesos.py)
+PROCESO = 0
 
-    return ruta
+# La orden STATS no pide LOGIN: solo se atiende si se arranca con
+# --stats-publicas (p. ej. en una red interna, para la monitorización)
+STATS_PUBLICAS = False
 
 
-# SERVIDOR
+# OPERACIONES DE E/S DE UNA SESIÓN
+#
+# El protocolo de una sesión (sesion_cliente) es un generador que no toca el
+# socket: hace 'yield' de la operación que necesita y recibe el resultado.
+# Así el mismo protocolo lo ejecutan el motor de hilos (manejar_cliente, más
+# abajo) y el motor asyncio (servidor_async.py).
 
-USUARIOS_ACTIVOS = {}     # usuario -> True si está conectado
-BASE_DATOS = "datos_server"
+LEER_LINEA = "leer_linea"           # (LEER_LINEA,) -> str
+LEER_DATOS = "leer_datos"           # (LEER_DATOS, prefijo) -> bytes
+LEER_EXACTO = "leer_exacto"         # (LEER_EXACTO, tam) -> bytes
+ENVIAR = "enviar"                   # (ENVIAR, bytes)
+ENVIAR_MP3 = "enviar_mp3"           # (ENVIAR_MP3, ruta, desde)
+RECIBIR_MP3 = "recibir_mp3"         # (RECIBIR_MP3, carpeta, hashes) -> ruta o None
+BLOQUEANTE = "bloqueante"           # (BLOQUEANTE, funcion, *args) -> resultado
+FASE = "fase"                       # (FASE, nombre o None): empieza una fase (o deja de medir)
 
-# Diccionario de pilas de versiones por usuario
-PILAS_VERSIONES = {}      # usuario -> Pila()
 
+def linea(texto):
+    """Operación para enviar una línea de texto."""
+    return (ENVIAR, f"{texto}\n".encode())
 
-def reconstruir_pila_usuario(usuario, carpeta_usuario):
-    """Reconstruye la pila de versiones de un usuario leyendo los ficheros
-    biblioteca_*.json de su carpeta. La cima de la pila será la versión más reciente.
-    """
-    pila = Pila()
 
-    if not os.path.exists(carpeta_usuario):
-        os.makedirs(carpeta_usuario, exist_ok=True)
+def bloque(prefijo, datos, etiqueta="json"):
+    """Operación para enviar 'PREFIJO:tam[:etiqueta]\n' seguido de los datos."""
+    return (ENVIAR, cabecera_tam(prefijo, datos, etiqueta) + datos)
 
-    # Listar archivos que siguen el patrón de versión
-    nombres = [
-        nombre for nombre in os.listdir(carpeta_usuario)
-        if nombre.startswith("biblioteca_") and nombre.endswith(".json")
-    ]
 
-    # Ordenamos por nombre (como llevan timestamp en AAAA_MM_DD_HH_MM_SS, el orden
-    # coincide con el cronológico)
-    nombres.sort()
+def preparar_usuario(usuario, carpeta_usuario, info):
+    """Crea la carpeta del usuario si no existe y devuelve su EntradaUsuario:
+    la que ya usan sus otras sesiones abiertas, la de la caché o, si no, la
+    que se lee de biblioteca.json y el índice de versiones."""
+    def cargar():
+        os.makedirs(carpeta_usuario, exist_ok=True)
+        metadata = leer_biblioteca(carpeta_usuario)
+        # Las versiones del formato antiguo (biblioteca_<fecha>.json) solo
+        # se buscan la primera vez, antes de que el usuario esté en el índice
+        migrar = INDICE is None or not INDICE.conocido(carpeta_usuario)
+        versiones = HistorialVersiones(carpeta_usuario, migrar)
 
-    # Apilamos en orden: el último en apilar será la cima (versión más reciente)
-    for nombre in nombres:
+        # Biblioteca de antes de numerar las versiones: pasa a ser la última
+        ruta_json = os.path.join(carpeta_usuario, "biblioteca.json")
+        if os.path.exists(ruta_json) and not versiones.es_ultima(metadata):
+            versiones.guardar(metadata, datetime.now().strftime("%Y_%m_%d_%H_%M_%S"))
+
+        return EntradaUsuario(metadata, versiones, versiones.ultima)
+
+    with info.cerrojo:
+        if info.entrada is None:
+            info.entrada = CACHE_USUARIOS.obtener(usuario, cargar)
+        return info.entrada
+
+
+def leer_biblioteca(carpeta_usuario):
+    """Devuelve el contenido de biblioteca.json (o una biblioteca vacía)."""
+    ruta_json = os.path.join(carpeta_usuario, "biblioteca.json")
+    if os.path.exists(ruta_json):
+        with open(ruta_json, "r", encoding="utf-8") as f:
+            return f.read()
+
+    # Biblioteca vacía inicial
+    return json.dumps(BIBLIOTECA_VACIA)
+
+
+def codificar_para(entrada, info, capacidades):
+    """Versión actual y metadata de la entrada codificada para esas
+    capacidades, reutilizando la última codificación mientras la metadata no
+    cambie. Devuelve (version, bytes, etiqueta)."""
+    clave = ("BIN" in capacidades, "ZLIB" in capacidades)
+    # Con el cerrojo del usuario la versión y la metadata van a juego
+    with info.cerrojo:
+        codificada = entrada.codificadas.get(clave)
+        if codificada is None:
+            codificada = codificar_metadata(entrada.metadata, capacidades)
+            CACHE_USUARIOS.anadir_codificada(entrada, clave, codificada)
+        version = entrada.version
+    return (version,) + codificada
+
+
+def listar_mp3(carpeta_usuario):
+    if INDICE is not None:
+        return list(manifiesto_usuario(carpeta_usuario))
+    return [f for f in os.listdir(carpeta_usuario) if f.lower().endswith(".mp3")]
+
+
+def manifiesto_usuario(carpeta_usuario):
+    """Manifiesto de los MP3 del usuario (del índice si está activo). Cuando
+    se lee la carpeta, de paso pasa al almacén los que aún no estén en él."""
+    if INDICE is not None and INDICE.conocido(carpeta_usuario):
+        return INDICE.manifiesto(carpeta_usuario)
+    if INDICE is not None:
+        manifiesto = INDICE.manifiesto(carpeta_usuario)
+    else:
+        manifiesto = calcular_manifiesto(carpeta_usuario)
+    ALMACEN.incorporar(carpeta_usuario, manifiesto)
+    return manifiesto
+
+
+def tiene_mp3(carpeta_usuario, nombre):
+    if INDICE is not None:
+        return INDICE.info(carpeta_usuario, nombre) is not None
+    return os.path.isfile(os.path.join(carpeta_usuario, nombre))
+
+
+def guardar_mp3(ruta, hash_mp3=None):
+    """Pasa al almacén un MP3 que el servidor acaba de poner en la carpeta
+    de un usuario y lo anota en el índice."""
+    hash_mp3 = ALMACEN.guardar(ruta, hash_mp3)
+    if INDICE is not None:
+        INDICE.anotar(ruta, hash_mp3)
+    return hash_mp3
+
+
+def aceptar_oferta(carpeta_usuario, oferta):
+    """Con BLOBS, antes de subir sus MP3 el cliente manda {nombre: hash}. Los
+    que ya están en el almacén (de este usuario o de otro) se enlazan en su
+    carpeta sin transferirlos; devuelve los nombres que sí hay que subir."""
+    faltan = []
+    for nombre, hash_mp3 in oferta.items():
+        nombre = os.path.basename(nombre)
         ruta = os.path.join(carpeta_usuario, nombre)
-        pila.apilar(ruta)
+        if not ALMACEN.enlazar(hash_mp3, ruta):
+            faltan.append(nombre)
+        elif INDICE is not None:
+            INDICE.anotar(ruta, hash_mp3)
+    return faltan
+
+
+def confirmar_escrituras(escrituras):
+    """Hace duraderas las escrituras: por el diario (junto con las de otras
+    sesiones) si está activo, o directamente si no."""
+    if DIARIO is not None:
+        DIARIO.confirmar(escrituras)
+    else:
+        aplicar_escrituras(escrituras)
+
+
+def guardar_biblioteca(carpeta_usuario, entrada, contenido_nuevo):
+    """Guarda la nueva metadata como biblioteca.json y como nueva versión en
+    el historial del usuario. Las dos se confirman juntas en el diario: o se
+    escriben las dos o ninguna. Hay que llamarla con el cerrojo del usuario.
+    Devuelve el número de la nueva versión."""
+    ruta_json = os.path.join(carpeta_usuario, "biblioteca.json")
+    timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+
+    version, escrituras = entrada.versiones.preparar(contenido_nuevo, timestamp)
+    escrituras.append((REEMPLAZAR, ruta_json, contenido_nuevo.encode()))
+    confirmar_escrituras(escrituras)
+    # Solo con las escrituras ya duraderas pasa la versión a memoria
+    entrada.versiones.confirmar()
+
+    CACHE_USUARIOS.actualizar_metadata(entrada, contenido_nuevo, version)
+    return version
+
+
+# Respuestas a una subida de metadata (capacidad VERSION)
+GUARDADA = "SAVED"        # la base era la versión actual: se guarda tal cual
+FUSIONADA = "MERGED"      # otro dispositivo subió antes: se han combinado
+CONFLICTO = "CONFLICT"    # los cambios chocan: no se guarda nada
+REENVIAR = "RESEND"       # las operaciones no dan lo que tiene el cliente: que suba la biblioteca entera
+ATRASADA = "BEHIND"       # punto de control sobre una versión que ya no es la actual: no se guarda
+
+
+def subir_biblioteca(carpeta_usuario, entrada, info, base, contenido_nuevo, solo_avance=False):
+    """Guarda la metadata que sube un cliente a partir de la versión 'base'
+    (None para clientes sin la capacidad VERSION: gana siempre la última
+    subida, como antes). Con solo_avance (puntos de control) solo se guarda
+    si 'base' sigue siendo la versión actual: no se fusiona.
+    Devuelve (respuesta, version, conflictos)."""
+    with info.cerrojo:
+        actual = entrada.version
+        if solo_avance and base != actual:
+            return ATRASADA, actual, None
+        if base is None or base == actual:
+            return GUARDADA, guardar_biblioteca(carpeta_usuario, entrada, contenido_nuevo), None
+
+        base_data = leer_version(entrada, base)
+        if base_data is None:
+            return CONFLICTO, actual, {"canciones": [], "listas": [], "base": base}
+        return _fusionar_y_guardar(carpeta_usuario, entrada, base_data, json.loads(contenido_nuevo))
+
+
+def subir_operaciones(carpeta_usuario, entrada, info, base, paquete, solo_avance=False):
+    """Como subir_biblioteca, pero el cliente manda solo las operaciones
+    que ha hecho sobre la versión 'base' (ver operaciones.py) y la huella de
+    la biblioteca que le han quedado. Si no ha cambiado nada no se escribe."""
+    with info.cerrojo:
+        actual = entrada.version
+        if solo_avance and base != actual:
+            return ATRASADA, actual, None
+        base_data = leer_version(entrada, base)
+        if base_data is None:
+            return CONFLICTO, actual, {"canciones": [], "listas": [], "base": base}
+
+        try:
+            mio = aplicar_operaciones(base_data, paquete["ops"])
+        except OperacionInvalida:
+            return REENVIAR, actual, None
+        if huella(mio) != paquete.get("huella"):
+            return REENVIAR, actual, None
+
+        if not paquete["ops"]:
+            return GUARDADA, actual, None
+        if base == actual:
+            return GUARDADA, guardar_biblioteca(carpeta_usuario, entrada, json.dumps(mio)), None
+        return _fusionar_y_guardar(carpeta_usuario, entrada, base_data, mio)
+
+
+def leer_version(entrada, version):
+    """Diccionario de una versión de la biblioteca del usuario, o None si
+    ya no está en el historial (compactada) o no existe."""
+    if version == entrada.version:
+        return json.loads(entrada.metadata)
+    if version == 0:
+        # La versión 0 es la biblioteca vacía de un usuario nuevo
+        return BIBLIOTECA_VACIA
+    try:
+        return json.loads(entrada.versiones.leer(version))
+    except KeyError:
+        return None
 
-    PILAS_VERSIONES[usuario] = pila
-    return pila
 
+def _fusionar_y_guardar(carpeta_usuario, entrada, base_data, mio):
+    fusion, conflictos = fusionar(base_data, json.loads(entrada.metadata), mio)
+    if conflictos:
+        return CONFLICTO, entrada.version, conflictos
+    return FUSIONADA, guardar_biblioteca(carpeta_usuario, entrada, json.dumps(fusion)), None
+
+
+def recibir_oferta(carpeta_usuario):
+    """Con BLOBS el cliente ofrece los MP3 que va a subir ({nombre: hash},
+    OFERTA_SIZE) y se le contesta cuáles hay que subir (FALTAN_SIZE); los
+    demás se enlazan desde el almacén."""
+    oferta = json.loads((yield (LEER_DATOS, "OFERTA_SIZE")).decode())
+    faltan = yield (BLOQUEANTE, aceptar_oferta, carpeta_usuario, oferta)
+    yield bloque("FALTAN_SIZE", json.dumps(faltan).encode())
+
+
+def sesion_transferencia(token):
+    """Conexión extra de un cliente con sesión abierta para mover MP3 en
+    paralelo. No toma el bloqueo del usuario: va ligada a la sesión principal
+    a través del token. Órdenes:
+    - GET:<desde>:<nombre> -> el servidor envía ese MP3 a partir del byte
+                              'desde' (o ERROR si no existe)
+    - PUT:<hash>:<nombre>  -> el servidor responde DESDE:<n> con lo que ya
+                              tiene en su .part, recibe el MP3 desde ahí y
+                              responde OK (o ERROR si el hash no cuadra)
+    - FIN                  -> cierra la conexión
+    """
+    carpeta_usuario = TOKENS_TRANSFERENCIA.get(token)
+    if carpeta_usuario is None:
+        yield linea("ERROR")
+        return
+    yield linea("OK")
 
-def manejar_cliente(sock, addr):
-    print(f"[+] Conexión aceptada desde {addr}")
+    while True:
+        orden = yield (LEER_LINEA,)
+
+        if orden.startswith("GET:"):
+            yield (FASE, estadisticas.TRANSFERENCIA_DESCARGA)
+            _, desde, nombre = orden.split(":", 2)
+            nombre = os.path.basename(nombre)
+            existe = yield (BLOQUEANTE, tiene_mp3, carpeta_usuario, nombre)
+            if existe:
+                ruta = os.path.join(carpeta_usuario, nombre)
+                yield (ENVIAR_MP3, ruta, int(desde))
+            else:
+                yield linea("ERROR")
+
+        elif orden.startswith("PUT:"):
+            yield (FASE, estadisticas.TRANSFERENCIA_SUBIDA)
+            _, hash_esperado, nombre = orden.split(":", 2)
+            nombre = os.path.basename(nombre)
+            desde = yield (BLOQUEANTE, tam_parcial, carpeta_usuario, nombre)
+            yield linea(f"DESDE:{desde}")
+            ruta = yield (RECIBIR_MP3, carpeta_usuario, {nombre: hash_esperado})
+            if ruta:
+                yield (BLOQUEANTE, guardar_mp3, ruta)
+            yield linea("OK" if ruta else "ERROR")
+
+        elif orden in ("FIN", ""):
+            return
 
-    usuario = None
+        else:
+            raise ErrorProtocolo(f"Orden de transferencia inválida: {orden}")
 
-    try:
-        # 1. LOGIN
-        linea = recibir_linea(sock)
-        if not linea.startswith("LOGIN:"):
-            sock.sendall("ERROR\n".encode())
-            sock.close()
-            return
+        # Entre orden y orden la conexión está parada: no se mide
+        yield (FASE, None)
 
-        usuario = linea.split(":")[1].strip()
 
-        # Comprobar bloqueo
-        if usuario in USUARIOS_ACTIVOS:
-            sock.sendall("REJECTED\n".encode())
-            sock.close()
-            return
+def tipo_error(e):
+    """Categoría de un error para las estadísticas."""
+    if isinstance(e, (ConexionCerrada, ConnectionError)):
+        return "conexion_cerrada"
+    if isinstance(e, (ErrorProtocolo, ValueError)):
+        return "protocolo"
+    if isinstance(e, ErrorCodificacion):
+        return "codificacion"
+    if isinstance(e, OSError):
+        return "red_o_disco"
+    return "otro"
 
-        # Bloquear usuario
-        USUARIOS_ACTIVOS[usuario] = True
-        sock.sendall("OK\n".encode())
 
-        # Carpeta del usuario
-        carpeta_usuario = os.path.join(BASE_DATOS, usuario)
-        os.makedirs(carpeta_usuario, exist_ok=True)
+def enviar_estadisticas(formato):
+    """Orden STATS (JSON) o STATS:PROMETHEUS."""
+    if formato == "PROMETHEUS":
+        yield bloque("STATS_SIZE", ESTADISTICAS.formato_prometheus().encode(), "prometheus")
+    else:
+        datos = json.dumps(ESTADISTICAS.instantanea(), ensure_ascii=False).encode()
+        yield bloque("STATS_SIZE", datos)
 
-        # NUEVO: Reconstruir/crear la pila de versiones para este usuario
-        pila_versiones = PILAS_VERSIONES.get(usuario)
-        if pila_versiones is None:
-            pila_versiones = reconstruir_pila_usuario(usuario, carpeta_usuario)
 
-        # 2. ENVIAR METADATA ACTUAL
-        ruta_json = os.path.join(carpeta_usuario, "biblioteca.json")
-        if os.path.exists(ruta_json):
-            with open(ruta_json, "r", encoding="utf-8") as f:
-                data = f.read()
-        else:
-            # Biblioteca vacía inicial
-            data = json.dumps({"canciones": [], "listas": []})
+def sesion_cliente(addr):
+    """Protocolo de una sesión completa (ver OPERACIONES DE E/S)."""
+    usuario = None
+    token = None
 
-        data_bytes = data.encode()
-        sock.sendall(f"METADATA_SIZE:{len(data_bytes)}\n".encode())
-        sock.sendall(data_bytes)
+    try:
+        # 1. LOGIN (o conexión extra de transferencia de una sesión ya
+        # abierta, o consulta de estadísticas)
+        linea_login = yield (LEER_LINEA,)
+        if linea_login.startswith("TRANSFER:"):
+            yield from sesion_transferencia(linea_login.split(":", 1)[1])
+            return
 
-        # 3. ENVIAR TODOS LOS MP3 QUE TENGA EL USUARIO
-        mp3s = [f for f in os.listdir(carpeta_usuario) if f.lower().endswith(".mp3")]
+        if linea_login == "STATS" or linea_login.startswith("STATS:"):
+            if not STATS_PUBLICAS:
+                yield linea("ERROR")
+                return
+            yield from enviar_estadisticas(linea_login.partition(":")[2].upper())
+            return
 
-        sock.sendall(f"NUM_MP3:{len(mp3s)}\n".encode())
+        yield (FASE, estadisticas.LOGIN)
 
-        for mp3 in mp3s:
-            ruta_mp3 = os.path.join(carpeta_usuario, mp3)
-            enviar_mp3(sock, ruta_mp3)
+        if not linea_login.startswith("LOGIN:"):
+            yield linea("ERROR")
+            return
 
-        # 4. RECIBIR NUEVA METADATA DESDE EL CLIENTE
-        linea = recibir_linea(sock)
-        if linea != "UPLOAD_METADATA":
-            raise Exception("Protocolo inválido (se esperaba UPLOAD_METADATA)")
+        partes = linea_login.split(":")
+        nombre = partes[1].strip()
+        # El nombre es una carpeta de datos_server: ni rutas ni ocultas (.blobs)
+        if not nombre or nombre.startswith(".") or os.sep in nombre:
+            yield linea("ERROR")
+            return
 
-        header = recibir_linea(sock)
-        if not header.startswith("SIZE:"):
-            raise Exception("Protocolo inválido en metadata")
+        # Capacidades opcionales anunciadas por el cliente: LOGIN:usuario:CAP1,CAP2
+        capacidades = set()
+        if len(partes) > 2:
+            capacidades = {c.strip() for c in partes[2].split(",") if c.strip()}
+
+        # El mismo usuario puede tener varias sesiones (varios dispositivos):
+        # los cambios concurrentes se resuelven al subir la metadata
+        info = SESIONES.abrir(nombre)
+        usuario = nombre
+        ESTADISTICAS.sesion_abierta()
+        if capacidades:
+            yield linea("OK:" + ",".join(sorted(capacidades & CAPACIDADES)))
+        else:
+            yield linea("OK")
 
-        tam = int(header.split(":")[1])
-        contenido_nuevo = sock.recv(tam).decode()
+        # Carpeta del usuario, su metadata y su pila de versiones
+        carpeta_usuario = os.path.join(BASE_DATOS, usuario)
+        entrada = yield (BLOQUEANTE, preparar_usuario, usuario, carpeta_usuario, info)
+
+        # Token para abrir conexiones extra de transferencia (solo si se ha
+        # confirmado PARALELO: el cliente lo espera según el OK)
+        if "PARALELO" in capacidades & CAPACIDADES:
+            # Empieza por el número del proceso para que procesos.py sepa a
+            # quién pasarle las conexiones de transferencia
+            token = f"{PROCESO}-{secrets.token_hex(16)}"
+            TOKENS_TRANSFERENCIA[token] = carpeta_usuario
+            yield linea(f"TOKEN:{token}")
+
+        # 2. ENVIAR METADATA ACTUAL (comprimida/binaria si el cliente lo admite)
+        # y su número de versión, que el cliente devuelve al subir sus cambios
+        yield (FASE, estadisticas.DESCARGA_METADATA)
+        version, cuerpo, etiqueta = yield (BLOQUEANTE, codificar_para, entrada, info, capacidades)
+        if "VERSION" in capacidades:
+            yield linea(f"VERSION:{version}")
+        yield bloque("METADATA_SIZE", cuerpo, etiqueta)
+
+        # 3. ENVIAR LOS MP3 DEL USUARIO
+        yield (FASE, estadisticas.DESCARGA_MP3)
+        if "DELTA" in capacidades:
+            # Sincronización incremental: mandamos el manifiesto (nombre, tamaño,
+            # hash) y el cliente nos pide solo los que le faltan o han cambiado
+            manifiesto = yield (BLOQUEANTE, manifiesto_usuario, carpeta_usuario)
+            yield bloque("MANIFEST_SIZE", json.dumps(manifiesto).encode())
+
+            # nombre -> byte desde el que reanudar (lo que ya tiene el cliente)
+            pedidos = json.loads((yield (LEER_DATOS, "PEDIR_SIZE")).decode())
+            if isinstance(pedidos, list):
+                pedidos = dict.fromkeys(pedidos, 0)
+            mp3s = {nombre: desde for nombre, desde in pedidos.items() if nombre in manifiesto}
+        else:
+            # Clientes antiguos: mandamos todos
+            mp3s = dict.fromkeys((yield (BLOQUEANTE, listar_mp3, carpeta_usuario)), 0)
 
-        # NUEVO: antes de sobrescribir biblioteca.json, guardar versión anterior (si existe)
-        if os.path.exists(ruta_json):
-            with open(ruta_json, "r", encoding="utf-8") as f:
-                contenido_anterior = f.read()
+        yield linea(f"NUM_MP3:{len(mp3s)}")
 
-            # Solo guardamos versión si había algo (no está vacío del todo)
-            if contenido_anterior.strip():
-                timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-                nombre_version = f"biblioteca_{timestamp}.json"
-                ruta_version = os.path.join(carpeta_usuario, nombre_version)
+        for mp3, desde in mp3s.items():
+            yield (ENVIAR_MP3, os.path.join(carpeta_usuario, mp3), desde)
 
-                # Guardar contenido anterior en el fichero de versión
-                with open(ruta_version, "w", encoding="utf-8") as f:
-                    f.write(contenido_anterior)
+        # Mientras el usuario usa el menú la conexión está parada
+        yield (FASE, estadisticas.EDICION)
 
-                # Apilar la ruta de la nueva versión en la pila del usuario
-                pila_versiones.apilar(ruta_version)
+        # 4. RECIBIR NUEVA METADATA DESDE EL CLIENTE
+        # Con VERSION el cliente indica la versión sobre la que hizo sus
+        # cambios (BASE:<n>) y recibe SAVED:<v>, MERGED:<v> o CONFLICT:<v>.
+        # Tras un conflicto puede volver a subir (sobre la versión <v>) o
+        # quedarse con lo que hay en el servidor (DISCARD).
+        # Con OPS puede subir solo sus operaciones (UPLOAD_OPS + OPS_SIZE);
+        # si el servidor no llega a la misma biblioteca contesta RESEND:<v>
+        # y el cliente sube la biblioteca entera.
+        # Con CHECKPOINT el cliente puede subir antes, mientras trabaja,
+        # puntos de control: CHECKPOINT seguido de una subida normal. Solo se
+        # guardan si van sobre la versión actual (si no, BEHIND:<v> y los
+        # cambios se combinan en la subida final); con BLOBS después viene la
+        # oferta de MP3 (que se suben por las conexiones de transferencia) y
+        # se vuelve a esperar.
+        punto_control = False
+        while True:
+            linea_cliente = yield (LEER_LINEA,)
+            if linea_cliente == "CHECKPOINT" and "CHECKPOINT" in capacidades:
+                punto_control = True
+                yield (FASE, estadisticas.PUNTO_CONTROL)
+                continue
+            if linea_cliente == "DISCARD":
+                break
+            if linea_cliente not in ("UPLOAD_METADATA", "UPLOAD_OPS"):
+                raise ErrorProtocolo("Protocolo inválido (se esperaba UPLOAD_METADATA)")
+            if not punto_control:
+                yield (FASE, estadisticas.SUBIDA_METADATA)
+
+            base = None
+            cabecera = yield (LEER_LINEA,)
+            if cabecera.startswith("BASE:"):
+                base = int(cabecera.split(":")[1])
+                cabecera = yield (LEER_LINEA,)
+
+            if linea_cliente == "UPLOAD_OPS":
+                if base is None:
+                    raise ErrorProtocolo("Protocolo inválido (UPLOAD_OPS sin BASE)")
+                tam, etiqueta = leer_cabecera_tam(cabecera, "OPS_SIZE")
+                cuerpo = yield (LEER_EXACTO, tam)
+                paquete = yield (BLOQUEANTE, decodificar_metadata, cuerpo, etiqueta)
+                respuesta, version, conflictos = yield (
+                    BLOQUEANTE, subir_operaciones, carpeta_usuario, entrada, info, base, paquete, punto_control)
+            else:
+                tam, etiqueta = leer_cabecera_tam(cabecera, "SIZE")
+                cuerpo = yield (LEER_EXACTO, tam)
+                contenido_nuevo = yield (BLOQUEANTE, decodificar_a_json, cuerpo, etiqueta)
+                respuesta, version, conflictos = yield (
+                    BLOQUEANTE, subir_biblioteca, carpeta_usuario, entrada, info, base, contenido_nuevo,
+                    punto_control)
+
+            if "VERSION" not in capacidades:
+                break
+            yield linea(f"{respuesta}:{version}")
+            if respuesta == REENVIAR:
+                continue
+            if punto_control:
+                if respuesta == GUARDADA and "BLOBS" in capacidades:
+                    yield from recibir_oferta(carpeta_usuario)
+                punto_control = False
+                yield (FASE, estadisticas.EDICION)
+                continue
+            if respuesta in (GUARDADA, FUSIONADA):
+                break
+            yield bloque("CONFLICT_SIZE", json.dumps(conflictos).encode())
+            yield (FASE, estadisticas.EDICION)  # el usuario decide qué hacer
 
-        # Ahora sí, guardamos la nueva metadata como versión actual
-        with open(ruta_json, "w", encoding="utf-8") as f:
-            f.write(contenido_nuevo)
+        # 5. MP3 QUE EL SERVIDOR YA TIENE (ver recibir_oferta)
+        yield (FASE, estadisticas.SUBIDA_MP3)
+        if "BLOBS" in capacidades:
+            yield from recibir_oferta(carpeta_usuario)
 
-        # 5. RECIBIR NÚMERO DE MP3
-        linea = recibir_linea(sock)
-        if not linea.startswith("NUM_MP3:"):
-            raise Exception("Protocolo inválido al recibir número de MP3")
+        # 6. RECIBIR NÚMERO DE MP3 (antes el cliente sube en paralelo lo que pueda)
+        linea_cliente = yield (LEER_LINEA,)
+        if not linea_cliente.startswith("NUM_MP3:"):
+            raise ErrorProtocolo("Protocolo inválido al recibir número de MP3")
 
-        n = int(linea.split(":")[1])
+        n = int(linea_cliente.split(":")[1])
 
         # Recibir MP3 uno por uno
         for _ in range(n):
-            recibir_mp3(sock, carpeta_usuario)
+            ruta = yield (RECIBIR_MP3, carpeta_usuario, None)
+            if ruta:
+                yield (BLOQUEANTE, guardar_mp3, ruta)
 
-        # 6. LOGOUT
-        linea = recibir_linea(sock)
-        if linea != "LOGOUT":
-            raise Exception("Protocolo inválido en LOGOUT")
+        # 7. LOGOUT
+        yield (FASE, estadisticas.LOGOUT)
+        linea_cliente = yield (LEER_LINEA,)
+        if linea_cliente != "LOGOUT":
+            raise ErrorProtocolo("Protocolo inválido en LOGOUT")
 
         print(f"[+] Usuario {usuario} desconectado limpiamente.")
 
     except Exception as e:
         print(f"[ERROR] {e}")
+        ESTADISTICAS.registrar_error(tipo_error(e))
 
     finally:
-        # Liberar usuario
-        if usuario in USUARIOS_ACTIVOS:
-            USUARIOS_ACTIVOS.pop(usuario)
-        sock.close()
+        # Invalidar las conexiones de transferencia de esta sesión
+        if token is not None:
+            TOKENS_TRANSFERENCIA.pop(token, None)
+
+        # Cerrar la sesión del usuario
+        if usuario is not None:
+            SESIONES.cerrar(usuario)
+            ESTADISTICAS.sesion_cerrada()
+
+
+# MOTOR DE HILOS (un hilo por conexión)
+
+def ejecutar_operacion(con, op, medidor):
+    """Ejecuta de forma bloqueante una operación pedida por sesion_cliente."""
+    tipo = op[0]
+    if tipo == FASE:
+        return medidor.empezar(op[1]) if op[1] else medidor.terminar()
+    if tipo == LEER_LINEA:
+        return con.leer_linea()
+    if tipo == LEER_DATOS:
+        return con.leer_datos(op[1])
+    if tipo == LEER_EXACTO:
+        return con.leer_exacto(op[1])
+    if tipo == ENVIAR:
+        return con.enviar(op[1])
+    if tipo == ENVIAR_MP3:
+        return enviar_mp3(con, op[1], op[2])
+    if tipo == RECIBIR_MP3:
+        return recibir_mp3(con, op[1], op[2])
+    if tipo == BLOQUEANTE:
+        return op[1](*op[2:])
+    raise ValueError(f"Operación desconocida: {tipo}")
 
 
-def main():
-    if not os.path.exists(BASE_DATOS):
-        os.makedirs(BASE_DATOS)
+def manejar_cliente(sock, addr):
+    print(f"[+] Conexión aceptada desde {addr}")
+
+    con = Conexion(sock)
+    medidor = MedidorSesion(ESTADISTICAS, con)
+    sesion = sesion_cliente(addr)
+    resultado = None
+    error = None
+
+    try:
+        while True:
+            try:
+                if error is not None:
+                    op = sesion.throw(error)
+                else:
+                    op = sesion.send(resultado)
+            except StopIteration:
+                break
+
+            resultado = None
+            error = None
+            try:
+                resultado = ejecutar_operacion(con, op, medidor)
+            except Exception as e:
+                # Se lo pasamos al protocolo para que libere lo que tenga
+                error = e
+    finally:
+        medidor.terminar()
+        con.cerrar()
+
+    print(f"[+] Conexión {addr} cerrada ({con.num_recv} recv, {con.num_send} send).")
+
+
+def servir_con_hilos(puerto, backlog, max_sesiones, reparto=None):
+    if reparto is not None:
+        # Varios procesos: el reparto acepta y nos entrega, cada una en su
+        # hilo, las conexiones de nuestros usuarios
+        plazas = threading.BoundedSemaphore(max_sesiones)
+
+        def entregar(sock, addr):
+            with plazas:
+                manejar_cliente(sock, addr)
+
+        reparto.servir(puerto, backlog, entregar)
+        return
 
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("0.0.0.0", 9999))
-    server.listen(5)
+    # Permite reiniciar el servidor aunque queden conexiones en TIME_WAIT
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("0.0.0.0", puerto))
+    server.listen(backlog)
 
-    print("[Servidor] Esperando conexiones en el puerto 9999...")
+    # Si hay max_sesiones abiertas dejamos de aceptar: los nuevos clientes
+    # esperan en el backlog del sistema en vez de crear más hilos
+    plazas = threading.BoundedSemaphore(max_sesiones)
+
+    def atender(sock, addr):
+        try:
+            manejar_cliente(sock, addr)
+        finally:
+            plazas.release()
+
+    print(f"[Servidor] Esperando conexiones en el puerto {puerto}...")
 
     while True:
+        plazas.acquire()
         sock, addr = server.accept()
-        hilo = threading.Thread(target=manejar_cliente, args=(sock, addr), daemon=True)
+        hilo = threading.Thread(target=atender, args=(sock, addr), daemon=True)
         hilo.start()
 
 
+def main(argv=None):
+    global STATS_PUBLICAS
+    parser = argparse.ArgumentParser(description="Servidor de sincronización de la plataforma musical")
+    parser.add_argument("--modo", choices=["hilos", "asyncio"], default="hilos",
+                        help="motor del servidor: un hilo por conexión o asyncio")
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--backlog", type=int, default=128,
+                        help="conexiones pendientes de aceptar que admite el sistema")
+    parser.add_argument("--max-sesiones", type=int, default=1000,
+                        help="sesiones atendidas a la vez; el resto espera")
+    parser.add_argument("--cache-usuarios", type=int, default=1000,
+                        help="usuarios cuya metadata se mantiene en memoria")
+    parser.add_argument("--cache-mb", type=int, default=256,
+                        help="memoria máxima para la metadata en caché")
+    parser.add_argument("--hilos-io", type=int, default=16,
+                        help="(asyncio) hilos para la E/S de disco")
+    parser.add_argument("--stats-fichero", default=None,
+                        help="fichero de texto de Prometheus donde volcar las estadísticas")
+    parser.add_argument("--stats-cada", type=float, default=15,
+                        help="segundos entre volcados de --stats-fichero")
+    parser.add_argument("--stats-publicas", action="store_true",
+                        help="responder a la orden STATS sin LOGIN (cualquiera que llegue al puerto)")
+    parser.add_argument("--procesos", type=int, default=1,
+                        help="procesos trabajadores que comparten el puerto (SO_REUSEPORT)")
+    args = parser.parse_args(argv)
+
+    if args.procesos > 1 and not (hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")):
+        parser.error("--procesos necesita fork y SO_REUSEPORT (Linux, BSD, macOS)")
+
+    STATS_PUBLICAS = args.stats_publicas
+
+    if not os.path.exists(BASE_DATOS):
+        os.makedirs(BASE_DATOS)
+
+    # Antes de atender a nadie se aplica lo que quedara en los diarios (el
+    # único de un proceso y los de cada trabajador, de una ejecución anterior;
+    # si solo quedó el .viejo de un checkpoint, recuperar lo aplica igual)
+    for nombre in sorted({n.removesuffix(".viejo") for n in os.listdir(BASE_DATOS)}):
+        if nombre.startswith("diario.") and nombre.endswith(".log"):
+            recuperados = Diario(os.path.join(BASE_DATOS, nombre)).recuperar()
+            if recuperados:
+                print(f"[Servidor] Recuperadas {recuperados} escrituras de {nombre}.")
+
+    # Blobs que ya no usa nadie (sus usuarios han subido otra versión del MP3)
+    blobs, ocupados, liberados = ALMACEN.recoger()
+    print(f"[Servidor] Almacén de MP3: {blobs} ficheros, {ocupados / 1e6:.1f} MB"
+          + (f" ({liberados / 1e6:.1f} MB liberados)" if liberados else ""))
+
+    # La caché se reparte entre los trabajadores
+    CACHE_USUARIOS.max_usuarios = max(1, args.cache_usuarios // args.procesos)
+    CACHE_USUARIOS.max_bytes = args.cache_mb * 1024 * 1024 // args.procesos
+
+    if args.procesos > 1:
+        import procesos
+        reparto = procesos.Reparto(args.procesos)
+        procesos.arrancar(reparto, lambda n: trabajar(args, n, reparto))
+    else:
+        trabajar(args)
+
+
+def trabajar(args, proceso=0, reparto=None):
+    """Arranca el motor elegido en este proceso. Con varios procesos cada
+    trabajador escribe en su propio diario."""
+    global DIARIO, INDICE, PROCESO
+    PROCESO = proceso
+    nombre_diario = f"diario.{proceso}.log" if reparto else "diario.log"
+    DIARIO = Diario(os.path.join(BASE_DATOS, nombre_diario))
+    DIARIO.iniciar()
+    # Después del fork: cada proceso abre su propia conexión a SQLite
+    INDICE = IndiceFicheros(os.path.join(BASE_DATOS, NOMBRE_INDICE))
+
+    ESTADISTICAS.registrar_medidor("usuarios_conectados", "Usuarios con alguna sesión abierta", lambda: len(SESIONES))
+    ESTADISTICAS.registrar_medidor("hilos", "Hilos vivos del proceso", threading.active_count)
+    ESTADISTICAS.registrar_medidor("transferencias", "Tokens de conexiones de transferencia válidos",
+                                   lambda: len(TOKENS_TRANSFERENCIA))
+    ESTADISTICAS.registrar_medidor("cache_usuarios", "Caché de metadata", CACHE_USUARIOS.estadisticas)
+    ESTADISTICAS.registrar_medidor("diario", "Diario de escrituras", DIARIO.estadisticas)
+    ESTADISTICAS.registrar_medidor("indice", "Índice de ficheros", INDICE.estadisticas)
+    ESTADISTICAS.registrar_medidor("proceso", "Número de este proceso trabajador", lambda: PROCESO)
+    if args.stats_fichero:
+        ruta = f"{args.stats_fichero}.{proceso}" if reparto else args.stats_fichero
+        ESTADISTICAS.iniciar_volcado(ruta, args.stats_cada)
+
+    if args.modo == "asyncio":
+        import servidor_async
+        servidor_async.main(args.puerto, args.backlog, args.max_sesiones, args.hilos_io, reparto)
+    else:
+        servir_con_hilos(args.puerto, args.backlog, args.max_sesiones, reparto)
+
+
 if __name__ == "__main__":
+    # servidor_async hace "import servidor": que use este mismo módulo (y su
+    # estado global: diario, caché, estadísticas...) y no una segunda copia
+    sys.modules.setdefault("servidor", sys.modules[__name__])
     main()
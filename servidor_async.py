@@ -0,0 +1,216 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import servidor
+from estadisticas import MedidorSesion
+from protocolo import ConexionCerrada, ErrorProtocolo, TAM_BLOQUE_MP3, cabeceras_mp3, abrir_parcial, terminar_parcial, sin_nagle
+
+
+# MOTOR ASYNCIO
+#
+# Ejecuta el mismo protocolo que el motor de hilos (servidor.sesion_cliente)
+# sobre asyncio streams: todas las sesiones comparten un único hilo y solo la
+# E/S de disco (operaciones BLOQUEANTE y escritura/lectura de MP3) se manda a
+# un pool de hilos de tamaño fijo.
+
+
+class ConexionAsync:
+    """Equivalente asyncio de protocolo.Conexion (con los mismos contadores)."""
+
+    def __init__(self, reader, writer, tam_bloque=TAM_BLOQUE_MP3):
+        self.reader = reader
+        self.writer = writer
+        # Como en Conexion (asyncio ya lo suele poner, pero no en todas las versiones)
+        sin_nagle(writer.get_extra_info("socket"))
+        self.tam_bloque = tam_bloque
+        self.num_recv = 0
+        self.num_send = 0
+        self.bytes_recibidos = 0
+        self.bytes_enviados = 0
+
+    async def leer_linea(self):
+        self.num_recv += 1
+        linea = await self.reader.readline()
+        self.bytes_recibidos += len(linea)
+        return linea.decode().strip()
+
+    async def leer_datos(self, prefijo):
+        cabecera = await self.leer_linea()
+        if not cabecera.startswith(prefijo + ":"):
+            raise ErrorProtocolo(f"Protocolo inválido (se esperaba {prefijo})")
+        return await self.leer_exacto(int(cabecera.split(":")[1]))
+
+    async def leer_exacto(self, tam):
+        self.num_recv += 1
+        try:
+            datos = await self.reader.readexactly(tam)
+        except asyncio.IncompleteReadError as e:
+            raise ConexionCerrada(f"Se esperaban {tam} bytes y llegaron {len(e.partial)}")
+        self.bytes_recibidos += tam
+        return datos
+
+    async def enviar(self, datos):
+        self.writer.write(datos)
+        self.num_send += 1
+        self.bytes_enviados += len(datos)
+        await self.writer.drain()
+
+    async def enviar_mp3(self, ruta, desde=0):
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, ruta, "rb")
+        try:
+            size = os.fstat(f.fileno()).st_size
+            desde = min(desde, size)
+            await self.enviar(cabeceras_mp3(os.path.basename(ruta), size, desde))
+            if size > desde:
+                # loop.sendfile usa os.sendfile cuando el transporte lo permite
+                await loop.sendfile(self.writer.transport, f, desde, size - desde)
+                self.num_send += 1
+                self.bytes_enviados += size - desde
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    async def recibir_mp3(self, carpeta_destino, hashes=None):
+        header = await self.leer_linea()
+        desde = 0
+        if header.startswith("MP3_RANGE:"):
+            desde = int(header.split(":")[1])
+            header = await self.leer_linea()
+
+        if not header.startswith("MP3_SIZE:"):
+            return None
+        size = int(header.split(":")[1])
+
+        header = await self.leer_linea()
+        if not header.startswith("MP3_NAME:"):
+            return None
+        nombre = os.path.basename(header.split(":", 1)[1])
+
+        loop = asyncio.get_running_loop()
+        f, ruta_parcial, ruta = await loop.run_in_executor(
+            None, abrir_parcial, carpeta_destino, nombre, desde)
+        try:
+            restantes = size
+            while restantes > 0:
+                chunk = await self.reader.read(min(self.tam_bloque, restantes))
+                self.num_recv += 1
+                if not chunk:
+                    raise ConexionCerrada(f"Faltaban {restantes} bytes de {size}")
+                self.bytes_recibidos += len(chunk)
+                await loop.run_in_executor(None, f.write, chunk)
+                restantes -= len(chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+        hash_esperado = hashes.get(nombre) if hashes else None
+        return await loop.run_in_executor(
+            None, terminar_parcial, ruta_parcial, ruta, desde, hash_esperado)
+
+    async def cerrar(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def ejecutar_operacion(con, op, medidor):
+    """Ejecuta sin bloquear el bucle una operación pedida por sesion_cliente."""
+    tipo = op[0]
+    if tipo == servidor.FASE:
+        return medidor.empezar(op[1]) if op[1] else medidor.terminar()
+    if tipo == servidor.LEER_LINEA:
+        return await con.leer_linea()
+    if tipo == servidor.LEER_DATOS:
+        return await con.leer_datos(op[1])
+    if tipo == servidor.LEER_EXACTO:
+        return await con.leer_exacto(op[1])
+    if tipo == servidor.ENVIAR:
+        return await con.enviar(op[1])
+    if tipo == servidor.ENVIAR_MP3:
+        return await con.enviar_mp3(op[1], op[2])
+    if tipo == servidor.RECIBIR_MP3:
+        return await con.recibir_mp3(op[1], op[2])
+    if tipo == servidor.BLOQUEANTE:
+        return await asyncio.get_running_loop().run_in_executor(None, op[1], *op[2:])
+    raise ValueError(f"Operación desconocida: {tipo}")
+
+
+async def manejar_cliente(reader, writer, plazas):
+    addr = writer.get_extra_info("peername")
+
+    # Si ya hay max_sesiones en curso, esta conexión espera su turno
+    async with plazas:
+        print(f"[+] Conexión aceptada desde {addr}")
+
+        con = ConexionAsync(reader, writer)
+        medidor = MedidorSesion(servidor.ESTADISTICAS, con)
+        sesion = servidor.sesion_cliente(addr)
+        resultado = None
+        error = None
+
+        try:
+            while True:
+                try:
+                    if error is not None:
+                        op = sesion.throw(error)
+                    else:
+                        op = sesion.send(resultado)
+                except StopIteration:
+                    break
+
+                resultado = None
+                error = None
+                try:
+                    resultado = await ejecutar_operacion(con, op, medidor)
+                except Exception as e:
+                    error = e
+        finally:
+            medidor.terminar()
+            await con.cerrar()
+
+        print(f"[+] Conexión {addr} cerrada ({con.num_recv} recv, {con.num_send} send).")
+
+
+async def servir(puerto, backlog, max_sesiones, hilos_io, reparto=None):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=hilos_io))
+
+    plazas = asyncio.Semaphore(max_sesiones)
+
+    async def atender(reader, writer):
+        await manejar_cliente(reader, writer, plazas)
+
+    if reparto is not None:
+        # Varios procesos: el reparto (en sus propios hilos) acepta y mira la
+        # primera línea; las conexiones de nuestros usuarios pasan al bucle
+        async def atender_socket(sock):
+            reader, writer = await asyncio.open_connection(sock=sock)
+            await atender(reader, writer)
+
+        # El bucle solo guarda referencias débiles a las tareas
+        tareas = set()
+
+        def lanzar(sock):
+            tarea = asyncio.ensure_future(atender_socket(sock))
+            tareas.add(tarea)
+            tarea.add_done_callback(tareas.discard)
+
+        def entregar(sock, addr):
+            loop.call_soon_threadsafe(lanzar, sock)
+
+        threading.Thread(target=reparto.servir, args=(puerto, backlog, entregar), daemon=True).start()
+        await asyncio.Event().wait()
+        return
+
+    server = await asyncio.start_server(atender, "0.0.0.0", puerto, backlog=backlog)
+
+    print(f"[Servidor asyncio] Esperando conexiones en el puerto {puerto}...")
+
+    async with server:
+        await server.serve_forever()
+
+
+def main(puerto, backlog, max_sesiones, hilos_io, reparto=None):
+    asyncio.run(servir(puerto, backlog, max_sesiones, hilos_io, reparto))
@@ -0,0 +1,67 @@
+import threading
+
+
+class InfoUsuario:
+    """Estado compartido por todas las sesiones abiertas de un usuario:
+    - sesiones: cuántas hay abiertas (un usuario puede conectarse desde
+      varios dispositivos a la vez)
+    - cerrojo: serializa las subidas de metadata de ese usuario
+    - entrada: su EntradaUsuario mientras haya alguna sesión abierta, para
+      que todas trabajen sobre la misma aunque la caché la desaloje
+    """
+
+    def __init__(self):
+        self.sesiones = 0
+        self.cerrojo = threading.Lock()
+        self.entrada = None
+
+
+class TablaSesiones:
+    """Sesiones abiertas por usuario, segura entre hilos.
+    Los usuarios se reparten en 'franjas', cada una con su propio cerrojo,
+    para que los logins de usuarios distintos no compitan por uno solo.
+    """
+
+    def __init__(self, num_franjas=64):
+        self._franjas = [(threading.Lock(), {}) for _ in range(num_franjas)]
+
+    def _franja(self, usuario):
+        return self._franjas[hash(usuario) % len(self._franjas)]
+
+    def abrir(self, usuario):
+        """Registra una sesión más del usuario y devuelve su InfoUsuario."""
+        cerrojo, usuarios = self._franja(usuario)
+        with cerrojo:
+            info = usuarios.get(usuario)
+            if info is None:
+                info = usuarios[usuario] = InfoUsuario()
+            info.sesiones += 1
+            return info
+
+    def cerrar(self, usuario):
+        """Quita una sesión del usuario; con la última se olvida su estado."""
+        cerrojo, usuarios = self._franja(usuario)
+        with cerrojo:
+            info = usuarios.get(usuario)
+            if info is None:
+                return
+            info.sesiones -= 1
+            if info.sesiones <= 0:
+                del usuarios[usuario]
+
+    def sesiones(self, usuario):
+        cerrojo, usuarios = self._franja(usuario)
+        with cerrojo:
+            info = usuarios.get(usuario)
+            return info.sesiones if info else 0
+
+    def __contains__(self, usuario):
+        return self.sesiones(usuario) > 0
+
+    def __len__(self):
+        """Número de usuarios con alguna sesión abierta."""
+        total = 0
+        for cerrojo, usuarios in self._franjas:
+            with cerrojo:
+                total += len(usuarios)
+        return total
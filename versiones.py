@@ -0,0 +1,489 @@
+import json
+import os
+from pila import Pila
+from diario import REEMPLAZAR, ESCRIBIR, BORRAR, aplicar_escrituras
+
+
+# HISTORIAL DE VERSIONES DE LA BIBLIOTECA DE UN USUARIO
+#
+# En vez de un biblioteca_<timestamp>.json completo por versión, cada usuario
+# tiene dos ficheros que solo crecen por el final:
+#   versiones.log -> un registro JSON por versión: cada CADA_COMPLETA
+#                    versiones una copia completa ("completa") y entre medias
+#                    solo la diferencia con la versión anterior ("delta")
+#   versiones.idx -> una primera línea "log <fichero>" con el log en uso y
+#                    una línea por versión: "id tipo offset longitud fecha"
+# Para reconstruir la pila basta con leer el índice, y para recuperar una
+# versión se parte de la última completa anterior y se aplican sus deltas.
+# El id de cada versión es el número de versión de la biblioteca que ven los
+# clientes: la última es la que hay en biblioteca.json.
+# Si hay más de MAX_VERSIONES, se compactan los ficheros quedándose con las
+# más recientes.
+# Los cambios en disco se expresan como escrituras del diario (diario.py):
+# preparar() las devuelve para que el servidor las confirme junto con
+# biblioteca.json, y guardar() las aplica directamente. La memoria (índice,
+# última versión) no cambia hasta confirmar(), que se llama cuando las
+# escrituras ya son duraderas: si fallan, el historial sigue como estaba y
+# los deltas siguientes se calculan sobre lo que sí está en disco.
+
+NOMBRE_LOG = "versiones.log"
+NOMBRE_INDICE = "versiones.idx"
+
+CADA_COMPLETA = 20
+MAX_VERSIONES = 200
+
+
+# DIFERENCIAS ENTRE DOS BIBLIOTECAS (diccionarios de PlataformaMusical.to_dict)
+
+def _diferencias_por_clave(antes, despues, clave):
+    """Diferencia entre dos listas de dicts identificados por 'clave'.
+    Devuelve {"cambiados": [...], "borrados": [...]} y, si el orden final no
+    se puede deducir de eso, también "orden" con las claves en orden."""
+    previos = {e[clave]: e for e in antes}
+    actuales = {e[clave] for e in despues}
+
+    cambiados = [e for e in despues if previos.get(e[clave]) != e]
+    borrados = [k for k in previos if k not in actuales]
+    diff = {"cambiados": cambiados, "borrados": borrados}
+
+    # Orden que dejaría _aplicar_por_clave: los que siguen, y detrás los nuevos
+    orden = [e[clave] for e in despues]
+    if [k for k in previos if k in actuales] + [k for k in orden if k not in previos] != orden:
+        diff["orden"] = orden
+    return diff
+
+
+def _aplicar_por_clave(antes, diff, clave):
+    """Aplica una diferencia de _diferencias_por_clave. Los cambiados que ya
+    existían se sustituyen en su sitio y los nuevos van al final."""
+    borrados = set(diff["borrados"])
+    cambiados = {e[clave]: e for e in diff["cambiados"]}
+
+    resultado = []
+    for e in antes:
+        k = e[clave]
+        if k in borrados:
+            continue
+        resultado.append(cambiados.pop(k, e))
+    resultado.extend(cambiados.values())
+
+    if "orden" in diff:
+        por_clave = {e[clave]: e for e in resultado}
+        resultado = [por_clave[k] for k in diff["orden"]]
+    return resultado
+
+
+def diferencia(antes, despues):
+    return {
+        "canciones": _diferencias_por_clave(antes.get("canciones", []), despues.get("canciones", []), "id"),
+        "listas": _diferencias_por_clave(antes.get("listas", []), despues.get("listas", []), "nombre"),
+    }
+
+
+def aplicar_diferencia(antes, diff):
+    return {
+        "canciones": _aplicar_por_clave(antes.get("canciones", []), diff["canciones"], "id"),
+        "listas": _aplicar_por_clave(antes.get("listas", []), diff["listas"], "nombre"),
+    }
+
+
+# FUSIÓN A TRES BANDAS
+#
+# Cuando un dispositivo sube cambios hechos sobre una versión 'base' que ya
+# no es la actual (otro dispositivo subió antes), se combinan los cambios de
+# los dos respecto a la base:
+#   - canciones, campo a campo: si solo uno cambió un campo, gana ese cambio;
+#     si los dos lo cambiaron de forma distinta, es un conflicto
+#   - listas: las canciones que uno añadió o quitó se añaden o quitan en la
+#     del otro (nunca es conflicto)
+#   - borrar algo que el otro ha modificado es un conflicto
+# Las canciones nuevas de los dos lados con el mismo id (los dos usaron
+# max+1) se renumeran para que convivan.
+
+def _fusionar_campos(base, actual, mio, fusionar_campo=None):
+    """Fusiona dos modificaciones de un mismo dict. Devuelve None si chocan."""
+    resultado = dict(actual)
+    for campo, valor in mio.items():
+        anterior = base.get(campo)
+        if valor == anterior:
+            continue  # No lo he cambiado yo
+        if fusionar_campo is not None and campo in fusionar_campo:
+            resultado[campo] = fusionar_campo[campo](anterior, actual.get(campo), valor)
+        elif actual.get(campo) in (anterior, valor):
+            resultado[campo] = valor
+        else:
+            return None
+    return resultado
+
+
+def _fusionar_ids(base, actual, mio):
+    """Lista de ids de 'actual' con lo que 'mio' añadió y quitó respecto a 'base'."""
+    base, actual, mio = set(base or []), actual or [], mio or []
+    quitados = base - set(mio)
+    ya = base | set(actual)
+    anadidos = [i for i in mio if i not in ya]
+    return [i for i in actual if i not in quitados] + anadidos
+
+
+def _fusionar_por_clave(base, actual, mio, clave, fusionar_campo=None):
+    previos = {e[clave]: e for e in base}
+    actuales = {e[clave]: e for e in actual}
+    conflictos = []
+    nuevos = []
+
+    for e in mio:
+        k = e[clave]
+        if k in previos:
+            if e == previos[k]:
+                continue
+            if k not in actuales:
+                conflictos.append(k)  # Lo modifiqué y allí lo borraron
+                continue
+            fusion = _fusionar_campos(previos[k], actuales[k], e, fusionar_campo)
+            if fusion is None:
+                conflictos.append(k)
+            else:
+                actuales[k] = fusion
+        elif k in actuales:
+            if actuales[k] != e:
+                conflictos.append(k)  # Los dos crearon lo mismo de forma distinta
+        else:
+            nuevos.append(e)
+
+    mios = {e[clave] for e in mio}
+    for k, e in previos.items():
+        if k not in mios and k in actuales:
+            if actuales[k] == e:
+                del actuales[k]  # Lo borré y nadie más lo tocó
+            else:
+                conflictos.append(k)  # Lo borré y allí lo modificaron
+
+    resultado = [actuales[e[clave]] for e in actual if e[clave] in actuales] + nuevos
+    return resultado, conflictos
+
+
+def _renumerar_nuevas(base, actual, mio):
+    """Da id nuevo a las canciones nuevas de 'mio' cuyo id ya usa otra
+    canción nueva de 'actual'. Devuelve una copia de 'mio'."""
+    ids_base = {c["id"] for c in base.get("canciones", [])}
+    actuales = {c["id"]: c for c in actual.get("canciones", [])}
+    todas = [c["id"] for c in base.get("canciones", []) + actual.get("canciones", []) + mio.get("canciones", [])]
+    siguiente = max(todas, default=0) + 1
+
+    cambios = {}
+    canciones = []
+    for c in mio.get("canciones", []):
+        if c["id"] not in ids_base and c["id"] in actuales and actuales[c["id"]] != c:
+            cambios[c["id"]] = siguiente
+            c = dict(c, id=siguiente)
+            siguiente += 1
+        canciones.append(c)
+
+    listas = [
+        dict(l, canciones=[cambios.get(i, i) for i in l.get("canciones", [])])
+        for l in mio.get("listas", [])
+    ]
+    return {"canciones": canciones, "listas": listas}
+
+
+def fusionar(base, actual, mio):
+    """Fusión a tres bandas de bibliotecas (diccionarios). Devuelve
+    (resultado, conflictos); conflictos es None si no hay, o un dict con los
+    ids de canción y nombres de lista que chocan."""
+    mio = _renumerar_nuevas(base, actual, mio)
+
+    canciones, conflictos_canciones = _fusionar_por_clave(
+        base.get("canciones", []), actual.get("canciones", []), mio["canciones"], "id")
+    listas, conflictos_listas = _fusionar_por_clave(
+        base.get("listas", []), actual.get("listas", []), mio["listas"], "nombre",
+        {"canciones": _fusionar_ids})
+
+    if conflictos_canciones or conflictos_listas:
+        return None, {"canciones": conflictos_canciones, "listas": conflictos_listas}
+
+    # Las listas no pueden apuntar a canciones que ya no existen
+    ids = {c["id"] for c in canciones}
+    listas = [dict(l, canciones=[i for i in l.get("canciones", []) if i in ids]) for l in listas]
+    return {"canciones": canciones, "listas": listas}, None
+
+
+# HISTORIAL EN DISCO
+
+class EntradaIndice:
+    def __init__(self, id, tipo, offset, longitud, fecha):
+        self.id = id
+        self.tipo = tipo
+        self.offset = offset
+        self.longitud = longitud
+        self.fecha = fecha
+
+    def linea(self):
+        return f"{self.id} {self.tipo} {self.offset} {self.longitud} {self.fecha}\n"
+
+
+def _tam_log(indice):
+    if not indice:
+        return 0
+    return indice[-1].offset + indice[-1].longitud
+
+
+class HistorialVersiones:
+    """Versiones de la biblioteca de un usuario (la última es la actual).
+    pila es una Pila con los ids de versión (la cima es la más reciente).
+    """
+
+    def __init__(self, carpeta_usuario, migrar=True):
+        self.carpeta = carpeta_usuario
+        self.nombre_log = NOMBRE_LOG
+        self.ruta_indice = os.path.join(carpeta_usuario, NOMBRE_INDICE)
+        self.indice = []       # EntradaIndice en orden
+        self.tam_indice = 0    # Bytes de versiones.idx
+        self.pila = Pila()
+        self._ultima = None    # Diccionario de la última versión (se calcula al necesitarlo)
+        self._preparada = None  # Estado en memoria tras la última preparar(), hasta confirmar()
+
+        self._cargar_indice()
+        if migrar:
+            self._migrar_versiones_antiguas()
+
+    @property
+    def ruta_log(self):
+        return os.path.join(self.carpeta, self.nombre_log)
+
+    @property
+    def tam_log(self):
+        """Bytes válidos del log (lo que haya detrás lo pisa la siguiente versión)."""
+        return _tam_log(self.indice)
+
+    def _cargar_indice(self):
+        if not os.path.exists(self.ruta_indice):
+            primera = f"log {self.nombre_log}\n"
+            with open(self.ruta_indice, "w", encoding="utf-8") as f:
+                f.write(primera)
+                # Las líneas siguientes se escriben en offsets fijos (también
+                # al repetir el diario), así que la primera tiene que estar
+                f.flush()
+                os.fsync(f.fileno())
+            self.tam_indice = len(primera.encode())
+            return
+
+        with open(self.ruta_indice, "r+", encoding="utf-8") as f:
+            contenido = f.read()
+            if not contenido.endswith("\n"):
+                # Última línea a medio escribir por una caída: se descarta
+                contenido = contenido[:contenido.rfind("\n") + 1]
+                f.seek(0)
+                f.truncate()
+                f.write(contenido)
+
+        self.tam_indice = len(contenido.encode())
+        lineas = contenido.splitlines()
+        self.nombre_log = lineas[0].split()[1]
+        for linea in lineas[1:]:
+            id_version, tipo, offset, longitud, fecha = linea.split()
+            self.indice.append(EntradaIndice(int(id_version), tipo, int(offset), int(longitud), fecha))
+
+        for entrada in self.indice:
+            self.pila.apilar(entrada.id)
+
+    def _migrar_versiones_antiguas(self):
+        """Pasa al log los biblioteca_<timestamp>.json del formato anterior
+        (en orden cronológico) y después los borra."""
+        antiguas = sorted(
+            nombre for nombre in os.listdir(self.carpeta)
+            if nombre.startswith("biblioteca_") and nombre.endswith(".json")
+        )
+        if not antiguas:
+            return
+
+        for nombre in antiguas:
+            with open(os.path.join(self.carpeta, nombre), "r", encoding="utf-8") as f:
+                contenido = f.read()
+            self.guardar(contenido, nombre[len("biblioteca_"):-len(".json")])
+
+        for nombre in antiguas:
+            os.remove(os.path.join(self.carpeta, nombre))
+
+    def __len__(self):
+        return len(self.indice)
+
+    @property
+    def ultima(self):
+        """Id de la última versión (0 si no hay ninguna)."""
+        return self.indice[-1].id if self.indice else 0
+
+    def es_ultima(self, contenido):
+        """True si 'contenido' es lo mismo que la última versión guardada."""
+        if not self.indice:
+            return False
+        try:
+            return json.loads(contenido) == self._ultima_version()
+        except ValueError:
+            return self.leer(self.ultima) == contenido
+
+    # LECTURA
+
+    def _leer_registro(self, entrada):
+        with open(self.ruta_log, "rb") as f:
+            f.seek(entrada.offset)
+            return json.loads(f.read(entrada.longitud).decode())
+
+    def leer(self, id_version):
+        """Devuelve el texto JSON de una versión."""
+        posicion = next((i for i, e in enumerate(self.indice) if e.id == id_version), None)
+        if posicion is None:
+            raise KeyError(f"No existe la versión {id_version}")
+
+        # Buscar hacia atrás la última copia completa
+        inicio = posicion
+        while self.indice[inicio].tipo == "delta":
+            inicio -= 1
+
+        registro = self._leer_registro(self.indice[inicio])
+        if registro["tipo"] == "texto":
+            return registro["datos"]
+
+        data = registro["datos"]
+        for entrada in self.indice[inicio + 1:posicion + 1]:
+            data = aplicar_diferencia(data, self._leer_registro(entrada)["datos"])
+        return json.dumps(data)
+
+    def _ultima_version(self):
+        if self._ultima is None and self.indice:
+            try:
+                self._ultima = json.loads(self.leer(self.indice[-1].id))
+            except ValueError:
+                self._ultima = None
+        return self._ultima
+
+    # ESCRITURA
+
+    def guardar(self, contenido, fecha):
+        """Añade 'contenido' (texto JSON de una biblioteca) como nueva versión
+        escribiéndola directamente en disco."""
+        id_version, escrituras = self.preparar(contenido, fecha)
+        aplicar_escrituras(escrituras)
+        self.confirmar()
+        return id_version
+
+    def preparar(self, contenido, fecha):
+        """Prepara 'contenido' como nueva versión y devuelve (id, escrituras)
+        con lo que hay que escribir en disco. El historial en memoria no
+        cambia hasta confirmar(), que hay que llamar cuando las escrituras
+        ya estén aplicadas (y antes de la siguiente preparar)."""
+        escrituras = []
+        nombre_log, indice, tam_indice = self.nombre_log, self.indice, self.tam_indice
+
+        # Se compacta antes de añadir, así lo que se lee del log ya está en disco
+        if len(indice) >= MAX_VERSIONES + CADA_COMPLETA:
+            nombre_log, indice, tam_indice = self._compactado(escrituras)
+
+        id_version = indice[-1].id + 1 if indice else 1
+
+        try:
+            data = json.loads(contenido)
+        except ValueError:
+            data = None
+
+        if not isinstance(data, dict):
+            # No es una biblioteca válida: se guarda el texto tal cual como copia completa
+            registro = {"id": id_version, "tipo": "texto", "datos": contenido}
+            data = None
+        else:
+            desde_completa = 0
+            for entrada in reversed(indice):
+                if entrada.tipo != "delta":
+                    break
+                desde_completa += 1
+
+            registro = {"id": id_version, "tipo": "completa", "datos": data}
+
+            anterior = self._ultima_version()
+            if anterior is not None and desde_completa + 1 < CADA_COMPLETA:
+                try:
+                    diff = diferencia(anterior, data)
+                    # Con claves repetidas u otros datos raros la diferencia no
+                    # reproduce la versión: en ese caso se guarda completa
+                    if aplicar_diferencia(anterior, diff) == data:
+                        registro = {"id": id_version, "tipo": "delta", "datos": diff}
+                except (KeyError, TypeError, AttributeError):
+                    pass
+
+        # Registro al final del log y su línea al final del índice
+        datos = json.dumps(registro).encode()
+        entrada = EntradaIndice(id_version, registro["tipo"], _tam_log(indice), len(datos), fecha)
+        linea = entrada.linea().encode()
+        escrituras.append((ESCRIBIR, os.path.join(self.carpeta, nombre_log), entrada.offset, datos))
+        escrituras.append((ESCRIBIR, self.ruta_indice, tam_indice, linea))
+
+        self._preparada = (nombre_log, indice + [entrada], tam_indice + len(linea), data)
+        return id_version, escrituras
+
+    def confirmar(self):
+        """Pasa a memoria la versión de la última preparar() (sus escrituras
+        ya están en disco)."""
+        if self._preparada is None:
+            return
+        nombre_log, indice, tam_indice, data = self._preparada
+        self._preparada = None
+
+        compactado = nombre_log != self.nombre_log
+        self.nombre_log = nombre_log
+        self.indice = indice
+        self.tam_indice = tam_indice
+        self._ultima = data
+        if compactado:
+            self.pila = Pila()
+            for entrada in self.indice:
+                self.pila.apilar(entrada.id)
+        else:
+            self.pila.apilar(indice[-1].id)
+
+    def _compactado(self, escrituras):
+        """Escrituras (que se añaden a 'escrituras') y nuevo (nombre del log,
+        índice, tamaño del índice) para quedarse con las MAX_VERSIONES más
+        recientes. La más antigua que se conserva pasa a ser copia completa.
+        El log nuevo se escribe con otro nombre y el índice nuevo (que lo
+        nombra en su primera línea) se reemplaza encima del viejo: hasta ese
+        momento sigue valiendo el historial anterior, así una caída no lo deja
+        a medias."""
+        conservar = self.indice[-MAX_VERSIONES:]
+        nombre_log_nuevo = f"versiones_{conservar[0].id}.log"
+        nuevo_indice = []
+        partes = []
+        offset = 0
+
+        for i, entrada in enumerate(conservar):
+            registro = self._leer_registro(entrada)
+            if i == 0 and registro["tipo"] == "delta":
+                registro = {"id": entrada.id, "tipo": "completa", "datos": json.loads(self.leer(entrada.id))}
+            datos = json.dumps(registro).encode()
+            nuevo_indice.append(EntradaIndice(entrada.id, registro["tipo"], offset, len(datos), entrada.fecha))
+            partes.append(datos)
+            offset += len(datos)
+
+        texto_indice = f"log {nombre_log_nuevo}\n" + "".join(e.linea() for e in nuevo_indice)
+        texto_indice = texto_indice.encode()
+
+        escrituras.extend([
+            (REEMPLAZAR, os.path.join(self.carpeta, nombre_log_nuevo), b"".join(partes)),
+            (REEMPLAZAR, self.ruta_indice, texto_indice),
+            (BORRAR, self.ruta_log),
+        ])
+        return nombre_log_nuevo, nuevo_indice, len(texto_indice)
+
+    def compactar(self):
+        """Se queda con las MAX_VERSIONES más recientes (ver _compactado),
+        escribiendo directamente en disco."""
+        if len(self.indice) <= MAX_VERSIONES:
+            return
+        escrituras = []
+        nombre_log, indice, tam_indice = self._compactado(escrituras)
+        aplicar_escrituras(escrituras)
+
+        self.nombre_log = nombre_log
+        self.tam_indice = tam_indice
+        self.indice = indice
+        self.pila = Pila()
+        for entrada in self.indice:
+            self.pila.apilar(entrada.id)